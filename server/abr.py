@@ -0,0 +1,229 @@
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, asdict
+from typing import Dict, Optional, Any
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GstWebRTC', '1.0')
+from gi.repository import Gst, GstWebRTC
+
+from .glib_loop import glib_loop
+
+LOG = logging.getLogger("abr")
+
+# Congestion thresholds (worst viewer wins: the encoder is shared)
+LOSS_BAD = 0.10       # fraction lost → step down hard
+LOSS_OK = 0.03        # below this the link counts as clean
+RTT_BAD = 0.50        # seconds
+RTT_OK = 0.25
+PLI_BAD = 2           # PLIs per interval (decoder keeps losing sync)
+STEP_DOWN = 0.75
+STEP_UP = 1.10
+CLEAN_TICKS_TO_RAISE = 3  # hysteresis: consecutive clean intervals before stepping up
+MIN_CHANGE = 0.05         # ignore retargets smaller than this (relative)
+AVAILABLE_HEADROOM = 0.85 # fraction of available-outgoing-bitrate we allow ourselves
+
+@dataclass
+class ViewerStats:
+    rtt: Optional[float] = None
+    fraction_lost: Optional[float] = None
+    nack_count: int = 0
+    pli_count: int = 0
+    available_bitrate: Optional[float] = None
+    nack_delta: int = 0
+    pli_delta: int = 0
+    updated: float = 0.0
+    poll: int = 0             # the tick whose get-stats request this reply answers
+
+def _field(s: Gst.Structure, name: str):
+    return s.get_value(name) if s.has_field(name) else None
+
+def parse_webrtc_stats(reply: Gst.Structure, prev: Optional[ViewerStats] = None) -> ViewerStats:
+    """Flatten the nested webrtcbin get-stats structure into the few numbers ABR cares about."""
+    out = ViewerStats(updated=time.monotonic())
+
+    def _visit(_field_id, value, _udata):
+        if not isinstance(value, Gst.Structure):
+            return True
+        typ = _field(value, "type")
+        if typ == GstWebRTC.WebRTCStatsType.REMOTE_INBOUND_RTP:
+            rtt = _field(value, "round-trip-time")
+            if rtt is not None: out.rtt = max(out.rtt or 0.0, float(rtt))
+            fl = _field(value, "fraction-lost")
+            if fl is not None: out.fraction_lost = max(out.fraction_lost or 0.0, float(fl))
+        elif typ == GstWebRTC.WebRTCStatsType.OUTBOUND_RTP:
+            out.nack_count += int(_field(value, "nack-count") or 0)
+            out.pli_count += int(_field(value, "pli-count") or 0)
+        elif typ == GstWebRTC.WebRTCStatsType.CANDIDATE_PAIR:
+            avail = _field(value, "available-outgoing-bitrate")
+            if avail: out.available_bitrate = float(avail)
+        return True
+
+    reply.foreach(_visit, None)
+    if prev is not None:
+        out.nack_delta = max(0, out.nack_count - prev.nack_count)
+        out.pli_delta = max(0, out.pli_count - prev.pli_count)
+    return out
+
+class BitrateController:
+    """
+    Polls every attached webrtcbin's get-stats and retargets the shared encoder
+    (and optionally the frame rate) within [abr.min_bitrate, abr.max_bitrate].
+    Steps down quickly on loss/RTT/PLI, steps up only after a run of clean intervals.
+    """
+    def __init__(self, capture):
+        self.capture = capture
+        self._webrtcs: Dict[str, Gst.Element] = {}
+        self._stats: Dict[str, ViewerStats] = {}
+        self._lock = threading.Lock()
+        self._source: Optional[int] = None
+        self._clean_ticks = 0
+        self._poll = 0
+        self.target_bitrate = 0
+        self.fps = 0
+        self.last_reason = "initial"
+        self.history = deque(maxlen=20)
+        self.reset()
+
+    @property
+    def abr_cfg(self):
+        return self.capture.cfg.abr
+
+    def reset(self) -> None:
+        v = self.capture.cfg.video
+        self.target_bitrate = int(v.bitrate)
+        self.fps = int(v.fps)
+        self._clean_ticks = 0
+        self.last_reason = "initial"
+
+    # ---- viewers ----
+    def register(self, name: str, webrtc: Gst.Element) -> None:
+        with self._lock:
+            self._webrtcs[name] = webrtc
+
+    def unregister(self, name: str) -> None:
+        with self._lock:
+            self._webrtcs.pop(name, None)
+            self._stats.pop(name, None)
+
+    # ---- polling (GLib timeout on the main loop thread) ----
+    def start(self) -> None:
+        if not self.abr_cfg.enabled or self._source is not None:
+            return
+        self._source = glib_loop().timeout(self.abr_cfg.interval_ms, self._on_timeout)
+
+    def stop(self) -> None:
+        if self._source is not None:
+            glib_loop().cancel(self._source)
+        self._source = None
+
+    def _on_timeout(self) -> bool:
+        try:
+            self.tick()
+        except Exception as e:
+            LOG.warning("ABR tick failed: %s", e)
+        return self._source is not None
+
+    def tick(self) -> None:
+        """Decide on the replies to the last tick's requests, then ask for fresh ones."""
+        self._decide()
+        with self._lock:
+            self._poll += 1
+            poll = self._poll
+            targets = list(self._webrtcs.items())
+        for name, webrtc in targets:
+            webrtc.emit("get-stats", None, Gst.Promise.new_with_change_func(self._on_stats, (name, poll)))
+
+    def _on_stats(self, promise: Gst.Promise, req: tuple) -> None:
+        # Runs on a webrtcbin thread. The reply is owned by the promise, so flatten it here
+        # and only hand the parsed numbers over (the next tick reads them on the GLib thread).
+        name, poll = req
+        reply = promise.get_reply()
+        if reply is None:
+            return
+        with self._lock:
+            if name not in self._webrtcs or poll != self._poll:
+                return  # viewer gone, or a late reply to an earlier tick
+            stats = parse_webrtc_stats(reply, self._stats.get(name))
+            stats.poll = poll
+            self._stats[name] = stats
+
+    # ---- control law ----
+    def _decide(self) -> None:
+        # Only viewers that answered the previous tick: one that stopped answering get-stats
+        # must not keep steering the encoder with its last reply
+        with self._lock:
+            fresh = [s for s in self._stats.values() if s.poll == self._poll]
+        if not fresh:
+            return
+        a = self.abr_cfg
+        loss = max((s.fraction_lost or 0.0) for s in fresh)
+        rtt = max((s.rtt or 0.0) for s in fresh)
+        plis = max(s.pli_delta for s in fresh)
+        avail = [s.available_bitrate for s in fresh if s.available_bitrate]
+
+        target, fps, reason = self.target_bitrate, self.fps, None
+        if loss > LOSS_BAD or rtt > RTT_BAD or plis >= PLI_BAD:
+            self._clean_ticks = 0
+            target = int(target * STEP_DOWN)
+            reason = f"congestion (loss={loss:.2f} rtt={rtt*1000:.0f}ms pli={plis})"
+            if a.adapt_fps and self.target_bitrate <= a.min_bitrate:
+                fps = max(a.min_fps, int(fps * STEP_DOWN))
+        elif loss > LOSS_OK or rtt > RTT_OK:
+            self._clean_ticks = 0
+        else:
+            self._clean_ticks += 1
+            if self._clean_ticks >= CLEAN_TICKS_TO_RAISE:
+                self._clean_ticks = 0
+                if fps < self.capture.cfg.video.fps:
+                    fps = min(self.capture.cfg.video.fps, max(fps + 1, int(fps * STEP_UP)))
+                    reason = f"clean link (loss={loss:.2f} rtt={rtt*1000:.0f}ms), restoring fps"
+                else:
+                    target = int(target * STEP_UP)
+                    reason = f"clean link (loss={loss:.2f} rtt={rtt*1000:.0f}ms)"
+
+        if avail:
+            cap = int(min(avail) * AVAILABLE_HEADROOM)
+            if cap < target:
+                target = cap
+                reason = f"available-outgoing-bitrate {min(avail)/1000:.0f}kbps"
+
+        target = max(a.min_bitrate, min(a.max_bitrate, target))
+        if abs(target - self.target_bitrate) < MIN_CHANGE * self.target_bitrate:
+            target = self.target_bitrate
+        if target != self.target_bitrate or fps != self.fps:
+            self._apply(target, fps, reason or "bounds")
+
+    def _apply(self, target: int, fps: int, reason: str) -> None:
+        """Retarget the encoder/rate cap; only changes that took effect are recorded."""
+        applied = False
+        if target != self.target_bitrate and self.capture.set_bitrate(target):
+            self.target_bitrate = target
+            applied = True
+        if fps != self.fps and self.capture.set_max_framerate(fps):
+            self.fps = fps
+            applied = True
+        if not applied:
+            LOG.warning("ABR could not apply %d bps @ %d fps (%s)", target, fps, reason)
+            return
+        self.last_reason = reason
+        self.history.append({"t": time.time(), "bitrate": self.target_bitrate, "fps": self.fps, "reason": reason})
+        LOG.info("ABR → %d bps @ %d fps: %s", self.target_bitrate, self.fps, reason)
+
+    def snapshot(self) -> Dict[str, Any]:
+        a = self.abr_cfg
+        with self._lock:
+            viewers = {name: asdict(s) for name, s in self._stats.items()}
+        return {
+            "enabled": a.enabled,
+            "target_bitrate": self.target_bitrate,
+            "fps": self.fps,
+            "min_bitrate": a.min_bitrate,
+            "max_bitrate": a.max_bitrate,
+            "last_reason": self.last_reason,
+            "history": list(self.history),
+            "viewers": viewers,
+        }
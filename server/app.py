@@ -1,11 +1,27 @@
+import time
+T_IMPORT = time.monotonic()  # startup time (import → listening) is measured from here
+
 import asyncio
+import dataclasses
 import json
 import logging
+import math
+import signal
+import uuid
 from pathlib import Path
+from typing import Dict, Optional
 from aiohttp import web, WSMsgType
 
-from .config import load_config, save_config, config_to_public_json
-from .webrtc_gst import WebRTCBroadcaster
+from .config import all_media_cpus, config_diff, config_store, config_to_public_json, stream_config
+from .encoders import REGISTRY
+from .glib_loop import glib_loop, SignalingQueue
+from .metrics import merge_expositions
+from .pipeline import CapturePipeline, get_capture
+from .preflight import PREFLIGHT
+from .recorder import safe_name
+from .sched import pin_process
+from .sessions import SESSIONS
+from .webrtc_gst import WebRTCBroadcaster, sdp_codecs
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
 LOG = logging.getLogger("app")
@@ -13,8 +29,57 @@ LOG = logging.getLogger("app")
 ROOT = Path(__file__).resolve().parent.parent
 STATIC_DIR = ROOT / "server" / "static"
 
-# Track active broadcasters for live tweaks
+# Track active viewer sessions (each stream's viewers share that stream's capture pipeline)
 _ACTIVE = set()
+# WHEP sessions by resource id (also in _ACTIVE)
+_WHEP: Dict[str, WebRTCBroadcaster] = {}
+# How long a WHEP POST waits for ICE gathering before answering with the candidates it has
+WHEP_ANSWER_TIMEOUT = 2.0
+# How long a disconnect waits for a session's teardown before moving on without it
+SESSION_STOP_TIMEOUT = 5.0
+# How long a request that needs GStreamer waits for it to finish initializing
+GST_WAIT_TIMEOUT = 30.0
+# Served without GStreamer, so the UI, config and readiness answer while it initializes
+NO_GST_PATHS = ("/", "/settings", "/api/config", "/api/ready", "/api/sessions")
+
+@web.middleware
+async def _wait_for_gst(request: web.Request, handler):
+    ready = request.app.get("gst_ready")
+    if ready is None or request.path in NO_GST_PATHS or request.path.startswith("/static/"):
+        return await handler(request)
+    if not ready.is_set():
+        try:
+            await asyncio.wait_for(ready.wait(), GST_WAIT_TIMEOUT)
+        except asyncio.TimeoutError:
+            return web.json_response({"ok": False, "error": "GStreamer still starting"}, status=503, headers={"Retry-After": "1"})
+    if PREFLIGHT.status == "failed":
+        return web.json_response({"ok": False, "error": f"GStreamer unavailable: {PREFLIGHT.error}"}, status=503)
+    return await handler(request)
+
+async def _stop_session(bc: WebRTCBroadcaster) -> None:
+    """
+    Run bc.stop() on a worker thread (it blocks until the tee pad is idle; keep it off both
+    the event loop and the GLib thread) and wait at most SESSION_STOP_TIMEOUT for it.
+    """
+    fut = asyncio.get_running_loop().run_in_executor(None, bc.stop)
+    try:
+        await asyncio.wait_for(asyncio.shield(fut), SESSION_STOP_TIMEOUT)
+    except asyncio.TimeoutError:
+        SESSIONS.stop_timed_out(bc.name)
+    except Exception as e:
+        LOG.warning("%s stop failed: %s", bc.name, e)
+
+def _stream_name(request: web.Request, cfg, default: Optional[str] = None) -> str:
+    """?stream= (else default, else the first configured stream); 404 for names not in config.yaml."""
+    want = request.query.get("stream") or default or None
+    try:
+        return cfg.stream(want).name
+    except KeyError:
+        raise web.HTTPNotFound(text=f"unknown stream {want!r}")
+
+def _capture(request: web.Request) -> CapturePipeline:
+    cfg = config_store().get()
+    return get_capture(cfg, _stream_name(request, cfg))
 
 async def index(request: web.Request) -> web.StreamResponse:
     return web.FileResponse(STATIC_DIR / "index.html")
@@ -23,96 +88,381 @@ async def settings_page(request: web.Request) -> web.StreamResponse:
     return web.FileResponse(STATIC_DIR / "settings.html")
 
 async def get_config(request: web.Request) -> web.StreamResponse:
-    return web.json_response(config_to_public_json(load_config()))
+    cfg = config_store().get()
+    name = _stream_name(request, cfg)
+    return web.json_response({"stream": name, **config_to_public_json(stream_config(cfg, name))})
 
 async def post_config(request: web.Request) -> web.StreamResponse:
     try:
         body = await request.json()
     except Exception:
         return web.json_response({"ok": False, "error": "invalid json"}, status=400)
-
-    cfg = load_config()
     v_in = body.get("video") or {}
-    changed = {}
-
-    # Live-applicable
-    if "mirror" in v_in:
-        cfg.video.mirror = str(v_in["mirror"])
-        changed["mirror"] = cfg.video.mirror
-    if "rotate" in v_in:
-        try: cfg.video.rotate = int(v_in["rotate"])
-        except Exception: cfg.video.rotate = 0
-        if cfg.video.rotate not in (0,90,180,270): cfg.video.rotate = 0
-        changed["rotate"] = cfg.video.rotate
-
-    # Non-live (require reconnect)
-    for k in ("width","height","fps","bitrate"):
-        if k in v_in:
-            setattr(cfg.video, k, int(v_in[k]))
-            changed[k] = getattr(cfg.video, k)
-
-    save_config(cfg)
-
-    # Apply live: mirror & rotate
-    applied = {"mirror": 0, "rotate": 0}
-    for bc in list(_ACTIVE):
-        try:
-            if "mirror" in changed and bc.apply_mirror(cfg.video.mirror): applied["mirror"] += 1
-            if "rotate" in changed and bc.apply_rotate(cfg.video.rotate): applied["rotate"] += 1
-        except Exception:
-            pass
+    old = config_store().get()
+    name = _stream_name(request, old, str(body.get("stream") or ""))
+
+    def _mutate(cfg):
+        v = cfg.stream(name).video
+        if "mirror" in v_in:
+            v.mirror = str(v_in["mirror"])
+        if "rotate" in v_in:
+            try: v.rotate = int(v_in["rotate"])
+            except Exception: v.rotate = 0
+        for k in ("width","height","fps","bitrate"):
+            if k in v_in:
+                setattr(v, k, int(v_in[k]))
+
+    capture = get_capture(old, name)
+    capture.format_rollback = None
+    # Validated, written atomically and pushed to subscribers (the stream's pipeline applies
+    # mirror/rotate/format/bitrate live) on a worker thread, off the event loop.
+    try:
+        cfg, _diff, live = await asyncio.get_running_loop().run_in_executor(None, config_store().update, _mutate)
+    except (TypeError, ValueError, KeyError) as e:
+        return web.json_response({"ok": False, "error": str(e)}, status=400)
+    changed = config_diff(stream_config(old, name), stream_config(cfg, name)).get("video", {})
+    applied = {k: live.get(k, 0) for k in ("mirror","rotate","width","height","fps","bitrate")}
+    # A running source that would not take the new format was put back on the old one, and
+    # the pipeline amended the config to match: cfg is that final snapshot, so `changed`
+    # no longer lists the format keys
+    rollback = capture.format_rollback
+    if rollback:
+        return web.json_response({"ok": False, "stream": name, "error": "format change failed and was rolled back",
+                                  "rolled_back": rollback, "changed": changed, "live_applied_to": applied,
+                                  "config": config_to_public_json(stream_config(cfg, name))}, status=409)
+    return web.json_response({"ok": True, "stream": name, "changed": changed, "live_applied_to": applied,
+                              "config": config_to_public_json(stream_config(cfg, name))})
+
+async def get_abr(request: web.Request) -> web.StreamResponse:
+    return web.json_response(_capture(request).abr.snapshot())
+
+async def get_encoders(request: web.Request) -> web.StreamResponse:
+    capture = _capture(request)
+    video, enc = capture.cfg.video, capture.encoder
+    return web.json_response({
+        "configured": video.encoder,
+        "active": {"element": enc.element, "codec": enc.codec} if enc else None,
+        **REGISTRY.summary(video),
+    })
+
+async def get_overlay(request: web.Request) -> web.StreamResponse:
+    return web.json_response(_capture(request).overlay.snapshot())
+
+async def post_overlay(request: web.Request) -> web.StreamResponse:
+    try:
+        body = await request.json()
+        if not isinstance(body, dict):
+            raise ValueError
+        if body.get("distance_m") is not None:
+            float(body["distance_m"])
+    except Exception:
+        return web.json_response({"ok": False, "error": "invalid json"}, status=400)
+    overlay = _capture(request).overlay
+    overlay.update(body)
+    return web.json_response({"ok": True, **overlay.snapshot()})
+
+async def get_scene(request: web.Request) -> web.StreamResponse:
+    return web.json_response(_capture(request).scene.snapshot())
+
+async def get_sched(request: web.Request) -> web.StreamResponse:
+    return web.json_response(_capture(request).sched.snapshot())
+
+async def get_ready(request: web.Request) -> web.StreamResponse:
+    snap = PREFLIGHT.snapshot()
+    return web.json_response(snap, status=200 if snap["ready"] else 503)
+
+async def get_sessions(request: web.Request) -> web.StreamResponse:
+    return web.json_response(SESSIONS.snapshot())
+
+async def metrics(request: web.Request) -> web.StreamResponse:
+    cfg = config_store().get()
+    # One family per metric; with a streams section every pipeline sample carries stream="…"
+    parts = [({"stream": n} if cfg.streams else {}, get_capture(cfg, n).render_metrics()) for n in cfg.stream_names()]
+    body = merge_expositions(parts) + "\n".join(SESSIONS.render()) + "\n"
+    return web.Response(body=body.encode(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match against our (strong) ETag: weak comparison, comma list or "*" (RFC 9110 13.1.2)."""
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or (tag[2:] if tag.startswith("W/") else tag) == etag:
+            return True
+    return False
+
+async def snapshot(request: web.Request) -> web.StreamResponse:
+    # Served only from a running pipeline: snapshot polling never opens the camera
+    capture = _capture(request)
+    if not capture.running:
+        return web.Response(status=503, text="camera not running")
+    headers = {"Cache-Control": "no-cache"}
+    res = await asyncio.get_running_loop().run_in_executor(None, capture.snapshot.latest_jpeg)
+    if res is None:
+        return web.Response(status=503, text="no frame yet", headers=headers)
+    etag, jpeg = res
+    headers["ETag"] = etag
+    if _etag_matches(request.headers.get("If-None-Match"), etag):
+        return web.Response(status=304, headers=headers)
+    return web.Response(body=jpeg, content_type="image/jpeg", headers=headers)
+
+async def recordings_list(request: web.Request) -> web.StreamResponse:
+    return web.json_response(_capture(request).recorder.summary())
+
+async def recordings_trigger(request: web.Request) -> web.StreamResponse:
+    try:
+        body = await request.json() if request.can_read_body else {}
+        if not isinstance(body, dict):
+            raise ValueError
+    except Exception:
+        return web.json_response({"ok": False, "error": "invalid json"}, status=400)
+    for k in ("pre_s", "post_s"):
+        val = body.get(k)
+        if val is not None and (isinstance(val, bool) or not isinstance(val, (int, float)) or not math.isfinite(val)):
+            return web.json_response({"ok": False, "error": f"{k} must be a number of seconds"}, status=400)
+    capture = _capture(request)
+    if not capture.cfg.recording.enabled:
+        return web.json_response({"ok": False, "error": "recording disabled"}, status=409)
+    try:
+        clip = capture.recorder.trigger(str(body.get("label", "")), body.get("pre_s"), body.get("post_s"))
+    except RuntimeError as e:
+        return web.json_response({"ok": False, "error": str(e)}, status=503)
+    return web.json_response({"ok": True, "name": clip.name, "pre_s": clip.pre_s, "post_s": clip.post_s}, status=202)
 
-    return web.json_response({"ok": True, "changed": changed, "live_applied_to": applied, "config": config_to_public_json(cfg)})
+async def recordings_download(request: web.Request) -> web.StreamResponse:
+    recorder = _capture(request).recorder
+    name = safe_name(request.match_info["name"])
+    path = recorder.out_dir / name if name else None
+    if path is None or path.suffix not in (".webm", ".mkv") or not path.is_file():
+        raise web.HTTPNotFound()
+    return web.FileResponse(path, headers={"Content-Disposition": f'attachment; filename="{name}"'})
 
 async def ws_handler(request: web.Request) -> web.StreamResponse:
+    cfg = config_store().get()
+    capture = get_capture(cfg, _stream_name(request, cfg))
     ws = web.WebSocketResponse()
     await ws.prepare(request)
 
-    cfg = load_config()
-    loop = asyncio.get_running_loop()
-
-    def send_json(payload):
-        try:
-            asyncio.run_coroutine_threadsafe(ws.send_str(json.dumps(payload)), loop)
-        except Exception as e:
-            LOG.warning("send_json scheduling failed: %s", e)
+    glib = glib_loop()
+    # Outbound signaling: bounded, batched, fed from GStreamer threads
+    outq = SignalingQueue(ws.send_str, asyncio.get_running_loop())
 
-    bc = WebRTCBroadcaster(cfg, send_json)
+    bc = WebRTCBroadcaster(cfg, outq.put, capture)
     _ACTIVE.add(bc)
     try:
-        LOG.info("Viewer connected")
-        bc.start()  # server offers SDP
+        LOG.info("Viewer connected to %s", capture.stream)
+        await glib.run(bc.start)  # server offers SDP
         async for msg in ws:
             if msg.type == WSMsgType.TEXT:
                 data = json.loads(msg.data)
                 t = data.get("type")
                 if t == "answer":
-                    bc.handle_answer(data.get("sdp", ""))
+                    glib.call(bc.handle_answer, data.get("sdp", ""))
                 elif t == "ice":
-                    bc.add_ice(data.get("candidate", ""), int(data.get("sdpMLineIndex", 0)))
+                    glib.call(bc.add_ice, data.get("candidate", ""), int(data.get("sdpMLineIndex", 0)))
+                elif t == "first-frame":
+                    bc.mark_first_frame()
             elif msg.type == WSMsgType.ERROR:
                 LOG.error("WS error: %s", ws.exception())
     finally:
-        LOG.info("Viewer disconnected")
-        try:
-            if hasattr(bc, "stop"):
-                bc.stop()
-        except Exception as e:
-            LOG.warning("bc.stop failed: %s", e)
+        LOG.info("Viewer disconnected (signaling: %d msgs in %d frames, %d dropped)", outq.sent_messages, outq.sent_frames, outq.dropped)
+        outq.close()
+        await _stop_session(bc)
         _ACTIVE.discard(bc)
         await ws.close()
     return ws
 
+# ---- WHEP (WebRTC-HTTP egress): one POST round trip, PATCH trickle, DELETE teardown ----
+def _whep_headers(cfg) -> Dict[str, str]:
+    h = {
+        "Access-Control-Allow-Origin": "*",
+        "Access-Control-Allow-Methods": "POST, PATCH, DELETE, OPTIONS",
+        "Access-Control-Allow-Headers": "Content-Type, If-Match",
+        "Access-Control-Expose-Headers": "Location, Link",
+    }
+    links = [f'<{u}>; rel="ice-server"' for u in cfg.webrtc.stun_servers]
+    if links:
+        h["Link"] = ", ".join(links)
+    return h
+
+async def _whep_close(sid: str) -> bool:
+    bc = _WHEP.pop(sid, None)
+    if bc is None:
+        return False
+    _ACTIVE.discard(bc)
+    await _stop_session(bc)
+    LOG.info("WHEP session %s closed", sid)
+    return True
+
+async def whep_options(request: web.Request) -> web.StreamResponse:
+    return web.Response(status=204, headers={"Accept-Post": "application/sdp", **_whep_headers(config_store().get())})
+
+async def whep_post(request: web.Request) -> web.StreamResponse:
+    cfg = config_store().get()
+    headers = _whep_headers(cfg)
+    capture = get_capture(cfg, _stream_name(request, cfg))
+    if request.content_type != "application/sdp":
+        return web.Response(status=415, text="expected application/sdp", headers=headers)
+    offer = await request.text()
+    if not {"VP8", "H264"} & set(sdp_codecs(offer)):
+        return web.Response(status=400, text="offer has no VP8 or H.264 video", headers=headers)
+
+    loop = asyncio.get_running_loop()
+    answered = loop.create_future()
+    sid = uuid.uuid4().hex
+    def on_answer(sdp: str):
+        loop.call_soon_threadsafe(lambda: answered.done() or answered.set_result(sdp))
+    def on_closed():
+        loop.call_soon_threadsafe(lambda: asyncio.ensure_future(_whep_close(sid)))
+
+    bc = WebRTCBroadcaster(cfg, lambda _msg: None, capture, on_closed=on_closed)
+    glib = glib_loop()
+    try:
+        await glib.run(bc.start_answer, offer, on_answer)
+    except Exception as e:
+        LOG.warning("WHEP offer rejected: %s", e)
+        await _stop_session(bc)
+        return web.Response(status=400, text=str(e), headers=headers)
+    _WHEP[sid] = bc
+    _ACTIVE.add(bc)
+    LOG.info("WHEP session %s started on %s", sid, capture.stream)
+
+    try:
+        answer = await asyncio.wait_for(asyncio.shield(answered), WHEP_ANSWER_TIMEOUT)
+    except asyncio.TimeoutError:
+        answer = await glib.run(bc.local_sdp)
+        LOG.info("WHEP %s: ICE gathering incomplete after %.1fs, answering with partial candidates", sid, WHEP_ANSWER_TIMEOUT)
+    if not answer:
+        await _whep_close(sid)
+        return web.Response(status=500, text="no answer", headers=headers)
+    return web.Response(status=201, text=answer, content_type="application/sdp",
+                        headers={"Location": f"/whep/{sid}", **headers})
+
+async def whep_patch(request: web.Request) -> web.StreamResponse:
+    headers = _whep_headers(config_store().get())
+    bc = _WHEP.get(request.match_info["sid"])
+    if bc is None:
+        return web.Response(status=404, headers=headers)
+    if request.content_type != "application/trickle-ice-sdpfrag":
+        return web.Response(status=415, text="expected application/trickle-ice-sdpfrag", headers=headers)
+    frag = await request.text()
+    glib = glib_loop()
+    # Candidates follow their section's a=mid (RFC 8840); the mid names the offer's m-line.
+    # Without one, fall back to the position of the fragment's m= line (or the first section).
+    mline, pos = 0, -1
+    for line in frag.splitlines():
+        line = line.strip()
+        if line.startswith("m="):
+            pos += 1
+            mline = pos
+        elif line.startswith("a=mid:"):
+            mline = bc.mids.get(line[len("a=mid:"):], mline)
+        elif line.startswith("a=candidate:"):
+            glib.call(bc.add_ice, line[2:], mline)
+    return web.Response(status=204, headers=headers)
+
+async def whep_delete(request: web.Request) -> web.StreamResponse:
+    headers = _whep_headers(config_store().get())
+    if not await _whep_close(request.match_info["sid"]):
+        return web.Response(status=404, headers=headers)
+    return web.Response(status=200, headers=headers)
+
+async def _close_whep(app: web.Application) -> None:
+    for sid in list(_WHEP):
+        await _whep_close(sid)
+
+async def _start_glib(app: web.Application) -> None:
+    glib_loop()
+    # Scheduling profile: everything running now (and whatever it spawns) goes to the app CPUs,
+    # i.e. off every stream's media CPUs
+    cfg = config_store().get()
+    pin_process(dataclasses.replace(cfg.sched, media_cpus=all_media_cpus(cfg)))
+
+async def _stop_glib(app: web.Application) -> None:
+    glib_loop().stop()
+
+async def _start_gstreamer(app: web.Application) -> None:
+    # In the background, so the port is bound before the plugin registry scan. The encoder
+    # benchmark and then the warm standby need GStreamer and follow it.
+    async def _run():
+        await asyncio.get_running_loop().run_in_executor(None, PREFLIGHT.run, config_store().get())
+        PREFLIGHT.ready_ms = round((time.monotonic() - T_IMPORT) * 1000.0, 1)
+        LOG.info("GStreamer %s %.0f ms after import", PREFLIGHT.status, PREFLIGHT.ready_ms)
+        app["gst_ready"].set()
+        if PREFLIGHT.status == "failed":
+            return
+        await _bench_encoders(app)
+        await _prewarm(app)
+    app["gst_ready"] = asyncio.Event()
+    app["gst_start"] = asyncio.ensure_future(_run())
+
+async def _bench_encoders(app: web.Application) -> None:
+    # First boot per resolution/fps only; until it finishes new pipelines use vp8enc. Each
+    # candidate runs in its own process, and the warm standby is only started afterwards.
+    cfg = config_store().get()
+    for name in cfg.stream_names():
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, REGISTRY.warm, cfg.stream(name).video)
+        except Exception as e:
+            LOG.warning("Encoder benchmark failed (%s): %s", name, e)
+
+async def _prewarm(app: web.Application) -> None:
+    cfg = config_store().get()
+    if not cfg.standby.warm:
+        return
+    for name in cfg.stream_names():
+        try:
+            await glib_loop().run(get_capture(cfg, name).prewarm)
+            LOG.info("Warm standby: capture pipeline %s running", name)
+        except Exception as e:
+            LOG.warning("Warm standby prewarm of %s failed: %s", name, e)
+
 def make_app() -> web.Application:
-    app = web.Application()
+    app = web.Application(middlewares=[_wait_for_gst])
+    app.on_startup.append(_start_glib)
+    app.on_startup.append(_start_gstreamer)
+    app.on_shutdown.append(_close_whep)
+    app.on_cleanup.append(_stop_glib)
     app.router.add_get("/", index)
     app.router.add_get("/settings", settings_page)
     app.router.add_get("/api/config", get_config)
     app.router.add_post("/api/config", post_config)
+    app.router.add_get("/api/abr", get_abr)
+    app.router.add_get("/api/encoders", get_encoders)
+    app.router.add_get("/api/overlay", get_overlay)
+    app.router.add_post("/api/overlay", post_overlay)
+    app.router.add_get("/api/scene", get_scene)
+    app.router.add_get("/api/ready", get_ready)
+    app.router.add_get("/api/sessions", get_sessions)
+    app.router.add_get("/api/sched", get_sched)
+    app.router.add_get("/metrics", metrics)
+    app.router.add_get("/api/snapshot.jpg", snapshot)
+    app.router.add_get("/api/recordings", recordings_list)
+    app.router.add_post("/api/recordings", recordings_trigger)
+    app.router.add_get("/api/recordings/{name}", recordings_download)
     app.router.add_static("/static/", path=str(STATIC_DIR), show_index=False)
     app.router.add_get("/ws", ws_handler)
+    app.router.add_route("OPTIONS", "/whep", whep_options)
+    app.router.add_post("/whep", whep_post)
+    app.router.add_patch("/whep/{sid}", whep_patch)
+    app.router.add_delete("/whep/{sid}", whep_delete)
     return app
 
+async def _serve(host: str, port: int) -> None:
+    runner = web.AppRunner(make_app())
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+        PREFLIGHT.listening_ms = round((time.monotonic() - T_IMPORT) * 1000.0, 1)
+        LOG.info("Listening on http://%s:%d, %.0f ms after import", host, port, PREFLIGHT.listening_ms)
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+
 if __name__ == "__main__":
-    cfg = load_config()
-    web.run_app(make_app(), host=cfg.server.host, port=cfg.server.port)
+    cfg = config_store().get()
+    asyncio.run(_serve(cfg.server.host, cfg.server.port))
@@ -0,0 +1,320 @@
+"""
+Headless pipeline benchmark.
+
+    python -m server.bench --res 640x360,960x540 --fps 25 --bitrate 800000,1200000 \
+        --orient none:0,horizontal:180 --encoder vp8enc --out bench.json
+    python -m server.bench ... --baseline bench.json --threshold 0.10   # exit 1 on regression
+
+Each case builds the real CapturePipeline with videotestsrc as the source and hangs
+one viewer-equivalent branch (queue → RTP payloader → fakesink) off enc_tee, so it
+measures the same chain a viewer gets minus DTLS/SRTP. Every case runs in a fresh
+subprocess so CPU and RSS figures are not polluted by earlier cases.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+# Case keys that identify a result when comparing against a baseline
+CASE_KEYS = ("width", "height", "fps", "bitrate", "mirror", "rotate", "encoder", "enc_props", "overlay", "scene", "sched")
+# Values assumed for keys missing from older result files
+CASE_DEFAULTS = {"sched": "off"}
+# (metric path, direction): +1 = higher is better, -1 = lower is better
+COMPARED = (("fps", +1), ("cpu_pct", -1), ("latency_ms.p90", -1), ("frame_interval_ms.jitter", -1), ("rss_mb", -1))
+MAX_LATENCY_SAMPLES = 20000
+
+def _rss_mb() -> Dict[str, float]:
+    """Current and peak RSS from /proc (Linux), falling back to getrusage peak."""
+    out = {}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    out["rss_mb" if line.startswith("VmRSS") else "peak_rss_mb"] = int(line.split()[1]) / 1024.0
+    except OSError:
+        out["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+        out["rss_mb"] = out["peak_rss_mb"]
+    return {k: round(v, 1) for k, v in out.items()}
+
+def _percentiles(samples: List[float]) -> Dict[str, Optional[float]]:
+    if not samples:
+        return {"p50": None, "p90": None, "p99": None, "max": None}
+    s = sorted(samples)
+    at = lambda q: round(s[min(len(s) - 1, int(q * len(s)))], 2)
+    return {"p50": at(0.50), "p90": at(0.90), "p99": at(0.99), "max": round(s[-1], 2)}
+
+def _intervals(arrivals_ns: List[int]) -> Dict[str, Optional[float]]:
+    """Packetized frame cadence: mean, jitter (stdev) and p99 of the inter-frame gap."""
+    gaps = [(b - a) / 1e6 for a, b in zip(arrivals_ns, arrivals_ns[1:])]
+    if not gaps:
+        return {"mean": None, "jitter": None, "p99": None}
+    mean = sum(gaps) / len(gaps)
+    stdev = (sum((g - mean) ** 2 for g in gaps) / len(gaps)) ** 0.5
+    return {"mean": round(mean, 2), "jitter": round(stdev, 2), "p99": _percentiles(gaps)["p99"]}
+
+# ---- one case (runs in the child process) ----
+def run_case(case: Dict[str, Any], duration: float, warmup: float) -> Dict[str, Any]:
+    from gi.repository import Gst
+    from .config import Config
+    from .encoders import BY_NAME
+    from .pipeline import CapturePipeline
+    from .preflight import gst_init
+    from .sched import pin_process
+
+    gst_init()
+
+    cfg = Config()
+    v = cfg.video
+    v.source, v.encoder = "test", case["encoder"]
+    v.width, v.height, v.fps, v.bitrate = case["width"], case["height"], case["fps"], case["bitrate"]
+    v.mirror, v.rotate = case["mirror"], case["rotate"]
+    cfg.abr.enabled = False           # fixed bitrate: ABR would make runs incomparable
+    cfg.metrics.enabled = True
+    cfg.recording.enabled = False
+    cfg.overlay.enabled = bool(case["overlay"])
+    cfg.scene.enabled = bool(case["scene"])
+    sched = case.get("sched", "off")
+    if sched != "off":
+        cfg.sched.enabled, cfg.sched.policy = True, sched
+        if case.get("media_cpus"):
+            cfg.sched.media_cpus = list(case["media_cpus"])
+        pin_process(cfg.sched)
+    if case["encoder"] not in BY_NAME or Gst.ElementFactory.find(case["encoder"]) is None:
+        return {"case": case, "ok": False, "error": f"{case['encoder']} not available"}
+
+    capture = CapturePipeline(cfg)
+    capture.acquire()
+    try:
+        for k, val in (case["enc_props"] or {}).items():
+            Gst.util_set_object_arg(capture.enc, k, str(val))
+
+        # Viewer-equivalent branch: same leaky queue and payloader, fakesink for webrtcbin
+        spec = capture.encoder
+        branch = Gst.Bin.new("benchviewer")
+        q = Gst.ElementFactory.make("queue", "qviewer")
+        q.set_property("leaky", 2); q.set_property("max-size-buffers", 0)
+        q.set_property("max-size-bytes", 0); q.set_property("max-size-time", 500 * Gst.MSECOND)
+        pay = spec.make_pay(96)
+        sink = Gst.ElementFactory.make("fakesink", "benchsink")
+        sink.set_property("sync", False); sink.set_property("async", False)
+        for e in (q, pay, sink): branch.add(e)
+        q.link(pay); pay.link(sink)
+        branch.add_pad(Gst.GhostPad.new("sink", q.get_static_pad("sink")))
+
+        # Capture → packetized latency, matched by PTS (first RTP packet of each frame)
+        lock = threading.Lock()
+        inflight: Dict[int, int] = {}
+        latencies: List[float] = []
+        arrivals: List[int] = []
+        state = {"measuring": False, "frames": 0}
+        def on_src(_pad, info):
+            buf = info.get_buffer()
+            if buf is not None and buf.pts != Gst.CLOCK_TIME_NONE:
+                with lock:
+                    inflight[buf.pts] = time.monotonic_ns()
+                    if len(inflight) > 64:
+                        inflight.pop(next(iter(inflight)))
+            return Gst.PadProbeReturn.OK
+        def on_out(_pad, info):
+            buf = info.get_buffer()
+            if buf is None:
+                return Gst.PadProbeReturn.OK
+            with lock:
+                t0 = inflight.pop(buf.pts, None)
+                if t0 is not None and state["measuring"]:
+                    now = time.monotonic_ns()
+                    state["frames"] += 1
+                    if len(latencies) < MAX_LATENCY_SAMPLES:
+                        latencies.append((now - t0) / 1e6)
+                        arrivals.append(now)
+            return Gst.PadProbeReturn.OK
+        capture.src.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, on_src)
+        sink.get_static_pad("sink").add_probe(Gst.PadProbeType.BUFFER, on_out)
+        tee_pad = capture.attach(branch)
+
+        time.sleep(warmup)
+        m = capture.metrics
+        bytes0, drops0 = m.enc_bytes, dict(m.drops)
+        cpu0, t0 = time.process_time(), time.monotonic()
+        with lock:
+            state["measuring"] = True
+        time.sleep(duration)
+        with lock:
+            state["measuring"] = False
+            frames = state["frames"]
+        cpu, wall = time.process_time() - cpu0, time.monotonic() - t0
+        result = {
+            "case": case, "ok": True,
+            "encoder_element": spec.element,
+            "seconds": round(wall, 2),
+            "fps": round(frames / wall, 2),
+            "latency_ms": _percentiles(latencies),
+            "frame_interval_ms": _intervals(arrivals),
+            "cpu_pct": round(100.0 * cpu / wall, 1),
+            "encoded_kbps": round((m.enc_bytes - bytes0) * 8 / wall / 1000.0, 1),
+            "queue_drops": {k: n - drops0.get(k, 0) for k, n in m.drops.items()},
+            "stage_latency_ms_mean": {s: round(h.sum / h.total * 1000.0, 3) for s, h in m.latency.items() if h.total},
+            # Next to cpu_pct, so an --orient sweep shows what the saved copies are worth
+            "orientation_passes": capture.orientation_passes(),
+            "orientation_bytes_saved_per_frame": capture.orientation_bytes_saved(),
+            **_rss_mb(),
+        }
+        if cfg.scene.enabled:
+            result["scene"] = capture.scene.snapshot()
+        if cfg.sched.enabled:
+            result["sched"] = capture.sched.snapshot()
+        capture.detach(tee_pad, branch)
+        return result
+    finally:
+        capture.release()
+
+# ---- sweep + comparison (parent process) ----
+def _split(s: str) -> List[str]:
+    return [x.strip() for x in s.split(",") if x.strip()]
+
+def build_cases(a) -> List[Dict[str, Any]]:
+    res = [tuple(int(n) for n in r.lower().split("x")) for r in _split(a.res)]
+    orient = []
+    for o in _split(a.orient):
+        mirror, _, rotate = o.partition(":")
+        orient.append((mirror or "none", int(rotate or 0)))
+    # --enc-prop cpu-used=4,8 --enc-prop threads=1,2 → every combination
+    prop_axes = []
+    for spec in a.enc_prop or []:
+        key, _, vals = spec.partition("=")
+        prop_axes.append([(key, v) for v in _split(vals)])
+    prop_sets = [dict(combo) for combo in itertools.product(*prop_axes)] if prop_axes else [{}]
+    cases = []
+    media_cpus = [int(c) for c in _split(a.media_cpus)]
+    for (w, h), fps, br, (mirror, rot), enc, props, sched in itertools.product(
+            res, [int(x) for x in _split(a.fps)], [int(x) for x in _split(a.bitrate)],
+            orient, _split(a.encoder), prop_sets, _split(a.sched)):
+        cases.append({"width": w, "height": h, "fps": fps, "bitrate": br, "mirror": mirror, "rotate": rot,
+                      "encoder": enc, "enc_props": props, "overlay": a.overlay, "scene": a.scene,
+                      "sched": sched, "media_cpus": media_cpus})
+    return cases
+
+def _run_child(case: Dict[str, Any], a) -> Dict[str, Any]:
+    cmd = [sys.executable, "-m", "server.bench", "--run-case", json.dumps(case),
+           "--duration", str(a.duration), "--warmup", str(a.warmup)]
+    try:
+        proc = subprocess.run(cmd, capture_output=True, text=True, timeout=a.duration + a.warmup + 60)
+    except subprocess.TimeoutExpired:
+        return {"case": case, "ok": False, "error": "timeout"}
+    lines = [l for l in proc.stdout.splitlines() if l.startswith("{")]
+    if proc.returncode != 0 or not lines:
+        return {"case": case, "ok": False, "error": (proc.stderr.strip().splitlines() or ["no output"])[-1]}
+    return json.loads(lines[-1])
+
+def _meta(a) -> Dict[str, Any]:
+    from gi.repository import Gst
+    cpu = platform.processor()
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.lower().startswith(("model name", "model")):
+                    cpu = line.split(":", 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    return {
+        "gstreamer": Gst.version_string(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu": cpu,
+        "cpus": os.cpu_count(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "duration_s": a.duration,
+        "warmup_s": a.warmup,
+    }
+
+def _case_id(case: Dict[str, Any]) -> str:
+    return json.dumps({k: case.get(k, CASE_DEFAULTS.get(k)) for k in CASE_KEYS}, sort_keys=True)
+
+def _get(d: Dict[str, Any], path: str):
+    for part in path.split("."):
+        d = d.get(part) if isinstance(d, dict) else None
+    return d
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """Human-readable regressions: a metric worse than baseline by more than threshold."""
+    base = {_case_id(r["case"]): r for r in baseline.get("results", []) if r.get("ok")}
+    out = []
+    for r in current.get("results", []):
+        b = base.get(_case_id(r["case"]))
+        if b is None or not r.get("ok"):
+            continue
+        for path, sign in COMPARED:
+            cur, ref = _get(r, path), _get(b, path)
+            if cur is None or not ref:
+                continue
+            change = (cur - ref) / ref
+            if sign * change < -threshold:
+                c = r["case"]
+                out.append(f"{c['encoder']} {c['width']}x{c['height']}@{c['fps']} {c['bitrate']}bps "
+                           f"{c['mirror']}/{c['rotate']}: {path} {ref} → {cur} ({change:+.0%})")
+    return out
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m server.bench", description="Headless capture/encode pipeline benchmark")
+    ap.add_argument("--res", default="960x540", help="comma list of WxH")
+    ap.add_argument("--fps", default="25", help="comma list")
+    ap.add_argument("--bitrate", default="1200000", help="comma list, bps")
+    ap.add_argument("--orient", default="none:0", help="comma list of mirror:rotate, e.g. none:0,horizontal:180")
+    ap.add_argument("--encoder", default="vp8enc", help="comma list of encoder elements")
+    ap.add_argument("--enc-prop", action="append", metavar="KEY=V1,V2", help="encoder property sweep (repeatable)")
+    ap.add_argument("--overlay", action="store_true", help="enable the overlay stage")
+    ap.add_argument("--scene", action="store_true", help="enable the static-scene gate")
+    ap.add_argument("--sched", default="off", help="comma list of scheduling profiles: off,nice,fifo")
+    ap.add_argument("--media-cpus", default="2,3", help="CPUs for the media threads when --sched is not off")
+    ap.add_argument("--duration", type=float, default=10.0, help="measured seconds per case")
+    ap.add_argument("--warmup", type=float, default=2.0, help="seconds before measuring")
+    ap.add_argument("--out", help="write JSON results here (default: stdout)")
+    ap.add_argument("--baseline", help="compare against this earlier --out file")
+    ap.add_argument("--threshold", type=float, default=0.10, help="allowed relative regression (0.10 = 10%%)")
+    ap.add_argument("--run-case", help=argparse.SUPPRESS)
+    a = ap.parse_args(argv)
+
+    if a.run_case:
+        print(json.dumps(run_case(json.loads(a.run_case), a.duration, a.warmup)))
+        return 0
+
+    cases = build_cases(a)
+    results = []
+    for i, case in enumerate(cases, 1):
+        print(f"[{i}/{len(cases)}] {case['encoder']} {case['width']}x{case['height']}@{case['fps']} "
+              f"{case['bitrate']}bps {case['mirror']}/{case['rotate']} sched={case['sched']} {case['enc_props'] or ''}", file=sys.stderr)
+        r = _run_child(case, a)
+        results.append(r)
+        if r.get("ok"):
+            print(f"    {r['fps']} fps, p90 {r['latency_ms']['p90']} ms, jitter {r['frame_interval_ms']['jitter']} ms, "
+                  f"cpu {r['cpu_pct']}%, rss {r.get('rss_mb')} MB", file=sys.stderr)
+        else:
+            print(f"    failed: {r.get('error')}", file=sys.stderr)
+    report = {"meta": _meta(a), "results": results}
+    text = json.dumps(report, indent=2)
+    if a.out:
+        with open(a.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if a.baseline:
+        with open(a.baseline) as f:
+            regressions = compare(report, json.load(f), a.threshold)
+        for line in regressions:
+            print("REGRESSION " + line, file=sys.stderr)
+        if regressions:
+            return 1
+        print(f"No regressions beyond {a.threshold:.0%} against {a.baseline}", file=sys.stderr)
+    return 0 if all(r.get("ok") for r in results) else 2
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,19 @@
 from __future__ import annotations
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import List, Optional, Dict, Any
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import copy
+import logging
+import os
+import tempfile
+import threading
+import time
 import yaml
 
 ROOT = Path(__file__).resolve().parent.parent
 CFG_DIR = ROOT / "config"
-CFG_PATH = CFG_DIR / "config.yaml"
+# REVCAM_CONFIG points a process at another config file (load tests, side-by-side instances)
+CFG_PATH = Path(os.environ.get("REVCAM_CONFIG") or CFG_DIR / "config.yaml").resolve()
 
 @dataclass
 class ServerConfig:
@@ -29,14 +36,142 @@ class VideoConfig:
     # New split fields
     mirror: str = "none"          # one of: none|horizontal|vertical
     rotate: int = 0               # one of: 0|90|180|270
+    source: str = "libcamera"     # one of: libcamera|test (videotestsrc stand-in for the camera)
+    camera: str = ""              # libcamera camera-name (empty = first camera); videotestsrc pattern for source: test
+    encoder: str = "auto"         # auto (benchmarked) | vp8enc | v4l2h264enc | openh264enc | x264enc
+    # Let libcamera flip the sensor readout (mirror/180°) instead of copying frames; needs a restart to change
+    sensor_orientation: bool = False
     # Back-compat: old single "flip" field (ignored if mirror/rotate are present)
     flip: str = "none"
 
+@dataclass
+class AbrConfig:
+    enabled: bool = True
+    min_bitrate: int = 300_000
+    max_bitrate: int = 2_500_000
+    interval_ms: int = 1000
+    # Optionally trade frame rate once bitrate is already at the floor
+    adapt_fps: bool = False
+    min_fps: int = 10
+
+@dataclass
+class MetricsConfig:
+    enabled: bool = True
+    # Time latency on every Nth buffer per stage (0 = counters only)
+    sample_every: int = 10
+
+@dataclass
+class StandbyConfig:
+    # Keep camera + encoder running with no viewers so a join only costs signaling
+    warm: bool = False
+    # Seconds without viewers before the camera is closed
+    idle_grace_s: float = 30.0
+
+@dataclass
+class RecordingConfig:
+    # Ring buffer of encoded frames on enc_tee; clips are remuxed, never re-encoded
+    enabled: bool = False
+    pre_roll_s: float = 10.0
+    post_roll_s: float = 10.0
+    dir: str = "recordings"       # relative to the repo root unless absolute
+    max_write_kib_s: int = 1024   # disk write cap while saving a clip
+
+@dataclass
+class OverlayConfig:
+    # overlaycomposition + cached Cairo layers; identity passthrough when off
+    enabled: bool = False
+    guides: bool = True
+    timestamp: bool = True
+    timestamp_format: str = "%Y-%m-%d %H:%M:%S"
+    distance: bool = True
+    distance_timeout_s: float = 2.0  # hide the distance text when the sensor goes quiet
+
+@dataclass
+class SceneConfig:
+    # Skip encoding frames of an unchanged scene (probe before qenc; needs numpy)
+    enabled: bool = False
+    threshold: float = 1.5     # mean abs luma difference (0–255) that counts as motion
+    floor_fps: float = 2.0     # frame rate kept while static
+    settle_s: float = 1.0      # quiet time before decimating
+    downsample: int = 8        # score every Nth pixel in both directions
+
+@dataclass
+class SchedConfig:
+    # Pin camera/encode streaming threads to media_cpus at raised priority; everything else
+    # (aiohttp, GLib/signaling, DTLS/SRTP) to app_cpus. Applied at the next pipeline start.
+    enabled: bool = False
+    media_cpus: List[int] = field(default_factory=lambda: [2, 3])
+    app_cpus: List[int] = field(default_factory=list)   # empty = every CPU not in media_cpus
+    policy: str = "nice"          # nice | fifo (SCHED_FIFO; falls back to nice if not permitted)
+    nice: int = -10               # media threads; negative values need CAP_SYS_NICE or RLIMIT_NICE
+    fifo_priority: int = 10       # 1–99, only with policy: fifo
+
+@dataclass
+class StreamConfig:
+    # One camera (or one sensor at another resolution) with its own pipeline and viewers.
+    # `video` is the top-level video section with this stream's overrides applied.
+    name: str
+    video: VideoConfig = field(default_factory=VideoConfig)
+    cpus: List[int] = field(default_factory=list)   # media CPUs for this pipeline (sched profile); empty = sched.media_cpus
+
+# Name of the implicit stream when config.yaml has no streams section
+DEFAULT_STREAM = "main"
+
 @dataclass
 class Config:
     server: ServerConfig = field(default_factory=ServerConfig)
     webrtc: WebRTCConfig = field(default_factory=WebRTCConfig)
     video: VideoConfig = field(default_factory=VideoConfig)
+    abr: AbrConfig = field(default_factory=AbrConfig)
+    metrics: MetricsConfig = field(default_factory=MetricsConfig)
+    standby: StandbyConfig = field(default_factory=StandbyConfig)
+    recording: RecordingConfig = field(default_factory=RecordingConfig)
+    overlay: OverlayConfig = field(default_factory=OverlayConfig)
+    scene: SceneConfig = field(default_factory=SceneConfig)
+    sched: SchedConfig = field(default_factory=SchedConfig)
+    streams: List[StreamConfig] = field(default_factory=list)   # empty = one stream, DEFAULT_STREAM, from `video`
+
+    def stream_names(self) -> List[str]:
+        return [s.name for s in self.streams] or [DEFAULT_STREAM]
+
+    def stream(self, name: Optional[str] = None) -> StreamConfig:
+        """A stream by name (None = the first). Raises KeyError for unknown names."""
+        if not self.streams:
+            if name not in (None, "", DEFAULT_STREAM):
+                raise KeyError(name)
+            return StreamConfig(DEFAULT_STREAM, self.video, [])
+        if not name:
+            return self.streams[0]
+        for s in self.streams:
+            if s.name == name:
+                return s
+        raise KeyError(name)
+
+def stream_config(cfg: Config, name: Optional[str] = None) -> Config:
+    """
+    The Config one stream's pipeline sees: `video` is the stream's, and the sched profile
+    uses the stream's CPUs. Shares every other section with cfg, so treat it as read-only.
+    """
+    s = cfg.stream(name)
+    if not cfg.streams:
+        return cfg
+    view = copy.copy(cfg)
+    view.video = s.video
+    if s.cpus:
+        view.sched = copy.copy(cfg.sched)
+        view.sched.media_cpus = list(s.cpus)
+        if not cfg.sched.app_cpus:
+            # Threads leaving a media element go back to the shared app CPUs, not to another stream's
+            media = set(all_media_cpus(cfg))
+            view.sched.app_cpus = [c for c in range(os.cpu_count() or 1) if c not in media]
+    return view
+
+def all_media_cpus(cfg: Config) -> List[int]:
+    """Every CPU any stream's media threads may use (the app CPUs are the rest)."""
+    cpus = set(cfg.sched.media_cpus)
+    for s in cfg.streams:
+        cpus |= set(s.cpus)
+    return sorted(cpus)
 
 def _coerce_video(d: Dict[str, Any]) -> VideoConfig:
     v = VideoConfig()
@@ -65,21 +200,31 @@ def _coerce_video(d: Dict[str, Any]) -> VideoConfig:
         v.rotate = 0
     if v.rotate not in (0,90,180,270):
         v.rotate = 0
+    source = str(d.get("source", v.source)).lower()
+    v.source = source if source in ("libcamera","test") else "libcamera"
+    v.camera = str(d.get("camera", v.camera) or "")
+    encoder = str(d.get("encoder", v.encoder)).lower()
+    v.encoder = encoder if encoder in ("auto","vp8enc","v4l2h264enc","openh264enc","x264enc") else "auto"
+    v.sensor_orientation = bool(d.get("sensor_orientation", v.sensor_orientation))
     # keep old field around when saving for clarity
     v.flip = d.get("flip", "none")
     return v
 
-def load_config() -> Config:
-    if not CFG_PATH.exists():
-        CFG_DIR.mkdir(parents=True, exist_ok=True)
-        cfg = Config()
-        save_config(cfg)
-        return cfg
-    data = yaml.safe_load(CFG_PATH.read_text()) or {}
+def _coerce_abr(d: Dict[str, Any]) -> AbrConfig:
+    a = AbrConfig()
+    a.enabled     = bool(d.get("enabled", a.enabled))
+    a.min_bitrate = max(50_000, int(d.get("min_bitrate", a.min_bitrate)))
+    a.max_bitrate = max(a.min_bitrate, int(d.get("max_bitrate", a.max_bitrate)))
+    a.interval_ms = max(200, int(d.get("interval_ms", a.interval_ms)))
+    a.adapt_fps   = bool(d.get("adapt_fps", a.adapt_fps))
+    a.min_fps     = max(1, int(d.get("min_fps", a.min_fps)))
+    return a
+
+def _from_dict(data: Dict[str, Any]) -> Config:
     cfg = Config()
-    s = data.get("server", {})
-    w = data.get("webrtc", {})
-    v = data.get("video", {})
+    s = data.get("server", {}) or {}
+    w = data.get("webrtc", {}) or {}
+    v = data.get("video", {}) or {}
     cfg.server.host = str(s.get("host", cfg.server.host))
     cfg.server.port = int(s.get("port", cfg.server.port))
     cfg.webrtc.stun_servers = list(w.get("stun_servers", cfg.webrtc.stun_servers))
@@ -87,11 +232,71 @@ def load_config() -> Config:
     cfg.webrtc.turn_username = w.get("turn_username", cfg.webrtc.turn_username)
     cfg.webrtc.turn_password = w.get("turn_password", cfg.webrtc.turn_password)
     cfg.video = _coerce_video(v)
+    cfg.abr = _coerce_abr(data.get("abr", {}) or {})
+    m = data.get("metrics", {}) or {}
+    cfg.metrics.enabled = bool(m.get("enabled", cfg.metrics.enabled))
+    cfg.metrics.sample_every = max(0, int(m.get("sample_every", cfg.metrics.sample_every)))
+    sb = data.get("standby", {}) or {}
+    cfg.standby.warm = bool(sb.get("warm", cfg.standby.warm))
+    cfg.standby.idle_grace_s = max(0.0, float(sb.get("idle_grace_s", cfg.standby.idle_grace_s)))
+    r = data.get("recording", {}) or {}
+    cfg.recording.enabled = bool(r.get("enabled", cfg.recording.enabled))
+    cfg.recording.pre_roll_s = max(0.0, float(r.get("pre_roll_s", cfg.recording.pre_roll_s)))
+    cfg.recording.post_roll_s = max(0.0, float(r.get("post_roll_s", cfg.recording.post_roll_s)))
+    cfg.recording.dir = str(r.get("dir", cfg.recording.dir) or cfg.recording.dir)
+    cfg.recording.max_write_kib_s = max(1, int(r.get("max_write_kib_s", cfg.recording.max_write_kib_s)))
+    o = data.get("overlay", {}) or {}
+    cfg.overlay.enabled = bool(o.get("enabled", cfg.overlay.enabled))
+    cfg.overlay.guides = bool(o.get("guides", cfg.overlay.guides))
+    cfg.overlay.timestamp = bool(o.get("timestamp", cfg.overlay.timestamp))
+    cfg.overlay.timestamp_format = str(o.get("timestamp_format", cfg.overlay.timestamp_format) or cfg.overlay.timestamp_format)
+    cfg.overlay.distance = bool(o.get("distance", cfg.overlay.distance))
+    cfg.overlay.distance_timeout_s = max(0.1, float(o.get("distance_timeout_s", cfg.overlay.distance_timeout_s)))
+    sc = data.get("scene", {}) or {}
+    cfg.scene.enabled = bool(sc.get("enabled", cfg.scene.enabled))
+    cfg.scene.threshold = max(0.0, float(sc.get("threshold", cfg.scene.threshold)))
+    cfg.scene.floor_fps = max(0.1, float(sc.get("floor_fps", cfg.scene.floor_fps)))
+    cfg.scene.settle_s = max(0.0, float(sc.get("settle_s", cfg.scene.settle_s)))
+    cfg.scene.downsample = max(1, int(sc.get("downsample", cfg.scene.downsample)))
+    cfg.sched = _coerce_sched(data.get("sched", {}) or {})
+    cfg.streams = _coerce_streams(data.get("streams") or [], v)
     return cfg
 
-def save_config(cfg: Config) -> None:
-    CFG_DIR.mkdir(parents=True, exist_ok=True)
-    data = {
+def _coerce_streams(items: List[Dict[str, Any]], video: Dict[str, Any]) -> List[StreamConfig]:
+    """Each stream's video = top-level video section + the stream's own keys."""
+    out: List[StreamConfig] = []
+    base = {k: val for k, val in video.items() if k != "flip"}
+    for i, d in enumerate(items):
+        d = d or {}
+        name = str(d.get("name") or f"cam{i}").strip()
+        if any(s.name == name for s in out):
+            raise ValueError(f"duplicate stream name {name!r}")
+        vid = _coerce_video({**base, **(d.get("video") or {})})
+        out.append(StreamConfig(name, vid, sorted({int(c) for c in (d.get("cpus") or [])})))
+    return out
+
+def _coerce_sched(d: Dict[str, Any]) -> SchedConfig:
+    s = SchedConfig()
+    s.enabled = bool(d.get("enabled", s.enabled))
+    s.media_cpus = sorted({int(c) for c in (d.get("media_cpus", s.media_cpus) or [])})
+    s.app_cpus = sorted({int(c) for c in (d.get("app_cpus", s.app_cpus) or [])})
+    s.policy = str(d.get("policy", s.policy)).lower()
+    if s.policy not in ("nice", "fifo"):
+        s.policy = "nice"
+    s.nice = min(19, max(-20, int(d.get("nice", s.nice))))
+    s.fifo_priority = min(99, max(1, int(d.get("fifo_priority", s.fifo_priority))))
+    return s
+
+def load_config() -> Config:
+    """Parse config.yaml from disk. Request handlers should use config_store().get() instead."""
+    if not CFG_PATH.exists():
+        cfg = Config()
+        save_config(cfg)
+        return cfg
+    return _from_dict(yaml.safe_load(CFG_PATH.read_text()) or {})
+
+def config_to_dict(cfg: Config) -> Dict[str, Any]:
+    return {
         "server": {"host": cfg.server.host, "port": cfg.server.port},
         "webrtc": {
             "stun_servers": cfg.webrtc.stun_servers,
@@ -100,16 +305,110 @@ def save_config(cfg: Config) -> None:
             "turn_password": cfg.webrtc.turn_password,
         },
         "video": {
-            "width": cfg.video.width,
-            "height": cfg.video.height,
-            "fps": cfg.video.fps,
-            "bitrate": cfg.video.bitrate,
-            "mirror": cfg.video.mirror,
-            "rotate": cfg.video.rotate,
+            **_video_to_dict(cfg.video),
             "flip": cfg.video.flip,  # keep for back-compat
         },
+        "abr": _abr_to_dict(cfg.abr),
+        "metrics": {"enabled": cfg.metrics.enabled, "sample_every": cfg.metrics.sample_every},
+        "standby": {"warm": cfg.standby.warm, "idle_grace_s": cfg.standby.idle_grace_s},
+        "recording": _recording_to_dict(cfg.recording),
+        "overlay": _overlay_to_dict(cfg.overlay),
+        "scene": _scene_to_dict(cfg.scene),
+        "sched": _sched_to_dict(cfg.sched),
+        **({"streams": _streams_to_list(cfg)} if cfg.streams else {}),
+    }
+
+def save_config(cfg: Config) -> None:
+    """Atomic: write a temp file next to config.yaml, fsync, then rename over it."""
+    CFG_PATH.parent.mkdir(parents=True, exist_ok=True)
+    text = yaml.safe_dump(config_to_dict(cfg), sort_keys=False)
+    fd, tmp = tempfile.mkstemp(prefix=".config.", suffix=".tmp", dir=str(CFG_PATH.parent))
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, CFG_PATH)
+    except BaseException:
+        try: os.unlink(tmp)
+        except OSError: pass
+        raise
+
+def _abr_to_dict(a: AbrConfig) -> Dict[str, Any]:
+    return {
+        "enabled": a.enabled,
+        "min_bitrate": a.min_bitrate,
+        "max_bitrate": a.max_bitrate,
+        "interval_ms": a.interval_ms,
+        "adapt_fps": a.adapt_fps,
+        "min_fps": a.min_fps,
+    }
+
+def _recording_to_dict(r: RecordingConfig) -> Dict[str, Any]:
+    return {
+        "enabled": r.enabled,
+        "pre_roll_s": r.pre_roll_s,
+        "post_roll_s": r.post_roll_s,
+        "dir": r.dir,
+        "max_write_kib_s": r.max_write_kib_s,
+    }
+
+def _overlay_to_dict(o: OverlayConfig) -> Dict[str, Any]:
+    return {
+        "enabled": o.enabled,
+        "guides": o.guides,
+        "timestamp": o.timestamp,
+        "timestamp_format": o.timestamp_format,
+        "distance": o.distance,
+        "distance_timeout_s": o.distance_timeout_s,
+    }
+
+def _scene_to_dict(sc: SceneConfig) -> Dict[str, Any]:
+    return {
+        "enabled": sc.enabled,
+        "threshold": sc.threshold,
+        "floor_fps": sc.floor_fps,
+        "settle_s": sc.settle_s,
+        "downsample": sc.downsample,
+    }
+
+def _video_to_dict(v: VideoConfig) -> Dict[str, Any]:
+    return {
+        "width": v.width,
+        "height": v.height,
+        "fps": v.fps,
+        "bitrate": v.bitrate,
+        "mirror": v.mirror,
+        "rotate": v.rotate,
+        "source": v.source,
+        "camera": v.camera,
+        "encoder": v.encoder,
+        "sensor_orientation": v.sensor_orientation,
+    }
+
+def _streams_to_list(cfg: Config) -> List[Dict[str, Any]]:
+    """Streams as written to YAML: only the video keys that differ from the top-level section."""
+    base = _video_to_dict(cfg.video)
+    out = []
+    for s in cfg.streams:
+        d: Dict[str, Any] = {"name": s.name}
+        overrides = {k: val for k, val in _video_to_dict(s.video).items() if base.get(k) != val}
+        if overrides:
+            d["video"] = overrides
+        if s.cpus:
+            d["cpus"] = list(s.cpus)
+        out.append(d)
+    return out
+
+def _sched_to_dict(s: SchedConfig) -> Dict[str, Any]:
+    return {
+        "enabled": s.enabled,
+        "media_cpus": list(s.media_cpus),
+        "app_cpus": list(s.app_cpus),
+        "policy": s.policy,
+        "nice": s.nice,
+        "fifo_priority": s.fifo_priority,
     }
-    CFG_PATH.write_text(yaml.safe_dump(data, sort_keys=False))
 
 def config_to_public_json(cfg: Config) -> Dict[str, Any]:
     return {
@@ -120,12 +419,179 @@ def config_to_public_json(cfg: Config) -> Dict[str, Any]:
             "turn_username": cfg.webrtc.turn_username,
             "turn_password": cfg.webrtc.turn_password,
         },
-        "video": {
-            "width": cfg.video.width,
-            "height": cfg.video.height,
-            "fps": cfg.video.fps,
-            "bitrate": cfg.video.bitrate,
-            "mirror": cfg.video.mirror,
-            "rotate": cfg.video.rotate,
-        },
+        "video": _video_to_dict(cfg.video),
+        "abr": _abr_to_dict(cfg.abr),
+        "metrics": {"enabled": cfg.metrics.enabled, "sample_every": cfg.metrics.sample_every},
+        "standby": {"warm": cfg.standby.warm, "idle_grace_s": cfg.standby.idle_grace_s},
+        "recording": _recording_to_dict(cfg.recording),
+        "overlay": _overlay_to_dict(cfg.overlay),
+        "scene": _scene_to_dict(cfg.scene),
+        "sched": _sched_to_dict(cfg.sched),
+        "streams": [{"name": s.name, "video": _video_to_dict(s.video), "cpus": list(s.cpus)}
+                    for s in cfg.streams] or [{"name": DEFAULT_STREAM, "video": _video_to_dict(cfg.video), "cpus": []}],
     }
+
+# ---- process-wide store ----
+# How often get() may stat config.yaml for external edits
+STAT_INTERVAL = 1.0
+
+ConfigDiff = Dict[str, Dict[str, Any]]
+Subscriber = Callable[[Config, ConfigDiff], Optional[Dict[str, int]]]
+
+LOG = logging.getLogger("config")
+
+def config_diff(old: Config, new: Config) -> ConfigDiff:
+    """{section: {key: new value}} for every key whose value changed."""
+    a, b = config_to_dict(old), config_to_dict(new)
+    out: ConfigDiff = {}
+    for section in b.keys() | a.keys():
+        old_vals, vals = a.get(section), b.get(section)
+        if section == "streams":
+            # Keyed by stream name; None marks a removed stream
+            old_by, new_by = {s["name"]: s for s in old_vals or []}, {s["name"]: s for s in vals or []}
+            changed = {n: s for n, s in new_by.items() if old_by.get(n) != s}
+            changed.update({n: None for n in old_by.keys() - new_by.keys()})
+        else:
+            changed = {k: v for k, v in (vals or {}).items() if (old_vals or {}).get(k) != v}
+        if changed:
+            out[section] = changed
+    return out
+
+class ConfigStore:
+    """
+    Validated in-memory snapshot of config.yaml. get() costs no disk I/O beyond a stat
+    at most every STAT_INTERVAL (to pick up external edits). update() runs on a worker
+    thread: it validates, writes atomically, swaps the snapshot and notifies subscribers
+    with the diff. Treat returned snapshots as read-only; change them through update().
+    A subscriber that has to undo part of a change (a format the camera would not take)
+    queues the correction with amend(); it goes through the same path right after.
+    """
+    def __init__(self):
+        self._cfg: Optional[Config] = None
+        self._stamp: Optional[Tuple[int, int]] = None
+        self._checked = 0.0
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
+        self._subs: List[Subscriber] = []
+        self._amends: List[Callable[[Config], None]] = []
+
+    def _disk_stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = CFG_PATH.stat()
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def get(self) -> Config:
+        now = time.monotonic()
+        cfg = self._cfg
+        if cfg is not None and now - self._checked < STAT_INTERVAL:
+            return cfg  # hot path: no lock, no syscall
+        with self._lock:
+            if self._cfg is None:
+                self._cfg = load_config()
+                self._stamp, self._checked = self._disk_stamp(), now
+                return self._cfg
+            if now - self._checked < STAT_INTERVAL:
+                return self._cfg
+            self._checked = now
+            stamp = self._disk_stamp()
+            if stamp is None or stamp == self._stamp:
+                return self._cfg
+            try:
+                fresh = load_config()
+            except Exception as e:
+                LOG.warning("config.yaml changed but failed to parse; keeping previous: %s", e)
+                self._stamp = stamp
+                return self._cfg
+            old, self._cfg, self._stamp = self._cfg, fresh, stamp
+        diff = config_diff(old, fresh)
+        if diff:
+            LOG.info("config.yaml edited externally: %s", ", ".join(diff))
+            # Subscribers may block (live format changes); never on the caller's thread
+            threading.Thread(target=self._notify_external, args=(fresh, diff), name="config-notify", daemon=True).start()
+        return fresh
+
+    def _notify_external(self, cfg: Config, diff: ConfigDiff) -> None:
+        self._notify(cfg, diff)
+        self._apply_amends()
+
+    def update(self, mutate: Callable[[Config], None]) -> Tuple[Config, ConfigDiff, Dict[str, int]]:
+        """
+        Blocking (run in an executor). Applies mutate to a copy of the snapshot, validates
+        it, persists it and notifies subscribers. Returns (config, diff, applied counts).
+        """
+        new, diff = self._save(mutate)
+        applied = self._notify(new, diff) if diff else {}
+        # Corrections subscribers queued while applying it; the caller gets the final snapshot
+        return self._apply_amends() or new, diff, applied
+
+    def amend(self, mutate: Callable[[Config], None]) -> None:
+        """
+        For subscribers: queue a change to be validated, saved and notified as soon as the
+        current notification is over. mutate should check the snapshot still needs it.
+        """
+        with self._lock:
+            self._amends.append(mutate)
+
+    def _save(self, mutate: Callable[[Config], None]) -> Tuple[Config, ConfigDiff]:
+        with self._write_lock:
+            old = self.get()
+            draft = copy.deepcopy(old)
+            mutate(draft)
+            new = _from_dict(config_to_dict(draft))  # same coercion as a file load
+            diff = config_diff(old, new)
+            if diff:
+                save_config(new)
+                with self._lock:
+                    self._cfg, self._stamp = new, self._disk_stamp()
+        return new, diff
+
+    def _apply_amends(self) -> Optional[Config]:
+        """Run queued amendments (and any they cause); returns the last snapshot, if any ran."""
+        last = None
+        while True:
+            with self._lock:
+                todo, self._amends = self._amends, []
+            if not todo:
+                return last
+            for mutate in todo:
+                try:
+                    last, diff = self._save(mutate)
+                except Exception:
+                    LOG.exception("config amendment failed")
+                    continue
+                if diff:
+                    LOG.info("config amended by a subscriber: %s", ", ".join(diff))
+                    self._notify(last, diff)
+
+    def subscribe(self, fn: Subscriber) -> None:
+        with self._lock:
+            if fn not in self._subs:
+                self._subs.append(fn)
+
+    def unsubscribe(self, fn: Subscriber) -> None:
+        with self._lock:
+            if fn in self._subs:
+                self._subs.remove(fn)
+
+    def _notify(self, cfg: Config, diff: ConfigDiff) -> Dict[str, int]:
+        applied: Dict[str, int] = {}
+        with self._lock:
+            subs = list(self._subs)
+        for fn in subs:
+            try:
+                for k, n in (fn(cfg, diff) or {}).items():
+                    applied[k] = applied.get(k, 0) + n
+            except Exception:
+                LOG.exception("config subscriber failed")
+        return applied
+
+_STORE: Optional[ConfigStore] = None
+
+def config_store() -> ConfigStore:
+    """Process-wide config store."""
+    global _STORE
+    if _STORE is None:
+        _STORE = ConfigStore()
+    return _STORE
@@ -0,0 +1,319 @@
+import argparse
+import dataclasses
+import json
+import logging
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from .config import CFG_DIR, ROOT, VideoConfig
+
+LOG = logging.getLogger("encoders")
+
+CACHE_PATH = CFG_DIR / "encoder_cache.json"
+BENCH_SECONDS = 3          # of video per candidate
+BENCH_TIMEOUT = 20.0       # wall-clock cap per candidate
+REALTIME_MARGIN = 1.2      # encode fps must beat the target by this factor
+PEER_REJECT_TTL = 600.0    # seconds a codec some peer's answer lacked stays out of auto-selection
+
+@dataclass(frozen=True)
+class EncoderSpec:
+    """How to build, tune and packetize one encoder element."""
+    element: str
+    codec: str                               # SDP encoding name: VP8 | H264
+    props: Dict[str, Any] = field(default_factory=dict)
+    hardware: bool = False
+    out_caps: Optional[str] = None           # capsfilter right after the encoder
+    parser: Optional[str] = None
+    pay: str = "rtpvp8pay"
+    pay_props: Dict[str, Any] = field(default_factory=dict)
+    rtp_caps_extra: str = ""
+
+    def make(self, v: VideoConfig, name: Optional[str] = None) -> Gst.Element:
+        enc = Gst.ElementFactory.make(self.element, name or self.element)
+        if not enc:
+            raise RuntimeError(f"{self.element} not available")
+        for k, val in self.props.items():
+            try:
+                if isinstance(val, str):
+                    Gst.util_set_object_arg(enc, k, val)  # enum nicks
+                else:
+                    enc.set_property(k, val)
+            except Exception:
+                LOG.debug("%s: property %s not supported", self.element, k)
+        self.set_keyframe_interval(enc, max(1, int(v.fps * 2)))
+        self.set_bitrate(enc, int(v.bitrate))
+        return enc
+
+    def set_bitrate(self, enc: Gst.Element, bps: int) -> None:
+        if self.element == "vp8enc":
+            enc.set_property("target-bitrate", int(bps))
+        elif self.element == "x264enc":
+            enc.set_property("bitrate", max(1, int(bps) // 1000))   # kbit/s
+        elif self.element == "openh264enc":
+            enc.set_property("bitrate", int(bps))
+        elif self.element == "v4l2h264enc":
+            self._v4l2_controls(enc, video_bitrate=int(bps))
+
+    def set_keyframe_interval(self, enc: Gst.Element, frames: int) -> None:
+        try:
+            if self.element == "vp8enc":
+                enc.set_property("keyframe-max-dist", frames)
+            elif self.element == "x264enc":
+                enc.set_property("key-int-max", frames)
+            elif self.element == "openh264enc":
+                enc.set_property("gop-size", frames)
+            elif self.element == "v4l2h264enc":
+                self._v4l2_controls(enc, h264_i_frame_period=frames)
+        except Exception:
+            pass
+
+    @staticmethod
+    def _v4l2_controls(enc: Gst.Element, **ctrls) -> None:
+        cur = enc.get_property("extra-controls") or Gst.Structure.new_empty("controls")
+        for k, val in ctrls.items():
+            cur.set_value(k, int(val))
+        cur.set_value("repeat_sequence_header", 1)
+        enc.set_property("extra-controls", cur)
+
+    def make_pay(self, pt: int, name: str = "pay") -> Gst.Element:
+        """RTP payloader for this codec (shared by viewer branches and the benchmark)."""
+        pay = Gst.ElementFactory.make(self.pay, name)
+        if not pay:
+            raise RuntimeError(f"{self.pay} missing (apt install gstreamer1.0-plugins-good)")
+        pay.set_property("pt", int(pt))
+        for k, val in self.pay_props.items():
+            try:
+                if isinstance(val, str):
+                    Gst.util_set_object_arg(pay, k, val)
+                else:
+                    pay.set_property(k, val)
+            except Exception:
+                LOG.debug("%s: property %s not supported", self.pay, k)
+        return pay
+
+    def rtp_caps(self, pt: int) -> str:
+        return f"application/x-rtp,media=video,encoding-name={self.codec},payload={pt},clock-rate=90000{self.rtp_caps_extra}"
+
+_H264_RTP = ",packetization-mode=(string)1,profile-level-id=(string)42e01f"
+_H264_PAY = {"config-interval": -1, "aggregate-mode": "zero-latency"}
+
+# Preference order only breaks ties; selection is by measured CPU cost
+CANDIDATES: List[EncoderSpec] = [
+    EncoderSpec("v4l2h264enc", "H264", {}, hardware=True,
+                out_caps="video/x-h264,profile=constrained-baseline,level=(string)3.1",
+                parser="h264parse", pay="rtph264pay", pay_props=_H264_PAY, rtp_caps_extra=_H264_RTP),
+    EncoderSpec("vp8enc", "VP8", {"deadline": 1, "cpu-used": 8, "end-usage": 1, "error-resilient": 1, "threads": 2}),
+    EncoderSpec("openh264enc", "H264", {"complexity": "low", "rate-control": "bitrate", "usage-type": "screen"},
+                out_caps="video/x-h264,profile=constrained-baseline",
+                parser="h264parse", pay="rtph264pay", pay_props=_H264_PAY, rtp_caps_extra=_H264_RTP),
+    EncoderSpec("x264enc", "H264", {"tune": "zerolatency", "speed-preset": "ultrafast", "threads": 2},
+                out_caps="video/x-h264,profile=constrained-baseline",
+                parser="h264parse", pay="rtph264pay", pay_props=_H264_PAY, rtp_caps_extra=_H264_RTP),
+]
+BY_NAME = {s.element: s for s in CANDIDATES}
+DEFAULT = BY_NAME["vp8enc"]
+
+def available() -> List[EncoderSpec]:
+    return [s for s in CANDIDATES if Gst.ElementFactory.find(s.element) is not None]
+
+def benchmark(spec: EncoderSpec, v: VideoConfig, seconds: float = BENCH_SECONDS) -> Dict[str, Any]:
+    """
+    Encode `seconds` of videotestsrc at v's resolution/fps as fast as possible and report
+    encode fps plus process CPU per frame (time.process_time counts every thread, so only
+    call this in a process doing nothing else: see benchmark_isolated).
+    cpu_pct is the CPU that would be needed to keep up at the target fps (100 = one core).
+    """
+    frames = max(10, int(v.fps * seconds))
+    p = Gst.Pipeline.new(f"bench-{spec.element}")
+    src = Gst.ElementFactory.make("videotestsrc")
+    src.set_property("num-buffers", frames)
+    Gst.util_set_object_arg(src, "pattern", "smpte")
+    capsf = Gst.ElementFactory.make("capsfilter")
+    capsf.set_property("caps", Gst.Caps.from_string(
+        f"video/x-raw,format=I420,width={v.width},height={v.height},framerate={v.fps}/1"))
+    conv = Gst.ElementFactory.make("videoconvert")
+    enc = spec.make(v)
+    sink = Gst.ElementFactory.make("fakesink")
+    sink.set_property("sync", False)
+    chain = [src, capsf, conv, enc, sink]
+    for e in chain: p.add(e)
+    for a, b in zip(chain, chain[1:]):
+        if not a.link(b):
+            raise RuntimeError(f"bench link {a.name} -> {b.name} failed")
+
+    cpu0, t0 = time.process_time(), time.monotonic()
+    p.set_state(Gst.State.PLAYING)
+    msg = p.get_bus().timed_pop_filtered(int(BENCH_TIMEOUT * Gst.SECOND), Gst.MessageType.EOS | Gst.MessageType.ERROR)
+    cpu, wall = time.process_time() - cpu0, time.monotonic() - t0
+    p.set_state(Gst.State.NULL)
+    if msg is None or msg.type == Gst.MessageType.ERROR:
+        err = msg.parse_error()[0].message if msg is not None else "timeout"
+        return {"element": spec.element, "codec": spec.codec, "ok": False, "error": err}
+    enc_fps = frames / wall if wall > 0 else 0.0
+    return {
+        "element": spec.element, "codec": spec.codec, "ok": True, "hardware": spec.hardware,
+        "encode_fps": round(enc_fps, 1),
+        "cpu_pct": round(100.0 * cpu / (frames / v.fps), 1),
+        "realtime": enc_fps >= v.fps * REALTIME_MARGIN,
+    }
+
+def benchmark_isolated(spec: EncoderSpec, v: VideoConfig) -> Dict[str, Any]:
+    """
+    benchmark() in a fresh child process, so the CPU figure is the encoder's alone and not
+    the server's (viewers, warm standby) running alongside it.
+    """
+    cmd = [sys.executable, "-m", "server.encoders", "--bench", spec.element,
+           "--video", json.dumps(dataclasses.asdict(v))]
+    try:
+        proc = subprocess.run(cmd, cwd=str(ROOT), capture_output=True, text=True, timeout=BENCH_TIMEOUT + 20)
+    except subprocess.TimeoutExpired:
+        return {"element": spec.element, "codec": spec.codec, "ok": False, "error": "timeout"}
+    lines = [l for l in proc.stdout.splitlines() if l.startswith("{")]
+    if proc.returncode != 0 or not lines:
+        err = (proc.stderr.strip().splitlines() or ["no output"])[-1]
+        return {"element": spec.element, "codec": spec.codec, "ok": False, "error": err}
+    return json.loads(lines[-1])
+
+class EncoderRegistry:
+    """
+    Picks the cheapest encoder that keeps up in realtime and whose codec peers accept.
+    Benchmarks run once per (GStreamer version, resolution, fps) and are cached on disk,
+    so later startups only read a small JSON file. Bitrate is left out of the key: it is
+    changed live far more often and barely moves the ranking. Codecs rejected by a peer
+    are only remembered in memory, for PEER_REJECT_TTL: one odd browser must not steer
+    every later session.
+    """
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._bench_lock = threading.Lock()
+        self._cache: Optional[Dict[str, Any]] = None
+        self._rejected: Dict[str, float] = {}   # codec -> time.monotonic() it may be picked again
+
+    def _load(self) -> Dict[str, Any]:
+        if self._cache is None:
+            try:
+                self._cache = json.loads(self.path.read_text())
+            except Exception:
+                self._cache = {}
+            self._cache.setdefault("results", {})
+            self._cache.pop("peer_unsupported", None)  # written by older versions
+        return self._cache
+
+    def _save(self) -> None:
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(self._cache, indent=2))
+            tmp.replace(self.path)
+        except Exception as e:
+            LOG.warning("encoder cache write failed: %s", e)
+
+    @staticmethod
+    def key(v: VideoConfig) -> str:
+        return f"gst-{Gst.version_string()}|{v.width}x{v.height}@{v.fps}"
+
+    def results(self, v: VideoConfig, cached_only: bool = False) -> Optional[List[Dict[str, Any]]]:
+        """Benchmark results for this config, benchmarking on a miss (None if cached_only)."""
+        k = self.key(v)
+        with self._lock:
+            hit = self._load()["results"].get(k)
+        if hit is not None or cached_only:
+            return hit
+        # _lock only guards the dict, so a cached_only caller never waits on a benchmark
+        with self._bench_lock:
+            with self._lock:
+                hit = self._load()["results"].get(k)
+            if hit is not None:
+                return hit
+            res = []
+            for spec in available():
+                LOG.info("Benchmarking %s at %dx%d@%d…", spec.element, v.width, v.height, v.fps)
+                try:
+                    res.append(benchmark_isolated(spec, v))
+                except Exception as e:
+                    res.append({"element": spec.element, "codec": spec.codec, "ok": False, "error": str(e)})
+                LOG.info("  %s", res[-1])
+            with self._lock:
+                self._cache["results"][k] = res
+                self._save()
+            return res
+
+    def select(self, v: VideoConfig, peer_codecs: Optional[Iterable[str]] = None,
+               cached_only: bool = False) -> EncoderSpec:
+        """
+        video.encoder pins an element; "auto" picks from the benchmark results. With
+        cached_only (pipeline build on the GLib thread) a cold cache falls back to vp8enc
+        instead of stalling for the benchmark; warm() fills it at startup.
+        """
+        if v.encoder != "auto":
+            spec = BY_NAME.get(v.encoder)
+            if spec is None or Gst.ElementFactory.find(spec.element) is None:
+                LOG.warning("encoder %s unavailable; falling back to vp8enc", v.encoder)
+                return DEFAULT
+            return spec
+        allowed = {c.upper() for c in peer_codecs} if peer_codecs else None
+        rejected = self.rejected()
+        results = self.results(v, cached_only=cached_only)
+        if results is None:
+            LOG.info("No encoder benchmark cached for %s yet; using vp8enc", self.key(v))
+            return DEFAULT
+        ok = [r for r in results if r.get("ok") and r.get("realtime")
+              and r["codec"] not in rejected and (allowed is None or r["codec"] in allowed)]
+        if not ok:
+            return DEFAULT
+        best = min(ok, key=lambda r: r["cpu_pct"])
+        return BY_NAME.get(best["element"], DEFAULT)
+
+    def warm(self, v: VideoConfig) -> None:
+        """Blocking (run in an executor): make sure this config has benchmark results."""
+        if v.encoder == "auto":
+            self.results(v)
+
+    def peer_rejected(self, codec: str) -> None:
+        """A peer's SDP answer lacked this codec: avoid it in auto-selection for a while."""
+        with self._lock:
+            self._rejected[codec] = time.monotonic() + PEER_REJECT_TTL
+        LOG.warning("Peer rejected %s; auto-selection will avoid it for %.0fs", codec, PEER_REJECT_TTL)
+
+    def rejected(self) -> List[str]:
+        """Codecs currently kept out of auto-selection."""
+        now = time.monotonic()
+        with self._lock:
+            self._rejected = {c: t for c, t in self._rejected.items() if t > now}
+            return sorted(self._rejected)
+
+    def summary(self, v: VideoConfig) -> Dict[str, Any]:
+        rejected = self.rejected()
+        with self._lock:
+            cache = self._load()
+            return {"key": self.key(v), "results": cache["results"].get(self.key(v)),
+                    "peer_unsupported": rejected}
+
+REGISTRY = EncoderRegistry()
+
+def main(argv=None) -> int:
+    """Child side of benchmark_isolated: one candidate, result as a JSON line on stdout."""
+    ap = argparse.ArgumentParser(prog="python -m server.encoders", description="Benchmark one encoder")
+    ap.add_argument("--bench", required=True, help="encoder element")
+    ap.add_argument("--video", default="{}", help="VideoConfig fields as JSON")
+    a = ap.parse_args(argv)
+    from .preflight import gst_init
+    gst_init()
+    spec = BY_NAME.get(a.bench)
+    if spec is None:
+        print(f"unknown encoder {a.bench}", file=sys.stderr)
+        return 2
+    print(json.dumps(benchmark(spec, VideoConfig(**json.loads(a.video)))))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
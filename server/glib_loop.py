@@ -0,0 +1,177 @@
+import asyncio
+import json
+import logging
+import threading
+from collections import deque
+from typing import Any, Callable, Dict, Optional
+
+from gi.repository import GLib
+
+LOG = logging.getLogger("glib")
+
+class GLibLoop:
+    """
+    Runs the default GLib main context on a dedicated thread. Bus signal watches,
+    GLib timeouts and every call into webrtcbin are dispatched here, so GStreamer
+    callbacks never depend on whichever thread happens to iterate the context.
+    """
+    def __init__(self):
+        self._loop: Optional[GLib.MainLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._ident: Optional[int] = None
+
+    @property
+    def running(self) -> bool:
+        return self._loop is not None and self._loop.is_running()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._loop = GLib.MainLoop.new(None, False)
+        ready = threading.Event()
+        def _ready():
+            ready.set()
+            return False
+        def _run():
+            self._ident = threading.get_ident()
+            GLib.idle_add(_ready)
+            self._loop.run()
+        self._thread = threading.Thread(target=_run, name="glib-main", daemon=True)
+        self._thread.start()
+        if not ready.wait(2.0):
+            LOG.warning("GLib main loop slow to start")
+        LOG.info("GLib main loop running")
+
+    def stop(self) -> None:
+        if self._loop is not None:
+            self._loop.quit()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+        self._loop = None
+        self._thread = None
+        self._ident = None
+
+    def in_loop(self) -> bool:
+        return threading.get_ident() == self._ident
+
+    def call(self, fn: Callable, *args) -> None:
+        """Fire-and-forget: run fn(*args) on the GLib thread (inline if already there)."""
+        if self.in_loop():
+            fn(*args)
+            return
+        def _once():
+            try:
+                fn(*args)
+            except Exception:
+                LOG.exception("GLib call %s failed", getattr(fn, "__name__", fn))
+            return False
+        GLib.idle_add(_once)
+
+    def run(self, fn: Callable, *args) -> "asyncio.Future":
+        """Run fn(*args) on the GLib thread and await its result from asyncio."""
+        aloop = asyncio.get_running_loop()
+        fut = aloop.create_future()
+        def _done(ok: bool, val: Any):
+            if fut.cancelled():
+                return
+            if ok: fut.set_result(val)
+            else: fut.set_exception(val)
+        def _once():
+            try:
+                res = fn(*args)
+                aloop.call_soon_threadsafe(_done, True, res)
+            except Exception as e:
+                aloop.call_soon_threadsafe(_done, False, e)
+            return False
+        GLib.idle_add(_once)
+        return fut
+
+    def timeout(self, ms: int, fn: Callable[[], bool]) -> int:
+        """Repeat fn every ms on the GLib thread while it returns True."""
+        return GLib.timeout_add(int(ms), fn)
+
+    def cancel(self, source_id: int) -> None:
+        try:
+            GLib.source_remove(source_id)
+        except Exception:
+            pass
+
+_GLIB: Optional[GLibLoop] = None
+
+def glib_loop() -> GLibLoop:
+    """Process-wide GLib loop, started on first use."""
+    global _GLIB
+    if _GLIB is None:
+        _GLIB = GLibLoop()
+    _GLIB.start()
+    return _GLIB
+
+class SignalingQueue:
+    """
+    Bounded outbound signaling queue for one viewer. Producers are GStreamer/GLib
+    threads; the asyncio loop is woken at most once per burst and flushes everything
+    queued so far as a single frame ({"type": "batch", "messages": [...]} for >1).
+    On overflow the oldest ICE candidate is dropped; offers/answers are never dropped.
+    """
+    def __init__(self, send: Callable[[str], Any], loop: asyncio.AbstractEventLoop, maxsize: int = 256):
+        self._send = send
+        self._loop = loop
+        self._maxsize = maxsize
+        self._q: deque = deque()
+        self._lock = threading.Lock()
+        self._scheduled = False
+        self._closed = False
+        self._send_lock = asyncio.Lock()
+        self.sent_frames = 0
+        self.sent_messages = 0
+        self.dropped = 0
+
+    def put(self, payload: Dict[str, Any]) -> None:
+        """Thread-safe enqueue."""
+        with self._lock:
+            if self._closed:
+                return
+            if len(self._q) >= self._maxsize and not self._drop_one_ice():
+                self.dropped += 1
+                LOG.warning("signaling queue full; dropping %s", payload.get("type"))
+                return
+            self._q.append(payload)
+            wake = not self._scheduled
+            self._scheduled = True
+        if wake:
+            try:
+                self._loop.call_soon_threadsafe(self._kick)
+            except RuntimeError:
+                pass  # loop closed: viewer is gone
+
+    def _drop_one_ice(self) -> bool:
+        for i, m in enumerate(self._q):
+            if m.get("type") == "ice":
+                del self._q[i]
+                self.dropped += 1
+                return True
+        return False
+
+    def _kick(self) -> None:
+        asyncio.ensure_future(self._flush())
+
+    async def _flush(self) -> None:
+        async with self._send_lock:
+            with self._lock:
+                batch = list(self._q)
+                self._q.clear()
+                self._scheduled = False
+            if not batch or self._closed:
+                return
+            frame = batch[0] if len(batch) == 1 else {"type": "batch", "messages": batch}
+            try:
+                await self._send(json.dumps(frame))
+                self.sent_frames += 1
+                self.sent_messages += len(batch)
+            except Exception as e:
+                LOG.warning("signaling send failed: %s", e)
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            self._q.clear()
@@ -0,0 +1,482 @@
+"""
+Multi-viewer load test with headless WebRTC receivers.
+
+    python -m server.loadtest --spawn --ramp 1,2,4,8 --hold 15 --signaling ws,whep --out load.json
+    python -m server.loadtest --url http://127.0.0.1:8080 --server-pid 1234 --ramp 1,4
+    python -m server.loadtest --spawn --streams 2 --ramp 2,4,8
+
+Each simulated viewer is a local webrtcbin (no STUN/TURN: host candidates only) that
+answers the server's /ws offer, or offers to /whep, and feeds a depayloader (optionally
+a decoder) into a fakesink whose pad probe counts frames. Viewers are added in steps;
+at every step the tool holds for --hold seconds and reports per-viewer connect time,
+time to first frame, received fps and frame-interval jitter, plus the server's CPU and
+RSS from /proc. --spawn starts a throwaway server on a free localhost port with the
+videotestsrc source (via REVCAM_CONFIG), so nothing touches the real config or camera.
+With --streams N viewers are spread round-robin over N streams (?stream=); --spawn then
+configures N test streams, each with its own videotestsrc pattern and pipeline.
+"""
+import argparse
+import asyncio
+import dataclasses
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+import yaml
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GstWebRTC', '1.0')
+gi.require_version('GstSdp', '1.0')
+from gi.repository import Gst, GstWebRTC, GstSdp
+
+from .config import Config, StreamConfig, config_to_dict
+from .glib_loop import glib_loop
+
+# Receive caps offered to /whep, in preference order
+RECV_CAPS = {
+    "VP8": "application/x-rtp,media=video,encoding-name=VP8,payload=96,clock-rate=90000",
+    "H264": "application/x-rtp,media=video,encoding-name=H264,payload=102,clock-rate=90000,"
+            "packetization-mode=(string)1,profile-level-id=(string)42e01f",
+}
+# Receiver branch per codec: frames are counted on the fakesink
+RECV_BRANCH = {
+    "VP8": ("rtpvp8depay", "vp8dec"),
+    "H264": ("rtph264depay ! video/x-h264,alignment=au", "decodebin"),
+}
+
+# videotestsrc patterns for the streams of a spawned server (one per stream, cycled)
+TEST_PATTERNS = ("ball", "smpte", "pinwheel", "circular", "snow", "gradient")
+
+def _pct(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    s = sorted(values)
+    return round(s[min(len(s) - 1, int(q * len(s)))], 1)
+
+def _parse_sdp(sdp_text: str, sdp_type) -> GstWebRTC.WebRTCSessionDescription:
+    ok, sdp = GstSdp.SDPMessage.new()
+    if ok != GstSdp.SDPResult.OK: raise RuntimeError("SDPMessage.new failed")
+    if GstSdp.sdp_message_parse_buffer(sdp_text.encode(), sdp) != GstSdp.SDPResult.OK:
+        raise RuntimeError("SDP parse failed")
+    return GstWebRTC.WebRTCSessionDescription.new(sdp_type, sdp)
+
+class ProcStats:
+    """CPU seconds, RSS and thread count of a process from /proc (Linux)."""
+    TICK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+    def __init__(self, pid: int):
+        self.pid = pid
+
+    def sample(self) -> Optional[Dict[str, float]]:
+        try:
+            with open(f"/proc/{self.pid}/stat") as f:
+                # comm may contain spaces; fields after ")" are fixed
+                fields = f.read().rsplit(")", 1)[1].split()
+            rss = 0.0
+            with open(f"/proc/{self.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        rss = int(line.split()[1]) / 1024.0
+        except (OSError, IndexError, ValueError):
+            return None
+        return {"t": time.monotonic(), "cpu_s": (int(fields[11]) + int(fields[12])) / self.TICK,
+                "rss_mb": round(rss, 1), "threads": int(fields[17])}
+
+    @staticmethod
+    def cpu_pct(a: Optional[Dict[str, float]], b: Optional[Dict[str, float]]) -> Optional[float]:
+        if not a or not b or b["t"] <= a["t"]:
+            return None
+        return round(100.0 * (b["cpu_s"] - a["cpu_s"]) / (b["t"] - a["t"]), 1)
+
+class Viewer:
+    """One headless receiver: webrtcbin → depayloader [→ decoder] → fakesink."""
+    def __init__(self, idx: int, signaling: str, decode: bool, codecs: List[str], stream: str = ""):
+        self.name = f"viewer{idx}"
+        self.signaling = signaling
+        self.stream = stream
+        self.query = f"?stream={stream}" if stream else ""
+        self.decode = decode
+        self.codecs = codecs
+        self.pipeline: Optional[Gst.Pipeline] = None
+        self.webrtc: Optional[Gst.Element] = None
+        self.send = None          # set by the ws runner: dict → server (thread-safe)
+        self.codec: Optional[str] = None
+        self.error: Optional[str] = None
+        self._lock = threading.Lock()
+        self._on_offer = None
+        self.t_start = time.monotonic()
+        self.t_answer: Optional[float] = None
+        self.t_connected: Optional[float] = None
+        self.t_first_frame: Optional[float] = None
+        self.frames = 0
+        self._window: List[float] = []
+        self._measuring = False
+
+    # ---- GLib thread ----
+    def build(self) -> None:
+        p = Gst.Pipeline.new(self.name)
+        webrtc = Gst.ElementFactory.make("webrtcbin", "webrtc")
+        if webrtc is None:
+            raise RuntimeError("webrtcbin missing (apt install gstreamer1.0-plugins-bad)")
+        webrtc.set_property("bundle-policy", GstWebRTC.WebRTCBundlePolicy.MAX_BUNDLE)
+        p.add(webrtc)
+        webrtc.connect("pad-added", self._on_pad_added)
+        webrtc.connect("on-ice-candidate", self._on_ice_candidate)
+        webrtc.connect("notify::connection-state", self._on_connection_state)
+        self.pipeline, self.webrtc = p, webrtc
+        p.set_state(Gst.State.PLAYING)
+
+    def handle_offer(self, sdp_text: str) -> None:
+        """/ws: the server offers, we answer."""
+        # Promises resolve on webrtcbin threads; finish each step on the GLib loop
+        def set_answer(answer):
+            if self.webrtc is None:
+                return
+            self.webrtc.emit("set-local-description", answer, Gst.Promise.new())
+            self.t_answer = time.monotonic()
+            if self.send is not None:
+                self.send({"type": "answer", "sdp": answer.sdp.as_text()})
+        def on_answer(promise, _):
+            reply = promise.get_reply()
+            answer = reply.get_value("answer") if reply is not None else None
+            if answer is None:
+                self.error = "create-answer failed"
+                return
+            glib_loop().call(set_answer, answer)
+        def create_answer():
+            if self.webrtc is not None:
+                self.webrtc.emit("create-answer", None, Gst.Promise.new_with_change_func(on_answer, None))
+        def on_remote(_promise, _):
+            glib_loop().call(create_answer)
+        offer = _parse_sdp(sdp_text, GstWebRTC.WebRTCSDPType.OFFER)
+        self.webrtc.emit("set-remote-description", offer, Gst.Promise.new_with_change_func(on_remote, None))
+
+    def make_offer(self, on_offer) -> None:
+        """/whep: we offer recvonly; on_offer(sdp) fires once ICE gathering is complete."""
+        caps = Gst.Caps.from_string("; ".join(RECV_CAPS[c] for c in self.codecs))
+        self.webrtc.emit("add-transceiver", GstWebRTC.WebRTCRTPTransceiverDirection.RECVONLY, caps)
+        self._on_offer = on_offer
+        self.webrtc.connect("notify::ice-gathering-state", self._on_gathering)
+        def set_offer(offer):
+            if self.webrtc is not None:
+                self.webrtc.emit("set-local-description", offer, Gst.Promise.new())
+        def on_created(promise, _):
+            reply = promise.get_reply()
+            offer = reply.get_value("offer") if reply is not None else None
+            if offer is None:
+                self.error = "create-offer failed"
+                return
+            glib_loop().call(set_offer, offer)
+        self.webrtc.emit("create-offer", None, Gst.Promise.new_with_change_func(on_created, None))
+
+    def _on_gathering(self, webrtc, _pspec):
+        if webrtc.get_property("ice-gathering-state") != GstWebRTC.WebRTCICEGatheringState.COMPLETE:
+            return
+        cb, self._on_offer = self._on_offer, None
+        desc = webrtc.get_property("local-description")
+        if cb is not None and desc is not None:
+            cb(desc.sdp.as_text())
+
+    def handle_answer(self, sdp_text: str) -> None:
+        self.t_answer = time.monotonic()
+        answer = _parse_sdp(sdp_text, GstWebRTC.WebRTCSDPType.ANSWER)
+        self.webrtc.emit("set-remote-description", answer, Gst.Promise.new())
+
+    def add_ice(self, candidate: str, sdp_mline_index: int) -> None:
+        if self.webrtc is not None:
+            self.webrtc.emit("add-ice-candidate", int(sdp_mline_index), candidate)
+
+    def _on_ice_candidate(self, _webrtc, mlineindex, candidate):
+        if self.send is not None:
+            self.send({"type": "ice", "candidate": candidate, "sdpMLineIndex": int(mlineindex)})
+
+    def _on_connection_state(self, webrtc, _pspec):
+        state = webrtc.get_property("connection-state")
+        if state == GstWebRTC.WebRTCPeerConnectionState.CONNECTED and self.t_connected is None:
+            self.t_connected = time.monotonic()
+        elif state == GstWebRTC.WebRTCPeerConnectionState.FAILED:
+            self.error = "connection failed"
+
+    def _on_pad_added(self, _webrtc, pad):
+        if pad.get_direction() != Gst.PadDirection.SRC:
+            return
+        caps = pad.get_current_caps() or pad.query_caps(None)
+        self.codec = caps.get_structure(0).get_string("encoding-name")
+        if self.codec not in RECV_BRANCH:
+            self.error = f"unexpected codec {self.codec}"
+            return
+        depay, dec = RECV_BRANCH[self.codec]
+        desc = f"queue ! {depay} ! " + (f"{dec} ! " if self.decode else "") + "fakesink name=sink sync=false async=false"
+        branch = Gst.parse_bin_from_description(desc, True)
+        self.pipeline.add(branch)
+        branch.sync_state_with_parent()
+        pad.link(branch.get_static_pad("sink"))
+        branch.get_by_name("sink").get_static_pad("sink").add_probe(Gst.PadProbeType.BUFFER, self._on_frame)
+
+    # ---- streaming thread ----
+    def _on_frame(self, _pad, _info):
+        now = time.monotonic()
+        with self._lock:
+            self.frames += 1
+            if self.t_first_frame is None:
+                self.t_first_frame = now
+                if self.send is not None:
+                    self.send({"type": "first-frame"})
+            if self._measuring:
+                self._window.append(now)
+        return Gst.PadProbeReturn.OK
+
+    # ---- measurement (any thread) ----
+    def begin_window(self) -> None:
+        with self._lock:
+            self._window = []
+            self._measuring = True
+
+    def end_window(self) -> Dict[str, Any]:
+        with self._lock:
+            self._measuring = False
+            arrivals = self._window
+        ms = lambda t: round((t - self.t_start) * 1000.0, 1) if t is not None else None
+        out = {"name": self.name, "stream": self.stream, "signaling": self.signaling, "codec": self.codec, "error": self.error,
+               "answer_ms": ms(self.t_answer), "connect_ms": ms(self.t_connected), "ttff_ms": ms(self.t_first_frame),
+               "frames": len(arrivals), "fps": 0.0, "jitter_ms": None, "interval_p99_ms": None}
+        if len(arrivals) >= 2:
+            intervals = [(b - a) * 1000.0 for a, b in zip(arrivals, arrivals[1:])]
+            out["fps"] = round((len(arrivals) - 1) / (arrivals[-1] - arrivals[0]), 2)
+            out["jitter_ms"] = round(statistics.pstdev(intervals), 2)
+            out["interval_p99_ms"] = _pct(intervals, 0.99)
+        return out
+
+    def stop(self) -> None:
+        """Blocking; call from a worker thread."""
+        if self.pipeline is not None:
+            self.pipeline.set_state(Gst.State.NULL)
+        self.pipeline = None
+        self.webrtc = None
+
+# ---- signaling (asyncio) ----
+async def run_ws(v: Viewer, session: aiohttp.ClientSession, base: str) -> None:
+    loop, glib = asyncio.get_running_loop(), glib_loop()
+    url = "ws" + base[len("http"):] + "/ws" + v.query
+    async with session.ws_connect(url) as ws:
+        def send(msg: Dict[str, Any]) -> None:
+            loop.call_soon_threadsafe(lambda: asyncio.ensure_future(ws.send_str(json.dumps(msg))))
+        v.send = send
+        await glib.run(v.build)
+        async for msg in ws:
+            if msg.type != aiohttp.WSMsgType.TEXT:
+                break
+            data = json.loads(msg.data)
+            for m in (data.get("messages") or []) if data.get("type") == "batch" else [data]:
+                t = m.get("type")
+                if t == "offer":
+                    glib.call(v.handle_offer, m.get("sdp", ""))
+                elif t == "ice":
+                    glib.call(v.add_ice, m.get("candidate", ""), int(m.get("sdpMLineIndex", 0)))
+                elif t == "error":
+                    v.error = f"server error: {m.get('reason')}"
+    v.send = None
+
+async def run_whep(v: Viewer, session: aiohttp.ClientSession, base: str) -> None:
+    loop, glib = asyncio.get_running_loop(), glib_loop()
+    offered = loop.create_future()
+    await glib.run(v.build)
+    await glib.run(v.make_offer, lambda sdp: loop.call_soon_threadsafe(lambda: offered.done() or offered.set_result(sdp)))
+    offer = await offered
+    async with session.post(base + "/whep" + v.query, data=offer, headers={"Content-Type": "application/sdp"}) as r:
+        if r.status != 201:
+            v.error = f"WHEP POST {r.status}: {(await r.text()).strip()}"
+            return
+        location = r.headers.get("Location", "")
+        answer = await r.text()
+    glib.call(v.handle_answer, answer)
+    try:
+        await asyncio.Event().wait()  # hold the session until cancelled
+    finally:
+        if location:
+            try:
+                async with session.delete(base + location):
+                    pass
+            except aiohttp.ClientError:
+                pass
+
+# ---- server under test ----
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def spawn_server(a, workdir: str) -> Tuple[subprocess.Popen, str]:
+    cfg = Config()
+    cfg.server.host, cfg.server.port = "127.0.0.1", _free_port()
+    cfg.webrtc.stun_servers = []
+    v = cfg.video
+    v.source, v.encoder = "test", a.encoder
+    v.width, v.height = (int(n) for n in a.res.lower().split("x"))
+    v.fps, v.bitrate = a.fps, a.bitrate
+    cfg.recording.enabled = False
+    if a.streams > 1:
+        cfg.streams = [StreamConfig(f"cam{i}", dataclasses.replace(v, camera=TEST_PATTERNS[i % len(TEST_PATTERNS)]))
+                       for i in range(a.streams)]
+    path = os.path.join(workdir, "config.yaml")
+    with open(path, "w") as f:
+        yaml.safe_dump(config_to_dict(cfg), f, sort_keys=False)
+    log = open(os.path.join(workdir, "server.log"), "w")
+    proc = subprocess.Popen([sys.executable, "-m", "server.app"], stdout=log, stderr=subprocess.STDOUT,
+                            env={**os.environ, "REVCAM_CONFIG": path})
+    return proc, f"http://127.0.0.1:{cfg.server.port}"
+
+async def wait_ready(session: aiohttp.ClientSession, base: str, timeout: float) -> Optional[List[str]]:
+    """Stream names once /api/ready says GStreamer is up (404: server predates it); None on timeout."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(base + "/api/ready") as r:
+                ready = r.status in (200, 404)
+            if ready:
+                async with session.get(base + "/api/config") as r:
+                    if r.status == 200:
+                        return [s["name"] for s in (await r.json()).get("streams") or []]
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.2)
+    return None
+
+# ---- ramp ----
+def _summary(level: int, views: List[Dict[str, Any]], server: Dict[str, Any], client_cpu: Optional[float]) -> Dict[str, Any]:
+    ok = [r for r in views if r["error"] is None and r["frames"] > 0]
+    vals = lambda k: [r[k] for r in ok if r[k] is not None]
+    streams: Dict[str, Dict[str, Any]] = {}
+    for r in views:
+        st = streams.setdefault(r["stream"] or "", {"viewers": 0, "receiving": 0, "fps_min": None})
+        st["viewers"] += 1
+        if r in ok:
+            st["receiving"] += 1
+            st["fps_min"] = r["fps"] if st["fps_min"] is None else min(st["fps_min"], r["fps"])
+    return {
+        "viewers": level,
+        "receiving": len(ok),
+        "failed": [r["name"] for r in views if r not in ok],
+        "server": server,
+        "client_cpu_pct": client_cpu,
+        "fps": {"min": min(vals("fps"), default=None), "median": _pct(vals("fps"), 0.5)},
+        "connect_ms": {"p50": _pct(vals("connect_ms"), 0.5), "p90": _pct(vals("connect_ms"), 0.9), "max": max(vals("connect_ms"), default=None)},
+        "ttff_ms": {"p50": _pct(vals("ttff_ms"), 0.5), "p90": _pct(vals("ttff_ms"), 0.9), "max": max(vals("ttff_ms"), default=None)},
+        "jitter_ms": {"median": _pct(vals("jitter_ms"), 0.5), "max": max(vals("jitter_ms"), default=None)},
+        "streams": streams,
+        "per_viewer": views,
+    }
+
+async def ramp(a, base: str, server_pid: Optional[int], streams: List[str]) -> List[Dict[str, Any]]:
+    """streams: names viewers are spread over, round-robin ([""] = the server's default)."""
+    modes = [m.strip() for m in a.signaling.split(",") if m.strip()]
+    codecs = [c.strip().upper() for c in a.codecs.split(",") if c.strip()]
+    server = ProcStats(server_pid) if server_pid else None
+    me = ProcStats(os.getpid())
+    viewers: List[Viewer] = []
+    tasks: List[asyncio.Task] = []
+    levels = []
+    async with aiohttp.ClientSession() as session:
+        try:
+            for level in [int(n) for n in a.ramp.split(",")]:
+                while len(viewers) < level:
+                    i = len(viewers)
+                    v = Viewer(i, modes[i % len(modes)], a.decode, codecs, streams[i % len(streams)])
+                    runner = run_ws if v.signaling == "ws" else run_whep
+                    viewers.append(v)
+                    tasks.append(asyncio.ensure_future(runner(v, session, base)))
+                    await asyncio.sleep(a.stagger)
+                # Give the new viewers until their first frame (or the timeout)
+                deadline = time.monotonic() + a.connect_timeout
+                while time.monotonic() < deadline and any(v.t_first_frame is None and v.error is None for v in viewers):
+                    await asyncio.sleep(0.1)
+                for v in viewers:
+                    v.begin_window()
+                s0, c0 = server.sample() if server else None, me.sample()
+                await asyncio.sleep(a.hold)
+                s1, c1 = server.sample() if server else None, me.sample()
+                views = [v.end_window() for v in viewers]
+                srv = {"cpu_pct": ProcStats.cpu_pct(s0, s1), "rss_mb": s1["rss_mb"], "threads": s1["threads"]} if s1 else {}
+                summary = _summary(level, views, srv, ProcStats.cpu_pct(c0, c1))
+                levels.append(summary)
+                print(f"{level:3d} viewers: {summary['receiving']} receiving, fps min {summary['fps']['min']}, "
+                      f"ttff p90 {summary['ttff_ms']['p90']} ms, jitter max {summary['jitter_ms']['max']} ms, "
+                      f"server cpu {srv.get('cpu_pct')}% rss {srv.get('rss_mb')} MB", file=sys.stderr)
+        finally:
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*(loop.run_in_executor(None, v.stop) for v in viewers), return_exceptions=True)
+    return levels
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m server.loadtest", description="Multi-viewer WebRTC load test")
+    ap.add_argument("--url", help="server base URL (default: spawn one with --spawn)")
+    ap.add_argument("--server-pid", type=int, help="PID of the server at --url, for CPU/RSS")
+    ap.add_argument("--spawn", action="store_true", help="start a throwaway localhost server with the test source")
+    ap.add_argument("--ramp", default="1,2,4,8", help="comma list of cumulative viewer counts")
+    ap.add_argument("--hold", type=float, default=15.0, help="measured seconds at each step")
+    ap.add_argument("--stagger", type=float, default=0.2, help="seconds between viewer joins")
+    ap.add_argument("--connect-timeout", type=float, default=15.0, help="max wait for first frames per step")
+    ap.add_argument("--signaling", default="ws", help="comma list, round-robin per viewer: ws,whep")
+    ap.add_argument("--codecs", default="VP8,H264", help="codecs WHEP viewers offer")
+    ap.add_argument("--streams", type=int, default=1, help="spread viewers over this many streams (--spawn: test streams to configure)")
+    ap.add_argument("--decode", action="store_true", help="decode frames (default: count depayloaded frames)")
+    ap.add_argument("--encoder", default="vp8enc", help="--spawn: server encoder")
+    ap.add_argument("--res", default="960x540", help="--spawn: WxH")
+    ap.add_argument("--fps", type=int, default=25, help="--spawn: frame rate")
+    ap.add_argument("--bitrate", type=int, default=1200000, help="--spawn: bps")
+    ap.add_argument("--out", help="write JSON results here (default: stdout)")
+    a = ap.parse_args(argv)
+    if not a.url and not a.spawn:
+        ap.error("give --url or --spawn")
+
+    Gst.init(None)
+    proc, workdir = None, tempfile.mkdtemp(prefix="revcam-load-")
+    base, pid = (a.url or "").rstrip("/"), a.server_pid
+    if a.spawn:
+        proc, base = spawn_server(a, workdir)
+        pid = proc.pid
+
+    async def _run() -> List[Dict[str, Any]]:
+        async with aiohttp.ClientSession() as s:
+            names = await wait_ready(s, base, 30.0)
+        if names is None:
+            raise RuntimeError(f"server at {base} not ready (log: {workdir}/server.log)")
+        if a.streams > len(names):
+            raise RuntimeError(f"--streams {a.streams}: server has {len(names)} ({', '.join(names)})")
+        return await ramp(a, base, pid, names[:a.streams] if a.streams > 1 else [""])
+
+    try:
+        levels = asyncio.run(_run())
+    finally:
+        glib_loop().stop()
+        if proc is not None:
+            proc.terminate()
+            try: proc.wait(timeout=10)
+            except subprocess.TimeoutExpired: proc.kill()
+    report = {
+        "meta": {"url": base, "spawned": bool(proc), "gstreamer": Gst.version_string(), "cpus": os.cpu_count(),
+                 "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "args": vars(a)},
+        "levels": levels,
+    }
+    text = json.dumps(report, indent=2)
+    if a.out:
+        with open(a.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0 if levels and all(not l["failed"] for l in levels) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
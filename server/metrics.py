@@ -0,0 +1,278 @@
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+LOG = logging.getLogger("metrics")
+
+# Upper bounds in seconds; sized for 25–30 fps (a frame period is ~33–40 ms)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.02, 0.04, 0.08, 0.16, 0.32, 0.64)
+# Session setup, join to first decoded frame (client-reported)
+FIRST_FRAME_BUCKETS = (0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0)
+# Time between consecutive encoded frames (40 ms at 25 fps)
+INTERVAL_BUCKETS = (0.01, 0.02, 0.03, 0.035, 0.04, 0.045, 0.05, 0.06, 0.08, 0.12, 0.25, 0.5, 1.0)
+# In-flight samples kept per stage; leaky queues drop buffers that never reach the src pad
+MAX_INFLIGHT = 32
+
+SHARED_STAGES = ("src", "vconv", "vflip", "q1", "overlay", "qenc", "enc")
+DROP_QUEUES = ("q1", "qenc")
+
+def _esc(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_esc(v)}"' for k, v in labels.items()) + "}"
+
+def merge_expositions(parts: List[Tuple[Dict[str, str], str]]) -> str:
+    """
+    Merge several text expositions (one per stream pipeline) into one: each metric family
+    keeps a single HELP/TYPE header and every sample gains the part's labels.
+    """
+    headers: Dict[str, List[str]] = {}
+    samples: Dict[str, List[str]] = {}
+    for labels, text in parts:
+        extra = _labels(labels)[1:-1]
+        family = ""
+        for line in text.splitlines():
+            if not line:
+                continue
+            if line.startswith("#"):
+                family = line.split(maxsplit=3)[2]
+                if line not in headers.setdefault(family, []):
+                    headers[family].append(line)
+                continue
+            samples.setdefault(family, [])
+            if not extra:
+                samples[family].append(line)
+            elif "{" in line.split(" ", 1)[0]:
+                samples[family].append(line.replace("{", "{" + extra + ",", 1))
+            else:
+                name, value = line.split(" ", 1)
+                samples[family].append(f"{name}{{{extra}}} {value}")
+    out: List[str] = []
+    for family, head in headers.items():
+        out += head + samples.get(family, [])
+    return "\n".join(out) + "\n"
+
+class Histogram:
+    """Cumulative Prometheus histogram with fixed buckets."""
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, v: float) -> None:
+        self.total += 1
+        self.sum += v
+        for i, le in enumerate(self.buckets):
+            if v <= le:
+                self.counts[i] += 1
+                break
+
+    def render(self, name: str, labels: Dict[str, str]) -> List[str]:
+        out, acc = [], 0
+        for le, c in zip(self.buckets, self.counts):
+            acc += c
+            out.append(f"{name}_bucket{_labels({**labels, 'le': repr(le)})} {acc}")
+        out.append(f"{name}_bucket{_labels({**labels, 'le': '+Inf'})} {self.total}")
+        out.append(f"{name}_sum{_labels(labels)} {self.sum:.6f}")
+        out.append(f"{name}_count{_labels(labels)} {self.total}")
+        return out
+
+class PipelineMetrics:
+    """
+    Buffer pad probes on the named pipeline elements. Frame counters run on every buffer;
+    latency (time between an element's sink and src pad, matched by PTS) is only timed on
+    every `sample_every`-th buffer so the probes stay cheap enough to leave on.
+    """
+    def __init__(self, sample_every: int = 10):
+        self.sample_every = max(0, int(sample_every))
+        self.latency: Dict[str, Histogram] = {}
+        self.frames: Dict[str, int] = {}
+        self.drops: Dict[str, int] = {q: 0 for q in DROP_QUEUES}
+        self.enc_bytes = 0
+        self.enc_frames = 0
+        self.enc_keyframes = 0
+        self.first_frame = Histogram(FIRST_FRAME_BUCKETS)
+        # Encoder output cadence: interval histogram + RFC 3550-style smoothed jitter
+        self.frame_interval = Histogram(INTERVAL_BUCKETS)
+        self.frame_jitter = 0.0
+        self._last_enc: Optional[int] = None
+        self._last_interval: Optional[float] = None
+        self._bitrate_snap: Tuple[float, int] = (time.monotonic(), 0)
+        self._bitrate_bps = 0.0
+        self._probes: List[Tuple[Gst.Pad, int]] = []
+        self._signals: List[Tuple[Gst.Element, int]] = []
+        self.encoder_labels: Dict[str, str] = {}
+
+    # ---- attach/detach ----
+    def attach(self, pipeline: Gst.Pipeline, encoder_labels: Optional[Dict[str, str]] = None) -> None:
+        self.encoder_labels = dict(encoder_labels or {})
+        for name in SHARED_STAGES:
+            el = pipeline.get_by_name(name)
+            if el is None:
+                continue
+            self._instrument(el, name)
+        for name in DROP_QUEUES:
+            q = pipeline.get_by_name(name)
+            if q is not None:
+                self._signals.append((q, q.connect("overrun", self._on_overrun, name)))
+        self._last_enc = self._last_interval = None
+        enc = pipeline.get_by_name("enc")
+        if enc is not None:
+            self._add_probe(enc.get_static_pad("src"), self._on_encoded)
+
+    def attach_payloader(self, pay: Gst.Element) -> List[Tuple[Gst.Pad, int]]:
+        """Per-viewer payloader; returns the probe ids so the viewer can remove them."""
+        before = len(self._probes)
+        self._instrument(pay, "pay")
+        added = self._probes[before:]
+        del self._probes[before:]
+        return added
+
+    def detach(self) -> None:
+        for pad, pid in self._probes:
+            try: pad.remove_probe(pid)
+            except Exception: pass
+        for el, hid in self._signals:
+            try: el.disconnect(hid)
+            except Exception: pass
+        self._probes.clear()
+        self._signals.clear()
+        self.encoder_labels = {}
+
+    def _add_probe(self, pad: Optional[Gst.Pad], cb, *udata) -> None:
+        if pad is None:
+            return
+        self._probes.append((pad, pad.add_probe(Gst.PadProbeType.BUFFER, cb, *udata)))
+
+    def _instrument(self, el: Gst.Element, stage: str) -> None:
+        self.latency.setdefault(stage, Histogram())
+        self.frames.setdefault(stage, 0)
+        inflight: Dict[int, int] = {}
+        state = {"n": 0, "last_pts": None}
+        sink = el.get_static_pad("sink")
+        if sink is not None:
+            self._add_probe(sink, self._on_sink, stage, inflight, state)
+        self._add_probe(el.get_static_pad("src"), self._on_src, stage, inflight, state, el)
+
+    # ---- probes (streaming threads) ----
+    def _on_sink(self, _pad, info, stage, inflight, state):
+        if self.sample_every:
+            state["n"] += 1
+            if state["n"] % self.sample_every == 0:
+                buf = info.get_buffer()
+                if buf is not None and buf.pts != Gst.CLOCK_TIME_NONE:
+                    inflight[buf.pts] = time.monotonic_ns()
+                    if len(inflight) > MAX_INFLIGHT:
+                        inflight.pop(next(iter(inflight)))
+        return Gst.PadProbeReturn.OK
+
+    def _on_src(self, _pad, info, stage, inflight, state, el):
+        buf = info.get_buffer()
+        if buf is None:
+            return Gst.PadProbeReturn.OK
+        pts = buf.pts
+        # Payloaders emit several packets per frame with the same PTS; count the first only
+        if pts == state["last_pts"] and pts != Gst.CLOCK_TIME_NONE:
+            return Gst.PadProbeReturn.OK
+        state["last_pts"] = pts
+        self.frames[stage] += 1
+        if not self.sample_every:
+            return Gst.PadProbeReturn.OK
+        if stage == "src":
+            # Live sources stamp PTS with capture running time; the gap to "now" is capture latency
+            if self.frames[stage] % self.sample_every == 0 and pts != Gst.CLOCK_TIME_NONE:
+                clock = el.get_clock()
+                if clock is not None:
+                    running = clock.get_time() - el.get_base_time()
+                    if running >= pts:
+                        self.latency[stage].observe((running - pts) / Gst.SECOND)
+        else:
+            t0 = inflight.pop(pts, None)
+            if t0 is not None:
+                self.latency[stage].observe((time.monotonic_ns() - t0) / 1e9)
+        return Gst.PadProbeReturn.OK
+
+    def _on_overrun(self, _queue, name):
+        # Leaky queues emit overrun right before discarding the oldest buffer
+        self.drops[name] = self.drops.get(name, 0) + 1
+
+    def _on_encoded(self, _pad, info):
+        buf = info.get_buffer()
+        if buf is not None:
+            self.enc_frames += 1
+            self.enc_bytes += buf.get_size()
+            if not buf.has_flags(Gst.BufferFlags.DELTA_UNIT):
+                self.enc_keyframes += 1
+            now = time.monotonic_ns()
+            if self._last_enc is not None:
+                interval = (now - self._last_enc) / 1e9
+                self.frame_interval.observe(interval)
+                if self._last_interval is not None:
+                    self.frame_jitter += (abs(interval - self._last_interval) - self.frame_jitter) / 16.0
+                self._last_interval = interval
+            self._last_enc = now
+        return Gst.PadProbeReturn.OK
+
+    def observe_first_frame(self, seconds: float) -> None:
+        self.first_frame.observe(seconds)
+
+    # ---- exposition ----
+    def encoder_bitrate(self) -> float:
+        now = time.monotonic()
+        t0, b0 = self._bitrate_snap
+        if now - t0 >= 1.0:
+            self._bitrate_bps = (self.enc_bytes - b0) * 8 / (now - t0)
+            self._bitrate_snap = (now, self.enc_bytes)
+        return self._bitrate_bps
+
+    def render(self, extra: Optional[Dict[str, float]] = None) -> str:
+        lines = [
+            "# HELP revcam_stage_latency_seconds Time a sampled buffer spends in each pipeline element (src: capture to pad).",
+            "# TYPE revcam_stage_latency_seconds histogram",
+        ]
+        for stage, h in self.latency.items():
+            lines += h.render("revcam_stage_latency_seconds", {"stage": stage})
+        lines += ["# HELP revcam_stage_frames_total Frames leaving each pipeline element.",
+                  "# TYPE revcam_stage_frames_total counter"]
+        lines += [f"revcam_stage_frames_total{_labels({'stage': s})} {n}" for s, n in self.frames.items()]
+        lines += ["# HELP revcam_queue_dropped_total Buffers discarded by leaky queues.",
+                  "# TYPE revcam_queue_dropped_total counter"]
+        lines += [f"revcam_queue_dropped_total{_labels({'queue': q})} {n}" for q, n in self.drops.items()]
+        lines += [
+            "# HELP revcam_encoder_bytes_total Encoded bytes produced.",
+            "# TYPE revcam_encoder_bytes_total counter",
+            f"revcam_encoder_bytes_total {self.enc_bytes}",
+            "# HELP revcam_encoder_frames_total Encoded frames produced.",
+            "# TYPE revcam_encoder_frames_total counter",
+            f"revcam_encoder_frames_total {self.enc_frames}",
+            "# HELP revcam_encoder_keyframes_total Encoded keyframes produced.",
+            "# TYPE revcam_encoder_keyframes_total counter",
+            f"revcam_encoder_keyframes_total {self.enc_keyframes}",
+            "# HELP revcam_encoder_bitrate_bps Encoder output bitrate over the last scrape window.",
+            "# TYPE revcam_encoder_bitrate_bps gauge",
+            f"revcam_encoder_bitrate_bps {self.encoder_bitrate():.0f}",
+        ]
+        if self.encoder_labels:
+            lines += ["# HELP revcam_encoder_info Encoder element picked for the running pipeline.",
+                      "# TYPE revcam_encoder_info gauge",
+                      f"revcam_encoder_info{_labels(self.encoder_labels)} 1"]
+        lines += ["# HELP revcam_join_to_first_frame_seconds Viewer join to first decoded frame.",
+                  "# TYPE revcam_join_to_first_frame_seconds histogram"]
+        lines += self.first_frame.render("revcam_join_to_first_frame_seconds", {})
+        lines += ["# HELP revcam_frame_interval_seconds Wall-clock time between consecutive encoded frames.",
+                  "# TYPE revcam_frame_interval_seconds histogram"]
+        lines += self.frame_interval.render("revcam_frame_interval_seconds", {})
+        lines += ["# HELP revcam_frame_interval_jitter_seconds Smoothed frame-to-frame interval variation (RFC 3550 style).",
+                  "# TYPE revcam_frame_interval_jitter_seconds gauge",
+                  f"revcam_frame_interval_jitter_seconds {self.frame_jitter:.6f}"]
+        for name, val in (extra or {}).items():
+            lines += [f"# TYPE {name} gauge", f"{name} {val}"]
+        return "\n".join(lines) + "\n"
@@ -1,11 +1,278 @@
+import abc
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
 import gi
 gi.require_version('Gst', '1.0')
-from gi.repository import Gst
+gi.require_version('GstVideo', '1.0')
+from gi.repository import Gst, GstVideo
+
+try:
+    import cairo
+except ImportError:  # apt install python3-gi-cairo
+    cairo = None
+
+from .config import OverlayConfig
+
+LOG = logging.getLogger("overlay")
+
+# Guide bands, nearest first: (fraction of the guide height, RGBA)
+GUIDE_BANDS = (
+    (0.25, (0.95, 0.15, 0.15, 0.9)),
+    (0.55, (1.0, 0.85, 0.1, 0.9)),
+    (1.0, (0.2, 0.9, 0.3, 0.9)),
+)
 
 def make_overlay_element():
+    """Passthrough used when the overlay is disabled or its dependencies are missing."""
+    return Gst.ElementFactory.make("identity", "overlay")
+
+def _to_rectangle(surface, x: int, y: int) -> "GstVideo.VideoOverlayRectangle":
     """
-    Placeholder overlay element.
-    Replace with a bin later, e.g.:
-      Gst.parse_bin_from_description("timeoverlay shaded-background=true", True)
+    Wrap a Cairo ARGB32 surface (premultiplied, BGRA in memory on little-endian) as an
+    overlay rectangle. GStreamer caches its own converted/scaled copy inside the
+    rectangle, so reusing the object across frames never re-converts the pixels.
     """
-    return Gst.ElementFactory.make("identity", "overlay")
+    surface.flush()
+    w, h = surface.get_width(), surface.get_height()
+    buf = Gst.Buffer.new_wrapped(bytes(surface.get_data()))
+    GstVideo.buffer_add_video_meta(buf, GstVideo.VideoFrameFlags.NONE, GstVideo.VideoFormat.BGRA, w, h)
+    return GstVideo.VideoOverlayRectangle.new_raw(buf, x, y, w, h, GstVideo.VideoOverlayFormatFlags.PREMULTIPLIED_ALPHA)
+
+class Layer(abc.ABC):
+    """One cached overlay rectangle. render() only runs when key() changes."""
+    name = "layer"
+
+    def __init__(self, visible: bool = True):
+        self.visible = visible
+        self._key: Any = None
+        self._rect: Optional[GstVideo.VideoOverlayRectangle] = None
+        self.renders = 0
+
+    def key(self, w: int, h: int) -> Any:
+        return (w, h)
+
+    @abc.abstractmethod
+    def render(self, w: int, h: int) -> Optional[Tuple[Any, int, int]]:
+        """Return (cairo surface, x, y) cropped to what is drawn, or None for nothing."""
+
+    def rectangle(self, w: int, h: int) -> Optional[GstVideo.VideoOverlayRectangle]:
+        if not self.visible:
+            return None
+        k = self.key(w, h)
+        if k != self._key:
+            out = self.render(w, h)
+            self._rect = _to_rectangle(*out) if out is not None else None
+            self._key = k
+            self.renders += 1
+        return self._rect
+
+class GuidesLayer(Layer):
+    """Static parking guides: two converging rails with near/mid/far cross bars."""
+    name = "guides"
+
+    def render(self, w: int, h: int):
+        # Drawn in frame coordinates inside the bounding box only (the dirty rectangle)
+        x0, x1, y0, y1 = int(w * 0.12), int(w * 0.88), int(h * 0.45), h
+        bw, bh = max(1, x1 - x0), max(1, y1 - y0)
+        s = cairo.ImageSurface(cairo.FORMAT_ARGB32, bw, bh)
+        cr = cairo.Context(s)
+        cr.translate(-x0, -y0)
+        cr.set_line_width(max(2.0, h / 120.0))
+        cr.set_line_cap(cairo.LINE_CAP_ROUND)
+        near_l, near_r = w * 0.15, w * 0.85
+        far_l, far_r = w * 0.36, w * 0.64
+        far_y = h * 0.48
+        def at(t: float) -> Tuple[float, float, float]:
+            # t = 0 at the bumper (bottom), 1 at the far end of the guides
+            y = h - (h - far_y) * t
+            return near_l + (far_l - near_l) * t, near_r + (far_r - near_r) * t, y
+        t_prev = 0.0
+        for t_end, rgba in GUIDE_BANDS:
+            cr.set_source_rgba(*rgba)
+            lx0, rx0, ya = at(t_prev)
+            lx1, rx1, yb = at(t_end)
+            cr.move_to(lx0, ya); cr.line_to(lx1, yb)
+            cr.move_to(rx0, ya); cr.line_to(rx1, yb)
+            # Cross bar at the far edge of the band, short stubs inward
+            stub = (rx1 - lx1) * 0.18
+            cr.move_to(lx1, yb); cr.line_to(lx1 + stub, yb)
+            cr.move_to(rx1, yb); cr.line_to(rx1 - stub, yb)
+            cr.stroke()
+            t_prev = t_end
+        return s, x0, y0
+
+class TextLayer(Layer):
+    """Dynamic text box; re-rendered only when the text (or frame size) changes."""
+    def __init__(self, name: str, anchor: str, visible: bool = True):
+        super().__init__(visible)
+        self.name = name
+        self.anchor = anchor  # "top-left" | "top-right"
+        self.text = ""
+
+    def current_text(self) -> str:
+        return self.text
+
+    def key(self, w: int, h: int) -> Any:
+        return (w, h, self.current_text())
+
+    def render(self, w: int, h: int):
+        text = self.current_text()
+        if not text:
+            return None
+        size = max(10.0, h / 22.0)
+        pad = int(size * 0.35)
+        # Measure on a 1×1 scratch surface, then allocate exactly the text box
+        scratch = cairo.Context(cairo.ImageSurface(cairo.FORMAT_ARGB32, 1, 1))
+        scratch.select_font_face("Sans", cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_BOLD)
+        scratch.set_font_size(size)
+        ext = scratch.text_extents(text)
+        bw, bh = int(ext.x_advance) + 2 * pad, int(size * 1.3) + 2 * pad
+        s = cairo.ImageSurface(cairo.FORMAT_ARGB32, bw, bh)
+        cr = cairo.Context(s)
+        cr.set_source_rgba(0, 0, 0, 0.55)
+        cr.rectangle(0, 0, bw, bh); cr.fill()
+        cr.select_font_face("Sans", cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_BOLD)
+        cr.set_font_size(size)
+        cr.set_source_rgba(1, 1, 1, 1)
+        cr.move_to(pad - ext.x_bearing, pad + size)
+        cr.show_text(text)
+        margin = int(h * 0.02)
+        x = margin if self.anchor == "top-left" else max(0, w - bw - margin)
+        return s, x, margin
+
+class ClockLayer(TextLayer):
+    def __init__(self, fmt: str, visible: bool = True):
+        super().__init__("timestamp", "top-left", visible)
+        self.fmt = fmt
+
+    def current_text(self) -> str:
+        return time.strftime(self.fmt)  # changes once per second at most
+
+class DistanceLayer(TextLayer):
+    """Latest sensor distance; hidden once no update arrived for `timeout_s`."""
+    def __init__(self, timeout_s: float, visible: bool = True):
+        super().__init__("distance", "top-right", visible)
+        self.timeout_s = timeout_s
+        self.distance_m: Optional[float] = None
+        self.updated = 0.0
+
+    def set(self, distance_m: Optional[float]) -> None:
+        self.distance_m = None if distance_m is None else max(0.0, float(distance_m))
+        self.updated = time.monotonic()
+
+    def current_text(self) -> str:
+        if self.distance_m is None or time.monotonic() - self.updated > self.timeout_s:
+            return ""
+        return f"{self.distance_m:.2f} m"
+
+class OverlayEngine:
+    """
+    overlaycomposition-driven overlay. Each frame the element asks for a composition;
+    we hand back the same GstVideoOverlayComposition until some layer re-renders, and
+    GStreamer blends it in place into the I420 frame, touching only the pixels inside
+    each layer's rectangle. Layer state survives pipeline rebuilds and is updated from
+    the API thread.
+    """
+    def __init__(self, cfg: OverlayConfig):
+        self.cfg = cfg
+        self.guides = GuidesLayer(cfg.guides)
+        self.clock = ClockLayer(cfg.timestamp_format, cfg.timestamp)
+        self.distance = DistanceLayer(cfg.distance_timeout_s, cfg.distance)
+        self.layers: List[Layer] = [self.guides, self.clock, self.distance]
+        self._lock = threading.Lock()
+        self._size: Optional[Tuple[int, int]] = None
+        self._comp: Optional[GstVideo.VideoOverlayComposition] = None
+        self._comp_key: Tuple = ()
+        self._signals: List[Tuple[Gst.Element, int]] = []
+        self.frames = 0
+
+    @property
+    def available(self) -> bool:
+        return cairo is not None and Gst.ElementFactory.find("overlaycomposition") is not None
+
+    def make_element(self) -> Gst.Element:
+        if not self.cfg.enabled:
+            return make_overlay_element()
+        if not self.available:
+            LOG.warning("Overlay disabled: needs pycairo (python3-gi-cairo) and overlaycomposition (plugins-base >= 1.20)")
+            return make_overlay_element()
+        el = Gst.ElementFactory.make("overlaycomposition", "overlay")
+        self._signals = [(el, el.connect("caps-changed", self._on_caps)), (el, el.connect("draw", self._on_draw))]
+        return el
+
+    def detach(self) -> None:
+        """Pipeline torn down: drop the element's handlers and the cached composition."""
+        for el, hid in self._signals:
+            try: el.disconnect(hid)
+            except Exception: pass
+        self._signals = []
+        with self._lock:
+            self._size = None
+            self._comp = None
+            self._comp_key = ()
+
+    def _on_caps(self, _el, caps, _ww, _wh):
+        s = caps.get_structure(0)
+        with self._lock:
+            self._size = (s.get_value("width"), s.get_value("height"))
+            self._comp_key = ()
+
+    def _on_draw(self, _el, _sample):
+        # Streaming thread: must stay cheap. Cached rectangles make this a few tuple compares.
+        with self._lock:
+            self.frames += 1
+            if self._size is None:
+                return None
+            w, h = self._size
+            rects, key = [], []
+            for layer in self.layers:
+                try:
+                    r = layer.rectangle(w, h)
+                except Exception as e:
+                    LOG.warning("overlay layer %s failed: %s", layer.name, e)
+                    layer.visible = False
+                    r = None
+                if r is not None:
+                    rects.append(r)
+                    key.append((layer.name, layer.renders))
+            key = tuple(key)
+            if key != self._comp_key:
+                self._comp_key = key
+                self._comp = None
+                if rects:
+                    self._comp = GstVideo.VideoOverlayComposition.new(rects[0])
+                    for r in rects[1:]:
+                        self._comp.add_rectangle(r)
+            return self._comp
+
+    def configure(self, cfg: OverlayConfig) -> None:
+        """New config section (enabling/disabling the element itself needs a pipeline restart)."""
+        with self._lock:
+            self.cfg = cfg
+            self.guides.visible = cfg.guides
+            self.clock.visible, self.clock.fmt = cfg.timestamp, cfg.timestamp_format
+            self.distance.visible, self.distance.timeout_s = cfg.distance, cfg.distance_timeout_s
+
+    # ---- API ----
+    def update(self, data: Dict[str, Any]) -> None:
+        """Runtime layer data: {"distance_m": 1.2, "guides": false, "timestamp": true, "distance": true}."""
+        with self._lock:
+            if "distance_m" in data:
+                self.distance.set(data["distance_m"])
+            for layer in self.layers:
+                if layer.name in data:
+                    layer.visible = bool(data[layer.name])
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.cfg.enabled,
+                "active": self.cfg.enabled and self.available,
+                "size": list(self._size) if self._size else None,
+                "frames": self.frames,
+                "distance_m": self.distance.distance_m,
+                "layers": {l.name: {"visible": l.visible, "renders": l.renders} for l in self.layers},
+            }
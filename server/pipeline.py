@@ -0,0 +1,721 @@
+import copy
+import dataclasses
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GstVideo', '1.0')
+from gi.repository import Gst, GstVideo
+
+from .abr import BitrateController
+from .glib_loop import glib_loop
+from .metrics import PipelineMetrics
+from .recorder import EventRecorder
+from .scene import SceneGate
+from .sched import ThreadScheduler
+from .sessions import SESSIONS
+from .snapshot import SnapshotBranch
+from .overlay import OverlayEngine
+from .config import DEFAULT_STREAM, Config, ConfigDiff, config_diff, config_store, stream_config
+from .encoders import REGISTRY, EncoderSpec
+
+# Gst.init runs on a worker thread at server startup (preflight.gst_init), not at import
+LOG = logging.getLogger("pipeline")
+
+# Upper bound on how long a live format change may stall the stream
+RENEGOTIATE_TIMEOUT = 1.5
+# Upper bound on waiting for a viewer's tee pad to go idle, and for a bin to reach NULL
+DETACH_TIMEOUT = 1.0
+
+# Orientation as an element of the dihedral group D4: (k, f) = rotate k quarter-turns
+# clockwise after an optional horizontal flip, i.e. R^k · H^f. mirror+rotate compose into
+# one of eight values, so one videoflip pass replaces the old mirror → rotate pair.
+_DIRECTION_NICKS = {
+    (0, 0): "identity", (1, 0): "90r", (2, 0): "180", (3, 0): "90l",
+    (0, 1): "horiz", (1, 1): "ur-ll", (2, 1): "vert", (3, 1): "ul-lr",
+}
+# libcamerasrc "orientation" nicks; sensors can only flip, so only these four exist
+_SENSOR_NICKS = {(0, 0): "rotate-0", (0, 1): "rotate-0-mirror", (2, 0): "rotate-180", (2, 1): "rotate-180-mirror"}
+
+def _orientation(mirror: str, rotate: int) -> tuple:
+    """Mirror first, then rotate clockwise (the order the settings UI has always used)."""
+    try: k = (int(rotate) // 90) % 4
+    except Exception: k = 0
+    m = (mirror or "none").lower()
+    if m == "horizontal":
+        return (k, 1)
+    if m == "vertical":
+        return ((k + 2) % 4, 1)  # V = R² · H
+    return (k, 0)
+
+def _compose(a: tuple, b: tuple) -> tuple:
+    """a after b. H · R^k = R^-k · H moves b's rotation past a's flip."""
+    (k1, f1), (k2, f2) = a, b
+    return ((k1 + (-k2 if f1 else k2)) % 4, f1 ^ f2)
+
+def _inverse(a: tuple) -> tuple:
+    k, f = a
+    return a if f else ((-k) % 4, 0)
+
+def _two_pass_copies(mirror: str, rotate: int) -> int:
+    """Full-frame copies the old videoflip(mirror) → videoflip(rotate) pair made; "none" ran in passthrough."""
+    m = (mirror or "none").lower() in ("horizontal", "vertical")
+    try: r = int(rotate) in (90, 180, 270)
+    except Exception: r = False
+    return int(m) + int(r)
+
+def _link(a, b, label=""):
+    if not a.link(b):
+        raise RuntimeError(f"Failed to link {a.name} -> {b.name} ({label})")
+
+def _with_video(cfg: Config, **changes) -> Config:
+    """cfg with some video keys changed, as a new object: the ConfigStore snapshot stays untouched."""
+    if all(getattr(cfg.video, k) == val for k, val in changes.items()):
+        return cfg
+    view = copy.copy(cfg)
+    view.video = dataclasses.replace(cfg.video, **changes)
+    return view
+
+def _fmt(fmt: tuple) -> Dict[str, int]:
+    return dict(zip(("width", "height", "fps"), fmt))
+
+def _wait_caps(capsf: Gst.Element, caps: Gst.Caps, timeout: float) -> bool:
+    pad = capsf.get_static_pad("src")
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        cur = pad.get_current_caps()
+        if cur is not None and cur.is_subset(caps):
+            return True
+        time.sleep(0.02)
+    return False
+
+def _renegotiate(capsf: Gst.Element, src: Gst.Element, caps: Gst.Caps, restart: bool = False) -> bool:
+    """Put caps on the capsfilter and wait for the source to produce them (restarting it if needed)."""
+    capsf.set_property("caps", caps)
+    if not restart and _wait_caps(capsf, caps, RENEGOTIATE_TIMEOUT / 2):
+        return True
+    if not restart:
+        LOG.info("Source did not renegotiate in place; restarting it")
+    src.set_state(Gst.State.NULL)
+    src.sync_state_with_parent()
+    return _wait_caps(capsf, caps, RENEGOTIATE_TIMEOUT / 2)
+
+def _set_null(el: Gst.Element, timeout: float) -> bool:
+    """set_state(NULL) and wait, bounded, for it to complete. False if it didn't."""
+    ret = el.set_state(Gst.State.NULL)
+    if ret == Gst.StateChangeReturn.ASYNC:
+        ret, _state, _pending = el.get_state(int(timeout * Gst.SECOND))
+    return ret == Gst.StateChangeReturn.SUCCESS
+
+class CapturePipeline:
+    """
+    One long-lived capture + encode pipeline shared by every viewer:
+
+      src → caps → vconv → vflip → tee → q1 → [overlay] → q2 → rate → [scene gate] → qenc → enc [→ enc_caps → parse] → enc_tee
+                                                 ↘ qsnap → snapsink   (snapshots, gated off when idle)
+      enc_tee → qrec → recsink   (event ring buffer, when recording.enabled)
+
+    The encoder (VP8 or H.264) comes from the encoder registry when the pipeline is built.
+    Viewers attach a branch (queue → rtp*pay → webrtcbin) to enc_tee at runtime, so a
+    second viewer costs packetization + DTLS/SRTP only, never another camera open or encode.
+
+    There is one instance per configured stream (see get_capture); cfg is that stream's
+    view of the config, so cfg.video is the stream's own camera and format.
+    """
+    def __init__(self, cfg: Config, stream: str = DEFAULT_STREAM):
+        self.cfg = cfg
+        self.stream = stream
+        self.pipeline: Optional[Gst.Pipeline] = None
+        self.enc: Optional[Gst.Element] = None
+        self.encoder: Optional[EncoderSpec] = None
+        self._encoder_stale = False
+        self.enc_tee: Optional[Gst.Element] = None
+        self.src: Optional[Gst.Element] = None
+        self.capsf: Optional[Gst.Element] = None
+        self.rate: Optional[Gst.Element] = None
+        self.vflip: Optional[Gst.Element] = None
+        # Part of the orientation done by the sensor (fixed while streaming)
+        self._sensor_orient = (0, 0)
+        # (width, height, fps) the running source is negotiated at; the rollback target
+        self._live_format: Optional[tuple] = None
+        # Set when the last live format change failed and was undone: {"requested": …, "kept": …}
+        self.format_rollback: Optional[Dict[str, Any]] = None
+        self._viewers = 0
+        self._lock = threading.RLock()
+        # Serializes live format changes, whose caps waits run without _lock
+        self._format_lock = threading.Lock()
+        self._idle_source: Optional[int] = None
+        # Released explicitly on teardown: bus watch handler, requested tee pads
+        self._bus_watch: Optional[int] = None
+        self._tee_pads: List[tuple] = []
+        self.abr = BitrateController(self)
+        self.metrics = PipelineMetrics(cfg.metrics.sample_every)
+        self.snapshot = SnapshotBranch()
+        self.recorder = EventRecorder(cfg.recording, stream)
+        self.overlay = OverlayEngine(cfg.overlay)
+        self.scene = SceneGate(cfg.scene)
+        self.sched = ThreadScheduler(cfg.sched)
+
+    @property
+    def running(self) -> bool:
+        return self.pipeline is not None
+
+    @property
+    def viewers(self) -> int:
+        return self._viewers
+
+    def _make_source(self) -> Gst.Element:
+        v = self.cfg.video
+        if v.source == "test":
+            src = Gst.ElementFactory.make("videotestsrc", "src")
+            if not src:
+                raise RuntimeError("videotestsrc missing (apt install gstreamer1.0-plugins-base)")
+            src.set_property("is-live", True)
+            Gst.util_set_object_arg(src, "pattern", v.camera or "ball")
+            return src
+        src = Gst.ElementFactory.make("libcamerasrc", "src")
+        if not src:
+            raise RuntimeError("libcamerasrc missing (apt install gstreamer1.0-libcamera rpicam-apps)")
+        if v.camera:
+            src.set_property("camera-name", v.camera)
+        return src
+
+    def _make_encoder(self, peer_codecs=None) -> List[Gst.Element]:
+        """Encoder plus, for H.264, the profile capsfilter and parser; returned in link order."""
+        spec = REGISTRY.select(self.cfg.video, peer_codecs, cached_only=True)
+        chain = [spec.make(self.cfg.video, "enc")]
+        if spec.out_caps:
+            capsf = Gst.ElementFactory.make("capsfilter", "enc_caps")
+            capsf.set_property("caps", Gst.Caps.from_string(spec.out_caps))
+            chain.append(capsf)
+        if spec.parser:
+            parse = Gst.ElementFactory.make(spec.parser, "parse")
+            if not parse:
+                raise RuntimeError(f"{spec.parser} missing (apt install gstreamer1.0-plugins-bad)")
+            parse.set_property("config-interval", -1)  # SPS/PPS with every IDR, for late joiners
+            chain.append(parse)
+        self.encoder = spec
+        return chain
+
+    def _raw_caps(self, fmt: Optional[tuple] = None) -> Gst.Caps:
+        v = self.cfg.video
+        w, h, fps = fmt or (v.width, v.height, v.fps)
+        return Gst.Caps.from_string(f"video/x-raw,format=I420,width={w},height={h},framerate={fps}/1")
+
+    def build(self, peer_codecs=None) -> None:
+        assert self.pipeline is None
+        v = self.cfg.video
+        p = Gst.Pipeline.new(f"rev-{self.stream}")
+
+        src = self._make_source()
+
+        capsf = Gst.ElementFactory.make("capsfilter", "caps")
+        capsf.set_property("caps", self._raw_caps())
+
+        vconv = Gst.ElementFactory.make("v4l2convert", "vconv") or Gst.ElementFactory.make("videoconvert", "vconv")
+        self._sensor_orient = self._apply_sensor_orientation(src)
+        # One pass for any mirror+rotate; passthrough (no copy) when nothing is left to do
+        self.vflip = Gst.ElementFactory.make("videoflip", "vflip")
+        self._set_direction()
+
+        tee = Gst.ElementFactory.make("tee", "tee")
+        q1 = Gst.ElementFactory.make("queue", "q1"); q1.set_property("leaky", 2); q1.set_property("max-size-buffers", 2)
+        qenc = Gst.ElementFactory.make("queue", "qenc"); qenc.set_property("leaky", 2); qenc.set_property("max-size-buffers", 2)
+        overlay = self.overlay.make_element()
+        q2 = Gst.ElementFactory.make("queue", "q2")
+        # Drop-only rate cap so ABR can shed frames without renegotiating caps
+        rate = Gst.ElementFactory.make("videorate", "rate")
+        rate.set_property("drop-only", True); rate.set_property("max-rate", int(v.fps))
+
+        enc_chain = self._make_encoder(peer_codecs)
+        enc = enc_chain[0]
+
+        # Encoded fan-out: viewers request pads at runtime; a sync=false fakesink keeps data
+        # flowing (and the encoder warm) while no viewer branch is linked.
+        enc_tee = Gst.ElementFactory.make("tee", "enc_tee"); enc_tee.set_property("allow-not-linked", True)
+        keepalive = Gst.ElementFactory.make("fakesink", "keepalive")
+        keepalive.set_property("sync", False); keepalive.set_property("async", False)
+
+        for e in [src, capsf, vconv, self.vflip, tee, q1, overlay, q2, rate, qenc, *enc_chain, enc_tee, keepalive]:
+            p.add(e)
+
+        # Camera chain
+        _link(src, capsf, "src->caps")
+        _link(capsf, vconv, "caps->vconv")
+        _link(vconv, self.vflip, "vconv->vflip")
+        _link(self.vflip, tee, "vflip->tee")
+
+        tee_src = tee.get_request_pad("src_%u")
+        if tee_src is None: raise RuntimeError("tee request pad failed")
+        self._tee_pads = [(tee, tee_src)]
+        q1_sink = q1.get_static_pad("sink")
+        if q1_sink is None: raise RuntimeError("q1 sink pad missing")
+        if tee_src.link(q1_sink) != Gst.PadLinkReturn.OK:
+            raise RuntimeError("link tee.src -> q1.sink failed")
+
+        _link(q1, overlay, "q1->overlay")
+        _link(overlay, q2, "overlay->q2")
+        _link(q2, rate, "q2->rate")
+        _link(rate, qenc, "rate->qenc")
+        _link(qenc, enc, "qenc->enc")
+        for a, b in zip(enc_chain, enc_chain[1:]):
+            _link(a, b, "encoder chain")
+        _link(enc_chain[-1], enc_tee, "enc->enc_tee")
+        _link(enc_tee, keepalive, "enc_tee->keepalive")
+
+        # Static-scene gate: drops frames between rate and qenc so they are never encoded
+        if self.cfg.scene.enabled:
+            self.scene.cfg = self.cfg.scene
+            self.scene.attach(rate.get_static_pad("src"))
+
+        # Low-priority raw branch for /api/snapshot.jpg
+        self._tee_pads.append((tee, self.snapshot.build(p, tee)))
+        if self.cfg.recording.enabled:
+            self.recorder.cfg = self.cfg.recording
+            self._tee_pads.append((enc_tee, self.recorder.build(p, enc_tee)))
+
+        # Dispatched on the GLib main loop thread (see glib_loop); removed again in _teardown
+        bus = p.get_bus(); bus.add_signal_watch()
+        self._bus_watch = bus.connect("message", self._on_bus)
+
+        if self.cfg.metrics.enabled:
+            self.metrics.attach(p, {"element": self.encoder.element, "codec": self.encoder.codec})
+
+        # Media streaming threads move to their own CPUs as they start (sched profile)
+        self.sched.cfg = self.cfg.sched
+        self.sched.attach(p)
+
+        self.enc = enc
+        self.enc_tee = enc_tee
+        self.src = src
+        self.capsf = capsf
+        self.rate = rate
+        self.pipeline = p
+        self._live_format = (v.width, v.height, v.fps)
+        SESSIONS.pipeline_started()
+
+    # ---- lifecycle ----
+    def _cancel_idle(self) -> None:
+        if self._idle_source is not None:
+            glib_loop().cancel(self._idle_source)
+            self._idle_source = None
+
+    def _ensure_started(self, peer_codecs=None) -> None:
+        self._cancel_idle()
+        if self.pipeline is not None:
+            return
+        self.build(peer_codecs)
+        ret = self.pipeline.set_state(Gst.State.PLAYING)
+        if ret == Gst.StateChangeReturn.FAILURE:
+            self._teardown()
+            raise RuntimeError(f"pipeline PLAYING failed ({self.encoder.element if self.encoder else '?'})")
+        LOG.info("Capture pipeline %s started (%s, %s)", self.stream, self.cfg.video.source, self.encoder.element)
+        self.abr.reset()
+        self.abr.start()
+
+    def prewarm(self) -> None:
+        """Warm standby: bring camera + encoder up before anyone connects."""
+        with self._lock:
+            self._ensure_started()
+            if self._viewers == 0:
+                self._schedule_idle_teardown()
+
+    def acquire(self, peer_codecs=None) -> None:
+        """
+        Register a viewer; builds and starts the pipeline if it isn't warm already. A new
+        pipeline picks an encoder whose codec is in peer_codecs (when the peer's SDP is
+        known up front); a running one must already match.
+        """
+        with self._lock:
+            self._ensure_started(peer_codecs)
+            if peer_codecs and self.encoder.codec not in peer_codecs:
+                if self._viewers == 0:
+                    self._teardown()
+                    self._ensure_started(peer_codecs)
+                if self.encoder.codec not in peer_codecs:
+                    raise RuntimeError(f"stream is {self.encoder.codec}; peer offers {', '.join(peer_codecs)}")
+            self._viewers += 1
+
+    def release(self) -> None:
+        """Drop a viewer; the camera is closed once no viewer has returned within the idle grace."""
+        with self._lock:
+            self._viewers = max(0, self._viewers - 1)
+            if self._viewers == 0 and self.pipeline is not None:
+                if self._encoder_stale:
+                    # A peer refused the codec: rebuild with a new pick on the next join
+                    self._cancel_idle()
+                    self._teardown()
+                    LOG.info("Capture pipeline %s stopped (encoder reselection)", self.stream)
+                    return
+                self._schedule_idle_teardown()
+
+    def encoder_rejected(self) -> bool:
+        """
+        A peer's answer didn't accept our codec; reselect once the current viewers leave.
+        Returns True only if that reselection would pick a different codec, i.e. it is
+        worth the peer coming back.
+        """
+        if self.encoder is None or self.cfg.video.encoder != "auto":
+            return False
+        codec = self.encoder.codec
+        REGISTRY.peer_rejected(codec)
+        if REGISTRY.select(self.cfg.video, cached_only=True).codec == codec:
+            return False
+        self._encoder_stale = True
+        return True
+
+    def _grace(self) -> float:
+        return self.cfg.standby.idle_grace_s if self.cfg.standby.warm else 0.0
+
+    def _schedule_idle_teardown(self) -> None:
+        self._cancel_idle()
+        grace = self._grace()
+        if grace <= 0:
+            self._teardown()
+            LOG.info("Capture pipeline %s stopped (no viewers)", self.stream)
+            return
+        self._idle_source = glib_loop().timeout(int(grace * 1000), self._on_idle_timeout)
+        LOG.info("No viewers on %s; closing camera in %.0fs unless someone joins", self.stream, grace)
+
+    def _on_idle_timeout(self) -> bool:
+        # GLib thread: the NULL transition can block for up to DETACH_TIMEOUT, so it runs
+        # on a worker and signaling keeps flowing meanwhile
+        fired = self._idle_source
+        threading.Thread(target=self._idle_teardown, args=(fired,), name=f"teardown-{self.stream}", daemon=True).start()
+        return False
+
+    def _idle_teardown(self, fired: Optional[int]) -> None:
+        with self._lock:
+            if self._idle_source != fired:
+                return  # a viewer joined (and maybe left again) since the timer fired
+            self._idle_source = None
+            if self._viewers == 0 and self.pipeline is not None:
+                self._teardown()
+                LOG.info("Capture pipeline %s stopped (idle grace expired)", self.stream)
+
+    def _teardown(self) -> None:
+        self.abr.stop()
+        self.metrics.detach()
+        self.scene.detach()
+        self.overlay.detach()
+        self.snapshot.reset()
+        self.recorder.reset()
+        p = self.pipeline
+        try:
+            if p is not None:
+                if not _set_null(p, DETACH_TIMEOUT):
+                    LOG.warning("Capture pipeline %s did not reach NULL within %.1fs", self.stream, DETACH_TIMEOUT)
+                # After NULL: streaming threads have posted LEAVE and are back on the app CPUs
+                self.sched.detach()
+                for tee, pad in self._tee_pads:
+                    tee.release_request_pad(pad)
+                bus = p.get_bus()
+                if self._bus_watch is not None:
+                    bus.disconnect(self._bus_watch)
+                bus.remove_signal_watch()
+                SESSIONS.pipeline_stopped()
+        finally:
+            self._tee_pads = []
+            self._bus_watch = None
+            self.pipeline = None
+            self.enc = None
+            self.encoder = None
+            self._encoder_stale = False
+            self.enc_tee = None
+            self.src = None
+            self.capsf = None
+            self.rate = None
+            self.vflip = None
+            self._sensor_orient = (0, 0)
+            self._live_format = None
+
+    # ---- viewer branches ----
+    def attach(self, branch: Gst.Bin) -> Gst.Pad:
+        """Add a viewer bin (with a ghost "sink" pad) and link it to the encoded tee."""
+        with self._lock:
+            assert self.pipeline is not None and self.enc_tee is not None
+            self.pipeline.add(branch)
+            tee_pad = self.enc_tee.get_request_pad("src_%u")
+            if tee_pad is None:
+                self.pipeline.remove(branch)
+                raise RuntimeError("enc_tee request pad failed")
+            if tee_pad.link(branch.get_static_pad("sink")) != Gst.PadLinkReturn.OK:
+                self.enc_tee.release_request_pad(tee_pad)
+                self.pipeline.remove(branch)
+                raise RuntimeError(f"link enc_tee -> {branch.get_name()} failed")
+            branch.sync_state_with_parent()
+            return tee_pad
+
+    def detach(self, tee_pad: Gst.Pad, branch: Gst.Bin) -> bool:
+        """
+        Unlink a viewer bin once its tee pad is idle, release the pad and shut the bin down.
+        Each wait is bounded by DETACH_TIMEOUT; returns False if either had to give up.
+        The waits run without the lock, so a viewer joining meanwhile is not held up.
+        """
+        with self._lock:
+            pipeline, enc_tee = self.pipeline, self.enc_tee
+        if pipeline is None or enc_tee is None:
+            return _set_null(branch, DETACH_TIMEOUT)
+        unlinked = threading.Event()
+        def _on_idle(pad, _info):
+            peer = pad.get_peer()
+            if peer is not None:
+                pad.unlink(peer)
+            unlinked.set()
+            return Gst.PadProbeReturn.REMOVE
+        probe = tee_pad.add_probe(Gst.PadProbeType.IDLE, _on_idle)
+        idle = unlinked.wait(DETACH_TIMEOUT)
+        if not idle:
+            LOG.warning("enc_tee pad %s never went idle; unlinking anyway", tee_pad.get_name())
+            tee_pad.remove_probe(probe)
+            peer = tee_pad.get_peer()
+            if peer is not None:
+                tee_pad.unlink(peer)
+        enc_tee.release_request_pad(tee_pad)
+        stopped = _set_null(branch, DETACH_TIMEOUT)
+        with self._lock:
+            pipeline.remove(branch)
+        return idle and stopped
+
+    def render_metrics(self) -> str:
+        scene = "\n".join(self.scene.render()) + "\n" if self.cfg.scene.enabled else ""
+        return scene + self.metrics.render({
+            "revcam_orientation_passes": self.orientation_passes(),
+            "revcam_orientation_bytes_saved_per_frame": self.orientation_bytes_saved(),
+            "revcam_viewers": self._viewers,
+            "revcam_pipeline_running": int(self.running),
+            "revcam_abr_target_bitrate_bps": self.abr.target_bitrate,
+            "revcam_abr_fps": self.abr.fps,
+            "revcam_sched_media_threads": len(self.sched.threads),
+        })
+
+    def _on_bus(self, _bus, msg):
+        t = msg.type
+        if t == Gst.MessageType.ERROR:
+            err, dbg = msg.parse_error()
+            LOG.error("GStreamer ERROR: %s (%s)", err, dbg)
+        elif t == Gst.MessageType.WARNING:
+            err, dbg = msg.parse_warning()
+            LOG.warning("GStreamer WARN: %s (%s)", err, dbg)
+        elif t == Gst.MessageType.EOS:
+            LOG.info("GStreamer EOS")
+
+    # ---- live controls ----
+    def on_config(self, cfg: Config, diff: ConfigDiff) -> Dict[str, int]:
+        """
+        ConfigStore subscriber: adopt the new snapshot and apply what can change live.
+        Returns how many viewers each key was applied to. Blocking (format changes).
+        """
+        v = diff.get("video", {})
+        with self._lock:
+            self.cfg = cfg
+            self.recorder.cfg = cfg.recording
+            if "overlay" in diff:
+                self.overlay.configure(cfg.overlay)
+            # Thresholds apply on the next frame; enabling/disabling takes a pipeline restart
+            self.scene.cfg = cfg.scene
+            if not self.running:
+                return {}
+            n = self._viewers
+        applied: Dict[str, int] = {}
+        if "mirror" in v and self.apply_mirror(cfg.video.mirror):
+            applied["mirror"] = n
+        if "rotate" in v and self.apply_rotate(cfg.video.rotate):
+            applied["rotate"] = n
+        fmt = {"width", "height", "fps"} & v.keys()
+        if fmt:
+            try:
+                ok = self.apply_format(cfg.video.width, cfg.video.height, cfg.video.fps)
+            except Exception as e:
+                LOG.warning("Live format change failed: %s", e)
+                ok = False
+            if ok:
+                applied.update({k: n for k in fmt})
+        if "bitrate" in v and self.apply_bitrate(cfg.video.bitrate):
+            applied["bitrate"] = n
+        return applied
+
+    def set_bitrate(self, bitrate: int) -> bool:
+        """Retarget the running encoder (every registry encoder takes bitrate live)."""
+        if self.enc is None:
+            return False
+        try:
+            self.encoder.set_bitrate(self.enc, int(bitrate))
+            return True
+        except Exception as e:
+            LOG.warning("Failed set bitrate: %s", e)
+            return False
+
+    def apply_bitrate(self, bitrate: int) -> bool:
+        """User-requested bitrate: becomes the new ABR starting point as well."""
+        self.cfg = _with_video(self.cfg, bitrate=int(bitrate))
+        if self.set_bitrate(bitrate):
+            self.abr.target_bitrate = int(bitrate)
+            LOG.info("Applied live bitrate: %s", bitrate)
+            return True
+        return False
+
+    def apply_format(self, width: int, height: int, fps: int) -> bool:
+        """
+        Change resolution/framerate on the running pipeline. The capsfilter swap makes
+        the source renegotiate in place; sources that can't (some libcamerasrc builds)
+        are restarted instead. Either way the stall is bounded by RENEGOTIATE_TIMEOUT,
+        and a keyframe is forced so viewers resync without renegotiating WebRTC.
+        If the source never takes the new format, the previous caps are restored (and the
+        source restarted on them), format_rollback records why, and the old values are
+        written back through ConfigStore.amend so config.yaml and every subscriber agree.
+        The caps waits run without _lock, so acquire() on the GLib thread never waits on them.
+        """
+        want = (int(width), int(height), int(fps))
+        with self._format_lock:
+            with self._lock:
+                capsf, src, old = self.capsf, self.src, self._live_format
+                self.cfg = _with_video(self.cfg, **_fmt(want))  # a stopped pipeline builds at this
+                if capsf is None or src is None or old is None:
+                    return False
+            ok = _renegotiate(capsf, src, self._raw_caps(want))
+            if not ok:
+                LOG.warning("Live format change to %dx%d@%d timed out; rolling back to %dx%d@%d", *want, *old)
+                if not _renegotiate(capsf, src, self._raw_caps(old), restart=True):
+                    LOG.error("Source did not come back at %dx%d@%d", *old)
+            with self._lock:
+                if self.capsf is not capsf:
+                    return False  # torn down meanwhile; the next build starts at the configured format
+                if not ok:
+                    self.cfg = _with_video(self.cfg, **_fmt(old))
+                    self.format_rollback = {"requested": _fmt(want), "kept": _fmt(old)}
+                    config_store().amend(self._undo_format(want, old))
+                else:
+                    self._live_format = want
+                    self.format_rollback = None
+                    self.set_max_framerate(want[2])
+                    self.abr.fps = want[2]
+                    self.encoder.set_keyframe_interval(self.enc, max(1, want[2] * 2))
+        self.force_keyframe()
+        if ok:
+            LOG.info("Applied live format: %dx%d@%d", *want)
+        return ok
+
+    def _undo_format(self, want: tuple, old: tuple):
+        """ConfigStore amendment putting this stream back on old, unless it has moved on from want."""
+        def _mutate(cfg: Config) -> None:
+            try:
+                v = cfg.stream(self.stream).video
+            except KeyError:
+                return
+            if (v.width, v.height, v.fps) == want:
+                v.width, v.height, v.fps = old
+        return _mutate
+
+    def force_keyframe(self) -> bool:
+        """Ask the encoder for a keyframe now (upstream force-key-unit event on its src pad)."""
+        if self.enc is None:
+            return False
+        evt = GstVideo.video_event_new_upstream_force_key_unit(Gst.CLOCK_TIME_NONE, True, 0)
+        return self.enc.get_static_pad("src").send_event(evt)
+
+    def set_max_framerate(self, fps: int) -> bool:
+        if self.rate is None:
+            return False
+        try:
+            self.rate.set_property("max-rate", max(1, int(fps)))
+            return True
+        except Exception as e:
+            LOG.warning("Failed set max framerate: %s", e)
+            return False
+
+    # ---- orientation ----
+    def _apply_sensor_orientation(self, src: Gst.Element) -> tuple:
+        """Hand mirror/180° to the sensor when asked to and libcamerasrc supports it."""
+        want = _orientation(self.cfg.video.mirror, self.cfg.video.rotate)
+        if not self.cfg.video.sensor_orientation or src.find_property("orientation") is None:
+            return (0, 0)
+        # Sensor takes the flips and 180°; an odd quarter-turn is left to videoflip
+        sensor = (want[0] & 2, want[1])
+        try:
+            Gst.util_set_object_arg(src, "orientation", _SENSOR_NICKS[sensor])
+        except Exception as e:
+            LOG.info("libcamerasrc orientation not usable (%s); flipping in software", e)
+            return (0, 0)
+        LOG.info("Sensor orientation: %s", _SENSOR_NICKS[sensor])
+        return sensor
+
+    def _residual(self) -> tuple:
+        """What videoflip still has to do on top of the sensor's transform."""
+        want = _orientation(self.cfg.video.mirror, self.cfg.video.rotate)
+        return _compose(want, _inverse(self._sensor_orient))
+
+    def _set_direction(self) -> bool:
+        if self.vflip is None:
+            return False
+        nick = _DIRECTION_NICKS[self._residual()]
+        try:
+            # videoflip switches itself to passthrough for "identity"
+            Gst.util_set_object_arg(self.vflip, "video-direction", nick)
+            return True
+        except Exception as e:
+            LOG.warning("Failed set video-direction %s: %s", nick, e)
+            return False
+
+    def orientation_passes(self) -> int:
+        """Full-frame copies spent on orientation per frame (0 or 1)."""
+        return 0 if self._residual() == (0, 0) else 1
+
+    def orientation_bytes_saved(self) -> int:
+        """I420 bytes per frame no longer copied compared to the old mirror → rotate pair at the same setting."""
+        v = self.cfg.video
+        saved = _two_pass_copies(v.mirror, v.rotate) - self.orientation_passes()
+        return max(0, saved) * (v.width * v.height * 3 // 2)
+
+    def apply_mirror(self, mirror: str) -> bool:
+        self.cfg = _with_video(self.cfg, mirror=mirror)
+        if self._set_direction():
+            LOG.info("Applied live mirror: %s (video-direction %s)", mirror, _DIRECTION_NICKS[self._residual()])
+            return True
+        return False
+
+    def apply_rotate(self, rotate: int) -> bool:
+        self.cfg = _with_video(self.cfg, rotate=int(rotate) if str(rotate).isdigit() else 0)
+        if self._set_direction():
+            LOG.info("Applied live rotate: %s (video-direction %s)", self.cfg.video.rotate, _DIRECTION_NICKS[self._residual()])
+            return True
+        return False
+
+_CAPTURES: Dict[str, CapturePipeline] = {}
+_CAPTURES_LOCK = threading.Lock()
+
+def _subscriber(capture: CapturePipeline):
+    """ConfigStore subscriber for one stream: hands it its own view and the diff of that view."""
+    def on_config(cfg: Config, _diff: ConfigDiff) -> Dict[str, int]:
+        try:
+            view = stream_config(cfg, capture.stream)
+        except KeyError:
+            return {}  # stream removed from config.yaml; its pipeline winds down with its viewers
+        diff = config_diff(capture.cfg, view)
+        return capture.on_config(view, diff) if diff else {}
+    return on_config
+
+def get_capture(cfg: Config, stream: Optional[str] = None) -> CapturePipeline:
+    """
+    Process-wide capture pipeline for a stream (None = the first configured). A stopped
+    pipeline picks up the latest config. Raises KeyError for unknown stream names.
+    """
+    name = cfg.stream(stream).name
+    view = stream_config(cfg, name)
+    with _CAPTURES_LOCK:
+        capture = _CAPTURES.get(name)
+        if capture is None:
+            capture = _CAPTURES[name] = CapturePipeline(view, name)
+            config_store().subscribe(_subscriber(capture))
+            return capture
+    if not capture.running:
+        capture.cfg = view
+    return capture
+
+def captures() -> List[CapturePipeline]:
+    """Every capture pipeline created so far (running or not)."""
+    with _CAPTURES_LOCK:
+        return list(_CAPTURES.values())
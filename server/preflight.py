@@ -0,0 +1,181 @@
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from .config import CFG_DIR, Config
+
+LOG = logging.getLogger("preflight")
+
+CACHE_PATH = CFG_DIR / "preflight.json"
+
+# (element, apt package) the pipeline cannot run without
+REQUIRED: Tuple[Tuple[str, str], ...] = (
+    ("capsfilter", "libgstreamer1.0-0"), ("tee", "libgstreamer1.0-0"), ("queue", "libgstreamer1.0-0"),
+    ("fakesink", "libgstreamer1.0-0"), ("identity", "libgstreamer1.0-0"),
+    ("videoconvert", "gstreamer1.0-plugins-base"), ("videorate", "gstreamer1.0-plugins-base"),
+    ("appsink", "gstreamer1.0-plugins-base"),
+    ("videoflip", "gstreamer1.0-plugins-good"), ("vp8enc", "gstreamer1.0-plugins-good"),
+    ("rtpvp8pay", "gstreamer1.0-plugins-good"),
+    ("webrtcbin", "gstreamer1.0-plugins-bad"), ("dtlssrtpenc", "gstreamer1.0-plugins-bad"),
+    ("srtpenc", "gstreamer1.0-plugins-bad"), ("nicesrc", "gstreamer1.0-nice"),
+)
+# Features that degrade gracefully when their element is missing
+OPTIONAL: Tuple[Tuple[str, str], ...] = (
+    ("v4l2convert", "gstreamer1.0-plugins-good"),        # hardware convert; falls back to videoconvert
+    ("v4l2h264enc", "gstreamer1.0-plugins-good"), ("openh264enc", "gstreamer1.0-plugins-bad"),
+    ("x264enc", "gstreamer1.0-plugins-ugly"),
+    ("h264parse", "gstreamer1.0-plugins-bad"), ("rtph264pay", "gstreamer1.0-plugins-good"),
+    ("jpegenc", "gstreamer1.0-plugins-good"),            # /api/snapshot.jpg
+    ("overlaycomposition", "gstreamer1.0-plugins-base"),  # overlay
+    ("webmmux", "gstreamer1.0-plugins-good"), ("matroskamux", "gstreamer1.0-plugins-good"),  # recordings
+)
+SOURCES = {"libcamera": ("libcamerasrc", "gstreamer1.0-libcamera"), "test": ("videotestsrc", "gstreamer1.0-plugins-base")}
+
+_INIT_LOCK = threading.Lock()
+
+def gst_init() -> None:
+    """Initialize GStreamer once (scans the plugin registry). Idempotent and thread-safe."""
+    with _INIT_LOCK:
+        if not Gst.is_initialized():
+            Gst.init(None)
+
+def requirements(cfg: Config) -> List[Tuple[str, str, bool]]:
+    """(element, package, required) for this config: the core set plus every stream's source."""
+    out = [(e, pkg, True) for e, pkg in REQUIRED]
+    for name in cfg.stream_names():
+        e, pkg = SOURCES[cfg.stream(name).video.source]
+        if all(e != r[0] for r in out):
+            out.append((e, pkg, True))
+    return out + [(e, pkg, False) for e, pkg in OPTIONAL]
+
+def _registry_stamp() -> List[Tuple[str, int, int]]:
+    """mtime/size of the plugin registry cache; GStreamer rewrites it when plugins change."""
+    paths = [os.environ.get("GST_REGISTRY_1_0") or os.environ.get("GST_REGISTRY") or ""]
+    cache = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    paths += glob.glob(os.path.join(cache, "gstreamer-1.0", "registry.*.bin"))
+    out = []
+    for p in filter(None, paths):
+        try:
+            st = os.stat(p)
+        except OSError:
+            continue
+        out.append((p, st.st_mtime_ns, st.st_size))
+    return sorted(out)
+
+def check_element(name: str) -> Dict[str, Any]:
+    """Find the factory and load its plugin (catches plugins that are registered but broken)."""
+    f = Gst.ElementFactory.find(name)
+    if f is None:
+        return {"found": False, "loaded": False, "plugin": None}
+    plugin = f.get_plugin_name()
+    loaded = f.load()
+    return {"found": True, "loaded": loaded is not None, "plugin": plugin}
+
+class Preflight:
+    """
+    Background GStreamer startup: Gst.init (the plugin registry scan) and a check that
+    every element the pipeline may build is present and loads. Loading plugins is the
+    slow part, so results are cached per (GStreamer version, registry file stamp) and
+    only re-checked after plugins are installed or removed. Read by GET /api/ready.
+    """
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self.status = "starting"       # starting → ready | degraded (required element missing) | failed
+        self.error: Optional[str] = None
+        self.init_ms: Optional[float] = None
+        self.check_ms: Optional[float] = None
+        self.cached = False
+        self.elements: Dict[str, Dict[str, Any]] = {}
+        self.missing: List[str] = []
+        self.missing_optional: List[str] = []
+        # Import → port bound, and import → preflight done (set by app)
+        self.listening_ms: Optional[float] = None
+        self.ready_ms: Optional[float] = None
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    @property
+    def ready(self) -> bool:
+        return self.status == "ready"
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._done.wait(timeout)
+
+    def run(self, cfg: Config) -> None:
+        """Blocking (run on a worker thread): init GStreamer, then check elements."""
+        reqs = requirements(cfg)
+        try:
+            t0 = time.monotonic()
+            gst_init()
+            t1 = time.monotonic()
+            self.init_ms = round((t1 - t0) * 1000.0, 1)
+            results, self.cached = self._check(reqs)
+            self.check_ms = round((time.monotonic() - t1) * 1000.0, 1)
+        except Exception as e:
+            LOG.exception("GStreamer init failed")
+            with self._lock:
+                self.status, self.error = "failed", str(e)
+            self._done.set()
+            return
+        with self._lock:
+            self.elements = {e: {**results[e], "package": pkg, "required": req} for e, pkg, req in reqs}
+            self.missing = [e for e, _pkg, req in reqs if req and not results[e]["loaded"]]
+            self.missing_optional = [e for e, _pkg, req in reqs if not req and not results[e]["loaded"]]
+            self.status = "degraded" if self.missing else "ready"
+        self._done.set()
+        for e in self.missing:
+            LOG.error("GStreamer element %s missing (apt install %s)", e, self.elements[e]["package"])
+        if self.missing_optional:
+            LOG.info("Optional GStreamer elements not available: %s", ", ".join(self.missing_optional))
+        LOG.info("GStreamer %s ready: init %.0f ms, preflight %.0f ms%s", Gst.version_string(),
+                 self.init_ms, self.check_ms, " (cached)" if self.cached else "")
+
+    def _check(self, reqs: List[Tuple[str, str, bool]]) -> Tuple[Dict[str, Dict[str, Any]], bool]:
+        key = {"gst": Gst.version_string(), "registry": [list(s) for s in _registry_stamp()]}
+        try:
+            cache = json.loads(self.path.read_text())
+        except Exception:
+            cache = {}
+        hit = cache.get("elements", {}) if cache.get("key") == key else {}
+        if all(e in hit for e, _pkg, _req in reqs):
+            return hit, True
+        results = {e: hit.get(e) or check_element(e) for e, _pkg, _req in reqs}
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(".tmp")
+            tmp.write_text(json.dumps({"key": key, "elements": {**hit, **results}}, indent=2))
+            tmp.replace(self.path)
+        except Exception as e:
+            LOG.warning("preflight cache write failed: %s", e)
+        return results, False
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "status": self.status,
+                "ready": self.ready,
+                "error": self.error,
+                "gstreamer": Gst.version_string() if Gst.is_initialized() else None,
+                "gst_init_ms": self.init_ms,
+                "preflight_ms": self.check_ms,
+                "preflight_cached": self.cached,
+                "listening_ms": self.listening_ms,
+                "ready_ms": self.ready_ms,
+                "missing": list(self.missing),
+                "missing_optional": list(self.missing_optional),
+                "elements": dict(self.elements),
+            }
+
+PREFLIGHT = Preflight()
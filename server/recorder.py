@@ -0,0 +1,253 @@
+import logging
+import queue
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from .config import DEFAULT_STREAM, ROOT, RecordingConfig
+
+LOG = logging.getLogger("recorder")
+
+MAX_PRE_ROLL_S = 60.0
+MAX_POST_ROLL_S = 300.0
+_SAFE = re.compile(r"[^A-Za-z0-9_.-]+")
+
+# (pts, buffer, is_keyframe)
+Frame = Tuple[int, Gst.Buffer, bool]
+
+@dataclass
+class Clip:
+    name: str
+    pre_s: float
+    post_s: float
+    frames: List[Frame] = field(default_factory=list)
+    until_pts: int = 0
+    state: str = "recording"   # recording → writing → done | failed
+    bytes_written: int = 0
+
+def safe_name(name: str) -> Optional[str]:
+    """Basename-only, no traversal; None if the name isn't one we could have written."""
+    if not name or name != Path(name).name or name.startswith("."):
+        return None
+    return name if _SAFE.sub("", name) == name else None
+
+def _container(caps: Optional[Gst.Caps]) -> Tuple[str, str]:
+    """(file suffix, muxer chain) for the encoded caps on enc_tee."""
+    if caps is not None and caps.get_size() and caps.get_structure(0).get_name() == "video/x-h264":
+        return ".mkv", "h264parse ! matroskamux"
+    return ".webm", "webmmux"
+
+class EventRecorder:
+    """
+    Taps enc_tee (queue → appsink) and keeps the last pre_roll_s of *encoded* frames in
+    memory, trimmed on keyframe boundaries so every clip starts decodable. A trigger copies
+    the ring (pre-roll), keeps collecting for post_roll_s, then remuxes (VP8 into WebM,
+    H.264 into Matroska) on a single writer thread with a bytes/s cap. Nothing is re-encoded.
+    """
+    def __init__(self, cfg: RecordingConfig, stream: str = DEFAULT_STREAM):
+        self.cfg = cfg
+        self.stream = stream
+        self.appsink: Optional[Gst.Element] = None
+        self._ring: Deque[Frame] = deque()
+        self._caps: Optional[Gst.Caps] = None
+        self._clips: List[Clip] = []
+        self._lock = threading.Lock()
+        self._jobs: "queue.Queue[Tuple[Clip, Optional[Gst.Caps]]]" = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        self._handler: Optional[Tuple[Gst.Element, int]] = None
+
+    @property
+    def out_dir(self) -> Path:
+        d = Path(self.cfg.dir)
+        return d if d.is_absolute() else ROOT / d
+
+    def build(self, p: Gst.Pipeline, enc_tee: Gst.Element) -> Gst.Pad:
+        """Add qrec → recsink off enc_tee; returns the requested tee pad (the owner releases it)."""
+        q = Gst.ElementFactory.make("queue", "qrec")
+        q.set_property("leaky", 2); q.set_property("max-size-buffers", 0)
+        q.set_property("max-size-bytes", 0); q.set_property("max-size-time", Gst.SECOND)
+        sink = Gst.ElementFactory.make("appsink", "recsink")
+        for k, val in {"emit-signals": True, "sync": False, "async": False, "max-buffers": 4, "drop": True}.items():
+            sink.set_property(k, val)
+        self._handler = (sink, sink.connect("new-sample", self._on_sample))
+        p.add(q); p.add(sink)
+        if not q.link(sink):
+            raise RuntimeError("link qrec -> recsink failed")
+        tee_pad = enc_tee.get_request_pad("src_%u")
+        if tee_pad is None or tee_pad.link(q.get_static_pad("sink")) != Gst.PadLinkReturn.OK:
+            raise RuntimeError("link enc_tee -> qrec failed")
+        self.appsink = sink
+        return tee_pad
+
+    def reset(self) -> None:
+        """Pipeline torn down: the ring is no longer continuous, and open clips end early."""
+        if self._handler is not None:
+            sink, hid = self._handler
+            sink.disconnect(hid)
+            self._handler = None
+        with self._lock:
+            self.appsink = None
+            self._ring.clear()
+            for clip in self._clips:
+                if clip.state == "recording":
+                    self._finish(clip)
+
+    # ---- streaming thread ----
+    def _on_sample(self, sink):
+        sample = sink.emit("pull-sample")
+        if sample is None:
+            return Gst.FlowReturn.OK
+        buf = sample.get_buffer()
+        if buf is None or buf.pts == Gst.CLOCK_TIME_NONE:
+            return Gst.FlowReturn.OK
+        frame = (buf.pts, buf, not buf.has_flags(Gst.BufferFlags.DELTA_UNIT))
+        with self._lock:
+            self._caps = sample.get_caps()
+            self._ring.append(frame)
+            self._trim(buf.pts)
+            for clip in self._clips:
+                if clip.state != "recording":
+                    continue
+                if not clip.frames:
+                    if not frame[2]:
+                        continue  # triggered with nothing buffered: wait for a keyframe
+                    clip.until_pts = buf.pts + int(clip.post_s * Gst.SECOND)
+                clip.frames.append(frame)
+                if buf.pts >= clip.until_pts:
+                    self._finish(clip)
+        return Gst.FlowReturn.OK
+
+    def _trim(self, newest: int) -> None:
+        cutoff = newest - int(min(self.cfg.pre_roll_s, MAX_PRE_ROLL_S) * Gst.SECOND)
+        while True:
+            # Drop the leading GOP once the *next* keyframe is already older than the cutoff
+            nxt = next((i for i, f in enumerate(self._ring) if i > 0 and f[2]), None)
+            if nxt is None or self._ring[nxt][0] > cutoff:
+                break
+            for _ in range(nxt):
+                self._ring.popleft()
+        while self._ring and not self._ring[0][2]:
+            self._ring.popleft()  # never start on a delta frame
+
+    # ---- triggers ----
+    def trigger(self, label: str = "", pre_s: Optional[float] = None, post_s: Optional[float] = None) -> Clip:
+        """Start a clip; pre_s is capped at what the ring holds (clip.pre_s is the effective value)."""
+        ring_s = min(self.cfg.pre_roll_s, MAX_PRE_ROLL_S)
+        pre = ring_s if pre_s is None else min(ring_s, max(0.0, float(pre_s)))
+        post = min(MAX_POST_ROLL_S, self.cfg.post_roll_s if post_s is None else max(0.0, float(post_s)))
+        tag = _SAFE.sub("_", label)[:40].strip("_")
+        with self._lock:
+            if self.appsink is None:
+                raise RuntimeError("pipeline not running")
+            # Streams share the recordings dir; clips from extra streams carry the stream name
+            prefix = "" if self.stream == DEFAULT_STREAM else _SAFE.sub("_", self.stream) + "-"
+            name = self._unique_name(prefix + time.strftime("%Y%m%d-%H%M%S") + (f"-{tag}" if tag else ""),
+                                     _container(self._caps)[0])
+            if not self._ring and post <= 0:
+                raise RuntimeError("no frames buffered yet")
+            # The ring always starts on a keyframe (see _trim). When it is empty the clip
+            # starts, and its post-roll is timed, from the first keyframe that arrives.
+            newest = self._ring[-1][0] if self._ring else 0
+            start = newest - int(pre * Gst.SECOND)
+            # Latest keyframe at or before the requested start, so the clip decodes from frame 0
+            frames = list(self._ring)
+            first = 0
+            for i, f in enumerate(frames):
+                if f[2] and f[0] <= start:
+                    first = i
+            clip = Clip(name=name, pre_s=pre, post_s=post, frames=frames[first:],
+                        until_pts=newest + int(post * Gst.SECOND))
+            self._clips.append(clip)
+            if post <= 0:
+                self._finish(clip)
+        LOG.info("Recording %s (pre %.1fs, post %.1fs)", name, pre, post)
+        return clip
+
+    def _unique_name(self, stem: str, suffix: str) -> str:
+        """stem+suffix, or stem-2, stem-3… if a clip of that name is on disk or still being made."""
+        taken = {c.name for c in self._clips if c.state in ("recording", "writing")}
+        name, n = stem + suffix, 1
+        while name in taken or (self.out_dir / name).exists():
+            n += 1
+            name = f"{stem}-{n}{suffix}"
+        return name
+
+    def _finish(self, clip: Clip) -> None:
+        clip.state = "writing"
+        self._jobs.put((clip, self._caps))
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._write_loop, name="rec-writer", daemon=True)
+            self._writer.start()
+
+    # ---- writer thread ----
+    def _write_loop(self) -> None:
+        while True:
+            clip, caps = self._jobs.get()
+            try:
+                self._write(clip, caps)
+                clip.state = "done"
+                LOG.info("Saved %s (%d frames, %d bytes)", clip.name, len(clip.frames), clip.bytes_written)
+            except Exception as e:
+                clip.state = "failed"
+                LOG.warning("Recording %s failed: %s", clip.name, e)
+            finally:
+                clip.frames = []
+                with self._lock:
+                    self._clips = [c for c in self._clips if c.state in ("recording", "writing")] + \
+                                  [c for c in self._clips if c.state in ("done", "failed")][-20:]
+
+    def _write(self, clip: Clip, caps: Optional[Gst.Caps]) -> None:
+        if not clip.frames or caps is None:
+            raise RuntimeError("no frames")
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        final = self.out_dir / clip.name
+        tmp = final.with_suffix(".part")
+        p = Gst.parse_launch(f"appsrc name=src format=time ! {_container(caps)[1]} name=mux ! filesink name=sink")
+        src = p.get_by_name("src")
+        src.set_property("caps", caps)
+        p.get_by_name("sink").set_property("location", str(tmp))
+        p.set_state(Gst.State.PLAYING)
+        try:
+            limit = max(1, int(self.cfg.max_write_kib_s)) * 1024
+            base = clip.frames[0][0]
+            t0 = time.monotonic()
+            for pts, buf, _key in clip.frames:
+                out = buf.copy()  # shallow: shares memory, only timestamps change
+                out.pts = pts - base
+                out.dts = Gst.CLOCK_TIME_NONE
+                if src.emit("push-buffer", out) != Gst.FlowReturn.OK:
+                    raise RuntimeError("push-buffer failed")
+                clip.bytes_written += buf.get_size()
+                # Bounded write bandwidth: never run ahead of limit bytes/s
+                ahead = clip.bytes_written / limit - (time.monotonic() - t0)
+                if ahead > 0:
+                    time.sleep(ahead)
+            src.emit("end-of-stream")
+            msg = p.get_bus().timed_pop_filtered(10 * Gst.SECOND, Gst.MessageType.EOS | Gst.MessageType.ERROR)
+            if msg is None or msg.type == Gst.MessageType.ERROR:
+                raise RuntimeError(msg.parse_error()[0].message if msg else "mux EOS timeout")
+        finally:
+            p.set_state(Gst.State.NULL)
+        tmp.replace(final)
+
+    # ---- listing ----
+    def summary(self) -> Dict[str, Any]:
+        files = []
+        if self.out_dir.exists():
+            clips = [f for f in self.out_dir.iterdir() if f.suffix in (".webm", ".mkv")]
+            for f in sorted(clips, key=lambda x: x.stat().st_mtime, reverse=True):
+                st = f.stat()
+                files.append({"name": f.name, "size": st.st_size, "mtime": st.st_mtime})
+        with self._lock:
+            active = [{"name": c.name, "state": c.state, "frames": len(c.frames)} for c in self._clips
+                      if c.state in ("recording", "writing")]
+            ring_s = (self._ring[-1][0] - self._ring[0][0]) / Gst.SECOND if len(self._ring) > 1 else 0.0
+        return {"enabled": self.cfg.enabled, "ring_seconds": round(ring_s, 2), "active": active, "files": files}
@@ -0,0 +1,167 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GstVideo', '1.0')
+from gi.repository import Gst, GstVideo
+
+try:
+    import numpy as np
+except ImportError:  # apt install python3-numpy
+    np = None
+
+from .config import SceneConfig
+from .metrics import Histogram
+
+LOG = logging.getLogger("scene")
+
+# Mean absolute luma difference (0–255) on the downsampled plane
+SCORE_BUCKETS = (0.25, 0.5, 1.0, 1.5, 2.0, 3.0, 5.0, 8.0, 12.0, 20.0, 40.0)
+RECENT_SCORES = 200
+
+class SceneGate:
+    """
+    Buffer probe on rate's src pad (just before qenc) that skips encoding a static scene.
+
+    Each frame's Y plane is viewed in place through the mapped buffer (np.frombuffer +
+    strided slicing, no copy) and sampled every `downsample` pixels. The score is the
+    mean absolute difference against the last frame that was let through, so slow drift
+    still adds up. Below `threshold` for longer than `settle_s`, only `floor_fps` frames
+    per second pass; the first frame at or above it passes immediately and restores the
+    full rate.
+    """
+    def __init__(self, cfg: SceneConfig):
+        self.cfg = cfg
+        self._lock = threading.Lock()
+        self._pad: Optional[Gst.Pad] = None
+        self._probe: Optional[int] = None
+        self._vinfo: Optional[GstVideo.VideoInfo] = None
+        self._ref = None
+        self._last_motion = 0.0
+        self._last_pass = 0.0
+        self.frames = 0
+        self.skipped = 0
+        self.static = False
+        self.last_score = 0.0
+        self.scores = Histogram(SCORE_BUCKETS)
+        self._recent: deque = deque(maxlen=RECENT_SCORES)
+
+    @property
+    def available(self) -> bool:
+        return np is not None
+
+    def attach(self, pad: Gst.Pad) -> None:
+        if not self.available:
+            LOG.warning("Scene gate disabled: numpy missing (apt install python3-numpy)")
+            return
+        self._pad = pad
+        self._probe = pad.add_probe(Gst.PadProbeType.BUFFER | Gst.PadProbeType.EVENT_DOWNSTREAM, self._on_probe)
+
+    def detach(self) -> None:
+        if self._pad is not None and self._probe is not None:
+            try: self._pad.remove_probe(self._probe)
+            except Exception: pass
+        self._pad = None
+        self._probe = None
+        with self._lock:
+            self._vinfo = None
+            self._ref = None
+            self.static = False
+
+    # ---- streaming thread ----
+    def _on_probe(self, _pad, info):
+        if info.type & Gst.PadProbeType.EVENT_DOWNSTREAM:
+            evt = info.get_event()
+            if evt is not None and evt.type == Gst.EventType.CAPS:
+                vinfo = GstVideo.VideoInfo.new_from_caps(evt.parse_caps())
+                with self._lock:
+                    self._vinfo = vinfo
+                    self._ref = None  # new geometry: next frame becomes the reference
+            return Gst.PadProbeReturn.OK
+        buf = info.get_buffer()
+        if buf is None or self._vinfo is None:
+            return Gst.PadProbeReturn.OK
+        return Gst.PadProbeReturn.OK if self._admit(buf) else Gst.PadProbeReturn.DROP
+
+    def _sample(self, buf: Gst.Buffer):
+        """Downsampled Y plane as int16 (the only copy: 1/downsample² of the luma)."""
+        vi, step = self._vinfo, max(1, int(self.cfg.downsample))
+        w, h, stride, offset = vi.width, vi.height, vi.stride[0], vi.offset[0]
+        ok, mapped = buf.map(Gst.MapFlags.READ)
+        if not ok:
+            return None
+        try:
+            y = np.frombuffer(mapped.data, dtype=np.uint8, count=stride * h, offset=offset).reshape(h, stride)
+            return y[::step, :w:step].astype(np.int16)
+        finally:
+            buf.unmap(mapped)
+
+    def _admit(self, buf: Gst.Buffer) -> bool:
+        small = self._sample(buf)
+        now = time.monotonic()
+        with self._lock:
+            self.frames += 1
+            if small is None:
+                return True
+            if self._ref is None or self._ref.shape != small.shape:
+                self._ref, self._last_motion, self._last_pass = small, now, now
+                return True
+            score = float(np.abs(small - self._ref).mean())
+            self.last_score = score
+            self.scores.observe(score)
+            self._recent.append(score)
+            c = self.cfg
+            if score >= c.threshold:
+                if self.static:
+                    LOG.info("Scene motion (score %.2f): full frame rate", score)
+                self.static = False
+                self._last_motion = now
+            elif not self.static and now - self._last_motion >= c.settle_s:
+                self.static = True
+                LOG.info("Scene static for %.1fs: decimating to %g fps", c.settle_s, c.floor_fps)
+            if self.static and now - self._last_pass < 1.0 / max(0.1, c.floor_fps):
+                self.skipped += 1
+                return False
+            self._ref, self._last_pass = small, now
+            return True
+
+    # ---- exposition ----
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            recent = sorted(self._recent)
+            pct = lambda q: round(recent[min(len(recent) - 1, int(q * len(recent)))], 3) if recent else None
+            return {
+                "enabled": self.cfg.enabled,
+                "active": self._probe is not None,
+                "static": self.static,
+                "threshold": self.cfg.threshold,
+                "floor_fps": self.cfg.floor_fps,
+                "frames": self.frames,
+                "skipped": self.skipped,
+                "skip_ratio": round(self.skipped / self.frames, 4) if self.frames else 0.0,
+                "last_score": round(self.last_score, 3),
+                "recent_scores": {"p10": pct(0.10), "p50": pct(0.50), "p90": pct(0.90), "max": recent[-1] if recent else None},
+            }
+
+    def render(self) -> List[str]:
+        with self._lock:
+            lines = [
+                "# HELP revcam_scene_frames_total Frames scored by the static-scene gate.",
+                "# TYPE revcam_scene_frames_total counter",
+                f"revcam_scene_frames_total {self.frames}",
+                "# HELP revcam_scene_skipped_total Frames not encoded because the scene was static.",
+                "# TYPE revcam_scene_skipped_total counter",
+                f"revcam_scene_skipped_total {self.skipped}",
+                "# TYPE revcam_scene_static gauge",
+                f"revcam_scene_static {int(self.static)}",
+                "# TYPE revcam_scene_score gauge",
+                f"revcam_scene_score {self.last_score:.3f}",
+                "# HELP revcam_scene_score_distribution Change score per frame (mean abs luma diff).",
+                "# TYPE revcam_scene_score_distribution histogram",
+            ]
+            lines += self.scores.render("revcam_scene_score_distribution", {})
+        return lines
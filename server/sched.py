@@ -0,0 +1,167 @@
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from .config import SchedConfig
+
+LOG = logging.getLogger("sched")
+
+# Elements whose streaming threads carry the camera → encoder path. The qenc thread runs
+# the encoder (and spawns vp8enc's worker threads, which inherit its affinity and
+# priority); viewer queues (payload + DTLS/SRTP), qsnap and qrec stay on the app CPUs.
+MEDIA_ELEMENTS = ("src", "q1", "q2", "qenc")
+
+def supported() -> bool:
+    return hasattr(os, "sched_setaffinity") and hasattr(os, "setpriority")
+
+def _online_cpus() -> Set[int]:
+    try:
+        return set(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        return set(range(os.cpu_count() or 1))
+
+def cpu_sets(cfg: SchedConfig) -> Tuple[Set[int], Set[int]]:
+    """(media, app) CPU sets, clipped to CPUs this process may run on."""
+    online = _online_cpus()
+    media = set(cfg.media_cpus) & online
+    app = (set(cfg.app_cpus) & online) or (online - media) or online
+    return media, app
+
+def pin_process(cfg: SchedConfig) -> Optional[Set[int]]:
+    """
+    Move every thread that exists now to the app CPUs. Threads created later inherit
+    their creator's mask, so the asyncio loop, executor, GLib/signaling and webrtcbin
+    threads all stay there; ThreadScheduler moves only the media threads off it.
+    """
+    if not cfg.enabled or not supported():
+        return None
+    media, app = cpu_sets(cfg)
+    if not media:
+        LOG.warning("sched: none of media_cpus %s is available; profile not applied", cfg.media_cpus)
+        return None
+    for tid in os.listdir("/proc/self/task"):
+        try:
+            os.sched_setaffinity(int(tid), app)
+        except OSError as e:
+            LOG.warning("sched: could not pin thread %s: %s", tid, e)
+    LOG.info("sched: app threads on CPUs %s, media threads on %s", sorted(app), sorted(media))
+    return app
+
+class ThreadScheduler:
+    """
+    Applies the scheduling profile to a pipeline's streaming threads via STREAM_STATUS
+    messages. They are delivered as sync messages on the thread that is entering (or
+    leaving) the task, so that thread can set its own affinity and priority. Threads
+    come from a shared pool and may be reused for another element, so LEAVE restores
+    the app CPUs and default priority.
+    """
+    def __init__(self, cfg: SchedConfig):
+        self.cfg = cfg
+        self._lock = threading.Lock()
+        self._bus: Optional[Gst.Bus] = None
+        self._handler: Optional[int] = None
+        self._media: Set[int] = set()
+        self._app: Set[int] = set()
+        self.threads: Dict[int, Dict[str, Any]] = {}
+        self.denied: List[str] = []
+
+    @property
+    def active(self) -> bool:
+        return self._handler is not None
+
+    def attach(self, pipeline: Gst.Pipeline) -> None:
+        if not self.cfg.enabled:
+            return
+        if not supported():
+            LOG.warning("sched: thread affinity/priority not supported on this platform")
+            return
+        self._media, self._app = cpu_sets(self.cfg)
+        if not self._media:
+            return
+        bus = pipeline.get_bus()
+        bus.enable_sync_message_emission()
+        self._bus = bus
+        self._handler = bus.connect("sync-message::stream-status", self._on_status)
+
+    def detach(self) -> None:
+        if self._bus is not None:
+            if self._handler is not None:
+                self._bus.disconnect(self._handler)
+            self._bus.disable_sync_message_emission()
+        self._bus = None
+        self._handler = None
+        with self._lock:
+            self.threads.clear()
+
+    # ---- streaming threads ----
+    def _on_status(self, _bus, msg):
+        st, owner = msg.parse_stream_status()
+        name = owner.get_name() if owner is not None else ""
+        if name not in MEDIA_ELEMENTS:
+            return
+        if st == Gst.StreamStatusType.ENTER:
+            self._promote(name)
+        elif st == Gst.StreamStatusType.LEAVE:
+            self._demote()
+
+    def _promote(self, element: str) -> None:
+        tid, c = threading.get_native_id(), self.cfg
+        try:
+            os.sched_setaffinity(tid, self._media)
+        except OSError as e:
+            self._deny(f"affinity: {e}")
+        policy = "default"
+        if c.policy == "fifo":
+            try:
+                os.sched_setscheduler(tid, os.SCHED_FIFO, os.sched_param(c.fifo_priority))
+                policy = f"fifo:{c.fifo_priority}"
+            except (OSError, AttributeError) as e:
+                self._deny(f"SCHED_FIFO {c.fifo_priority}: {e}; using nice {c.nice}")
+        if policy == "default" and c.nice:
+            try:
+                os.setpriority(os.PRIO_PROCESS, tid, c.nice)
+                policy = f"nice:{c.nice}"
+            except OSError as e:
+                self._deny(f"nice {c.nice}: {e}")
+        with self._lock:
+            self.threads[tid] = {"element": element, "cpus": sorted(self._media), "policy": policy}
+        LOG.info("sched: %s streaming thread %d on CPUs %s (%s)", element, tid, sorted(self._media), policy)
+
+    def _demote(self) -> None:
+        tid = threading.get_native_id()
+        with self._lock:
+            info = self.threads.pop(tid, None)
+        if info is None:
+            return
+        try:
+            if info["policy"].startswith("fifo"):
+                os.sched_setscheduler(tid, os.SCHED_OTHER, os.sched_param(0))
+            os.setpriority(os.PRIO_PROCESS, tid, 0)
+            os.sched_setaffinity(tid, self._app)
+        except OSError as e:
+            LOG.warning("sched: could not restore thread %d: %s", tid, e)
+
+    def _deny(self, what: str) -> None:
+        with self._lock:
+            if what in self.denied:
+                return
+            self.denied.append(what)
+        LOG.warning("sched: not permitted: %s", what)
+
+    # ---- exposition ----
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.cfg.enabled,
+                "active": self.active,
+                "policy": self.cfg.policy,
+                "media_cpus": sorted(self._media),
+                "app_cpus": sorted(self._app),
+                "threads": [{"tid": t, **info} for t, info in self.threads.items()],
+                "denied": list(self.denied),
+            }
@@ -0,0 +1,153 @@
+import logging
+import threading
+import time
+import weakref
+from typing import Any, Dict, List
+
+from .metrics import Histogram
+
+LOG = logging.getLogger("sessions")
+
+# Seconds a viewer teardown took (unlink at the tee, bin → NULL, pads released)
+TEARDOWN_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0)
+
+def _proc_status() -> Dict[str, int]:
+    """VmRSS (bytes) and OS thread count from /proc/self/status; empty off Linux."""
+    out = {}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    out["rss_bytes"] = int(line.split()[1]) * 1024
+                elif line.startswith("Threads:"):
+                    out["threads"] = int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return out
+
+class SessionTracker:
+    """
+    Process-wide lifecycle accounting for viewer sessions and capture pipelines.
+
+    Every WebRTCBroadcaster is registered on creation and closed exactly once by its
+    stop(). Closed sessions stay in a WeakSet: a session whose Python object outlives
+    its teardown is still referenced somewhere (a signal handler, probe or pad), so a
+    growing `revcam_sessions_lingering` is the leak alarm, alongside RSS and threads.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active: Dict[str, Dict[str, Any]] = {}
+        self._closed: "weakref.WeakSet" = weakref.WeakSet()
+        self.opened_total = 0
+        self.closed_total = 0
+        self.unclean_total = 0
+        self.stop_timeouts_total = 0
+        self.pipelines_active = 0
+        self.pipelines_built_total = 0
+        self.teardown = Histogram(TEARDOWN_BUCKETS)
+
+    # ---- sessions ----
+    def opened(self, session: Any, kind: str, stream: str) -> None:
+        with self._lock:
+            self.opened_total += 1
+            self._active[session.name] = {"kind": kind, "stream": stream, "since": time.time(), "t0": time.monotonic()}
+
+    def set_kind(self, session: Any, kind: str) -> None:
+        with self._lock:
+            if session.name in self._active:
+                self._active[session.name]["kind"] = kind
+
+    def closed(self, session: Any, seconds: float, clean: bool) -> None:
+        with self._lock:
+            if self._active.pop(session.name, None) is None:
+                return
+            self.closed_total += 1
+            self.unclean_total += int(not clean)
+            self.teardown.observe(seconds)
+            self._closed.add(session)
+        if not clean:
+            LOG.warning("%s teardown unclean after %.2fs", session.name, seconds)
+
+    def stop_timed_out(self, name: str) -> None:
+        """The caller gave up waiting for a stop(); it may still finish in the background."""
+        with self._lock:
+            self.stop_timeouts_total += 1
+        LOG.warning("%s teardown still running; no longer waiting for it", name)
+
+    # ---- capture pipelines ----
+    def pipeline_started(self) -> None:
+        with self._lock:
+            self.pipelines_active += 1
+            self.pipelines_built_total += 1
+
+    def pipeline_stopped(self) -> None:
+        with self._lock:
+            self.pipelines_active = max(0, self.pipelines_active - 1)
+
+    # ---- exposition ----
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            active = [{"name": n, "kind": s["kind"], "stream": s["stream"], "since": s["since"], "age_s": round(now - s["t0"], 1)}
+                      for n, s in self._active.items()]
+            out = {
+                "active": active,
+                "opened_total": self.opened_total,
+                "closed_total": self.closed_total,
+                "unclean_total": self.unclean_total,
+                "stop_timeouts_total": self.stop_timeouts_total,
+                "lingering": len(self._closed),
+                "pipelines_active": self.pipelines_active,
+                "pipelines_built_total": self.pipelines_built_total,
+                "python_threads": threading.active_count(),
+            }
+        out.update(_proc_status())
+        return out
+
+    def render(self) -> List[str]:
+        s = self.snapshot()
+        with self._lock:
+            teardown = self.teardown.render("revcam_session_teardown_seconds", {})
+        lines = [
+            "# HELP revcam_sessions_active Viewer sessions currently open.",
+            "# TYPE revcam_sessions_active gauge",
+            f"revcam_sessions_active {len(s['active'])}",
+            "# HELP revcam_sessions_opened_total Viewer sessions created.",
+            "# TYPE revcam_sessions_opened_total counter",
+            f"revcam_sessions_opened_total {s['opened_total']}",
+            "# HELP revcam_sessions_closed_total Viewer sessions torn down.",
+            "# TYPE revcam_sessions_closed_total counter",
+            f"revcam_sessions_closed_total {s['closed_total']}",
+            "# HELP revcam_sessions_unclean_total Teardowns where the tee pad never went idle or the bin did not reach NULL.",
+            "# TYPE revcam_sessions_unclean_total counter",
+            f"revcam_sessions_unclean_total {s['unclean_total']}",
+            "# HELP revcam_session_stop_timeouts_total Teardowns the server stopped waiting for.",
+            "# TYPE revcam_session_stop_timeouts_total counter",
+            f"revcam_session_stop_timeouts_total {s['stop_timeouts_total']}",
+            "# HELP revcam_sessions_lingering Closed sessions still referenced (should stay near 0).",
+            "# TYPE revcam_sessions_lingering gauge",
+            f"revcam_sessions_lingering {s['lingering']}",
+            "# HELP revcam_session_teardown_seconds Time to tear one viewer session down.",
+            "# TYPE revcam_session_teardown_seconds histogram",
+            *teardown,
+            "# HELP revcam_pipelines_active Capture pipelines currently built.",
+            "# TYPE revcam_pipelines_active gauge",
+            f"revcam_pipelines_active {s['pipelines_active']}",
+            "# HELP revcam_pipelines_built_total Capture pipelines built since start.",
+            "# TYPE revcam_pipelines_built_total counter",
+            f"revcam_pipelines_built_total {s['pipelines_built_total']}",
+            "# HELP revcam_process_python_threads Python threads alive.",
+            "# TYPE revcam_process_python_threads gauge",
+            f"revcam_process_python_threads {s['python_threads']}",
+        ]
+        if "threads" in s:
+            lines += ["# HELP revcam_process_threads OS threads in the server process (GStreamer streaming threads included).",
+                      "# TYPE revcam_process_threads gauge",
+                      f"revcam_process_threads {s['threads']}"]
+        if "rss_bytes" in s:
+            lines += ["# HELP revcam_process_resident_memory_bytes Resident set size.",
+                      "# TYPE revcam_process_resident_memory_bytes gauge",
+                      f"revcam_process_resident_memory_bytes {s['rss_bytes']}"]
+        return lines
+
+SESSIONS = SessionTracker()
@@ -0,0 +1,136 @@
+import logging
+import os
+import threading
+import time
+from typing import Optional, Tuple
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GstVideo', '1.0')
+from gi.repository import Gst, GstVideo
+
+LOG = logging.getLogger("snapshot")
+
+# Keep frames flowing into the branch this long after the last request (covers 1 Hz pollers)
+ARM_SECONDS = 5.0
+# Max wait for a fresh frame when the branch was idle
+FIRST_FRAME_TIMEOUT = 1.0
+JPEG_TIMEOUT = 2.0
+# Many dashboards polling out of phase share one encode per interval
+MIN_ENCODE_INTERVAL = 0.2
+
+class SnapshotBranch:
+    """
+    Spare raw-tee branch: gate → queue(leaky, 1) → appsink(max-buffers=1, drop).
+
+    While nobody polls, a pad probe on the tee pad drops every buffer before it is queued,
+    so the branch costs one probe call per frame and wakes no thread. A request arms
+    it for ARM_SECONDS; the newest frame is JPEG-encoded on the caller's thread (never the
+    camera or encoder threads) and the bytes are cached until a newer frame arrives.
+    When the arm window closes, the gate pulls and drops the frame the appsink still
+    holds, so an idle branch keeps no buffer from the camera/convert pool.
+    """
+    def __init__(self):
+        self.appsink: Optional[Gst.Element] = None
+        self._armed_until = 0.0
+        self._held = False          # a frame may be sitting in qsnap/snapsink
+        self._token = os.urandom(3).hex()
+        self._seq = 0
+        self._jpeg: Optional[bytes] = None
+        self._jpeg_at = 0.0
+        self._encoding = False      # a poller is pulling/encoding (outside _lock)
+        self._lock = threading.Lock()
+        self.encodes = 0
+        self.requests = 0
+
+    def build(self, p: Gst.Pipeline, tee: Gst.Element) -> Gst.Pad:
+        """Add qsnap → snapsink off tee; returns the requested tee pad (the owner releases it)."""
+        q = Gst.ElementFactory.make("queue", "qsnap")
+        q.set_property("leaky", 2); q.set_property("max-size-buffers", 1)
+        q.set_property("max-size-bytes", 0); q.set_property("max-size-time", 0)
+        sink = Gst.ElementFactory.make("appsink", "snapsink")
+        for k, val in {"max-buffers": 1, "drop": True, "sync": False, "async": False,
+                       "emit-signals": False, "enable-last-sample": False}.items():
+            sink.set_property(k, val)
+        p.add(q); p.add(sink)
+        if not q.link(sink):
+            raise RuntimeError("link qsnap -> snapsink failed")
+        tee_pad = tee.get_request_pad("src_%u")
+        if tee_pad is None or tee_pad.link(q.get_static_pad("sink")) != Gst.PadLinkReturn.OK:
+            raise RuntimeError("link tee -> qsnap failed")
+        tee_pad.add_probe(Gst.PadProbeType.BUFFER, self._gate)
+        self.appsink = sink
+        return tee_pad
+
+    def reset(self) -> None:
+        with self._lock:
+            self.appsink = None
+            self._armed_until = 0.0
+            self._held = False
+            self._jpeg = None
+            self._jpeg_at = 0.0
+
+    def _gate(self, _pad, _info):
+        if time.monotonic() < self._armed_until:
+            self._held = True
+            return Gst.PadProbeReturn.OK
+        if self._held:
+            # First frames after the window: hand the held buffer back to the pool. Repeats
+            # until the sink is empty, in case qsnap was still delivering the last one.
+            sink = self.appsink
+            if sink is None or sink.try_pull_sample(0) is None:
+                self._held = False
+        return Gst.PadProbeReturn.DROP
+
+    def etag(self) -> str:
+        return f'"{self._token}-{self._seq}"'
+
+    def latest_jpeg(self) -> Optional[Tuple[str, bytes]]:
+        """
+        Blocking (run in an executor). Returns (etag, jpeg) or None when no frame is available.
+        Only the arm/cache bookkeeping holds _lock: the pull (up to FIRST_FRAME_TIMEOUT) and the
+        encode run outside it, so reset() on pipeline teardown and other pollers never wait on them.
+        """
+        with self._lock:
+            sink = self.appsink
+            if sink is None:
+                return None
+            self.requests += 1
+            now = time.monotonic()
+            was_armed = now < self._armed_until
+            self._armed_until = now + ARM_SECONDS
+            fresh = now - self._jpeg_at < MIN_ENCODE_INTERVAL
+            if self._jpeg is not None and ((was_armed and fresh) or self._encoding):
+                return self.etag(), self._jpeg  # recent enough, or another poller is on it
+            self._encoding = True
+        try:
+            if was_armed:
+                sample = sink.try_pull_sample(0)
+            else:
+                sink.try_pull_sample(0)  # whatever is left from the last armed period is stale
+                sample = sink.try_pull_sample(int(FIRST_FRAME_TIMEOUT * Gst.SECOND))
+            jpeg = self._encode(sample) if sample is not None else None
+            del sample  # don't hold a camera buffer longer than the encode
+        finally:
+            with self._lock:
+                self._encoding = False
+        with self._lock:
+            if jpeg is not None and self.appsink is sink:
+                self._seq += 1
+                self._jpeg = jpeg
+                self._jpeg_at = now
+            if self._jpeg is None:
+                return None
+            return self.etag(), self._jpeg
+
+    def _encode(self, sample: Gst.Sample) -> Optional[bytes]:
+        try:
+            out = GstVideo.video_convert_sample(sample, Gst.Caps.from_string("image/jpeg"), int(JPEG_TIMEOUT * Gst.SECOND))
+        except Exception as e:
+            LOG.warning("JPEG encode failed: %s", e)
+            return None
+        buf = out.get_buffer() if out is not None else None
+        if buf is None:
+            return None
+        self.encodes += 1
+        return buf.extract_dup(0, buf.get_size())
@@ -14,8 +14,16 @@
   });
   playBtn.onclick = async () => { try { await video.play(); log('manual play() OK'); } catch (e) { log('manual play() failed:', e?.message || e); } };
 
+  // ?stream=<name> picks one of the configured cameras (default: the first)
+  const stream = location.search;
+  // Reloads after a codec error ("retry") are capped per tab, and reset by a decoded frame
+  const RETRY_KEY = 'revcam-retries' + stream;
+  const MAX_RETRIES = 3;
+  const settingsLink = document.querySelector('a[href="/settings"]');
+  if (settingsLink) settingsLink.href += stream;
+
   (async () => {
-    const cfg = await fetch('/api/config').then(r => r.json()).catch(() => ({}));
+    const cfg = await fetch('/api/config' + stream).then(r => r.json()).catch(() => ({}));
     const iceServers = [];
     if (cfg.webrtc?.stun_servers?.length) iceServers.push({ urls: cfg.webrtc.stun_servers });
     if (cfg.webrtc?.turn) iceServers.push({ urls: cfg.webrtc.turn, username: cfg.webrtc.turn_username || undefined, credential: cfg.webrtc.turn_password || undefined });
@@ -33,10 +41,18 @@
     };
 
     const proto = location.protocol === 'https:' ? 'wss' : 'ws';
-    const ws = new WebSocket(`${proto}://${location.host}/ws`);
+    const ws = new WebSocket(`${proto}://${location.host}/ws${stream}`);
 
-    ws.onmessage = async (msg) => {
-      const data = JSON.parse(msg.data);
+    // Report the first decoded frame so the server can log join-to-first-frame time
+    const reportFirstFrame = () => {
+      sessionStorage.removeItem(RETRY_KEY);
+      if (ws.readyState === WebSocket.OPEN) ws.send(JSON.stringify({ type: 'first-frame' }));
+      log('first frame decoded');
+    };
+    if (video.requestVideoFrameCallback) video.requestVideoFrameCallback(() => reportFirstFrame());
+    else video.addEventListener('loadeddata', reportFirstFrame, { once: true });
+
+    const handle = async (data) => {
       if (data.type === 'offer') {
         // Server is the offerer
         await pc.setRemoteDescription({ type: 'offer', sdp: data.sdp });
@@ -47,9 +63,27 @@
       } else if (data.type === 'ice') {
         try { await pc.addIceCandidate({ candidate: data.candidate, sdpMLineIndex: data.sdpMLineIndex }); }
         catch (e) { log('addIce error', e?.message || e); }
+      } else if (data.type === 'error') {
+        // e.g. this browser can't decode the server's codec; the server picks another for the next session
+        log('server error:', data.reason, data.codec || '');
+        const tries = Number(sessionStorage.getItem(RETRY_KEY) || 0);
+        if (data.retry && tries < MAX_RETRIES) {
+          sessionStorage.setItem(RETRY_KEY, String(tries + 1));
+          setTimeout(() => location.reload(), 1500);
+        } else if (data.retry) {
+          log('giving up after', tries, 'retries; reload to try again');
+          sessionStorage.removeItem(RETRY_KEY);
+        }
       }
     };
 
+    // The server batches signaling bursts into one frame; handle them in order
+    ws.onmessage = async (msg) => {
+      const data = JSON.parse(msg.data);
+      if (data.type === 'batch') { for (const m of data.messages || []) await handle(m); }
+      else await handle(data);
+    };
+
     ws.onerror = (e) => log('ws error', e?.message || e);
     ws.onclose = () => log('ws closed');
     window._pc = pc;
@@ -5,7 +5,7 @@
   const toList = s => s.split(',').map(x=>x.trim()).filter(Boolean);
 
   async function load(){
-    const r = await fetch('/api/config');
+    const r = await fetch('/api/config' + location.search);
     const cfg = await r.json();
     document.getElementById('width').value = cfg.video.width;
     document.getElementById('height').value = cfg.video.height;
@@ -41,7 +41,7 @@
         port: +document.getElementById('port').value,
       }
     };
-    const r = await fetch('/api/config', {method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify(body)});
+    const r = await fetch('/api/config' + location.search, {method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify(body)});
     const ok = (await r.json()).ok;
     setStatus(ok ? 'saved' : 'error');
   });
@@ -1,5 +1,8 @@
 import logging
-from typing import Callable, Optional, Dict, Any
+import re
+import threading
+import time
+from typing import Callable, Optional, Dict, Any, List
 
 import gi
 gi.require_version('Gst', '1.0')
@@ -7,35 +10,110 @@ gi.require_version('GstWebRTC', '1.0')
 gi.require_version('GstSdp', '1.0')
 from gi.repository import Gst, GstWebRTC, GstSdp
 
-from .overlay import make_overlay_element
 from .config import Config
+from .encoders import EncoderSpec
+from .glib_loop import glib_loop
+from .pipeline import DETACH_TIMEOUT, CapturePipeline, _link, _set_null
+from .sessions import SESSIONS
 
-Gst.init(None)
 LOG = logging.getLogger("webrtc")
 
-def _mirror_to_method(mirror: str) -> str:
-    m = (mirror or "none").lower()
-    return {"none":"none","horizontal":"horizontal-flip","vertical":"vertical-flip"}.get(m, "none")
-
-def _rotate_to_method(r: int) -> str:
-    try: r = int(r)
-    except Exception: r = 0
-    return {0:"none", 90:"rotate-90", 180:"rotate-180", 270:"rotate-270"}.get(r, "none")
-
-def _link(a, b, label=""):
-    if not a.link(b):
-        raise RuntimeError(f"Failed to link {a.name} -> {b.name} ({label})")
+def sdp_codecs(sdp_text: str) -> List[str]:
+    """Encoding names in the video m-section(s) of an SDP, skipping rejected (port 0) ones."""
+    codecs, in_video = [], False
+    for line in (sdp_text or "").splitlines():
+        line = line.strip()
+        if line.startswith("m="):
+            parts = line[2:].split()
+            in_video = len(parts) > 1 and parts[0] == "video" and parts[1] != "0"
+        elif in_video and line.startswith("a=rtpmap:") and " " in line:
+            enc = line.split(None, 1)[1].split("/")[0].upper()
+            if enc not in codecs:
+                codecs.append(enc)
+    return codecs
+
+def sdp_mids(sdp_text: str) -> Dict[str, int]:
+    """a=mid value → m-line index, for mapping trickled candidates onto the offer's sections."""
+    mids, mline = {}, -1
+    for line in (sdp_text or "").splitlines():
+        line = line.strip()
+        if line.startswith("m="):
+            mline += 1
+        elif line.startswith("a=mid:") and mline >= 0:
+            mids[line[len("a=mid:"):]] = mline
+    return mids
+
+_RTPMAP = re.compile(r"^a=rtpmap:(\d+)\s+([A-Za-z0-9-]+)/90000", re.MULTILINE)
+_FMTP = re.compile(r"^a=fmtp:(\d+)\s+(.*)$", re.MULTILINE)
+
+def payload_type(sdp_text: str, codec: str) -> Optional[int]:
+    """
+    Peer's payload type for codec (WHEP peers pick their own PTs). For H.264 prefer a
+    packetization-mode=1 baseline entry, which is what the H.264 encoders here produce.
+    """
+    sdp_text = sdp_text or ""
+    pts = [int(m.group(1)) for m in _RTPMAP.finditer(sdp_text) if m.group(2).upper() == codec.upper()]
+    if not pts:
+        return None
+    if codec.upper() == "H264":
+        fmtp = {int(m.group(1)): m.group(2).lower() for m in _FMTP.finditer(sdp_text)}
+        for pt in pts:
+            f = fmtp.get(pt, "")
+            if "packetization-mode=1" in f and "profile-level-id=42" in f:
+                return pt
+    return pts[0]
+
+def _parse_sdp(sdp_text: str, sdp_type) -> GstWebRTC.WebRTCSessionDescription:
+    ok, sdp = GstSdp.SDPMessage.new()
+    if ok != GstSdp.SDPResult.OK: raise RuntimeError("SDPMessage.new failed")
+    if GstSdp.sdp_message_parse_buffer(sdp_text.encode(), sdp) != GstSdp.SDPResult.OK:
+        raise RuntimeError("SDP parse failed")
+    return GstWebRTC.WebRTCSessionDescription.new(sdp_type, sdp)
 
 class WebRTCBroadcaster:
-    """Zero 2W friendly — SOFTWARE VP8; server is SDP offerer. Supports independent mirror+rotate with live updates."""
-    def __init__(self, cfg: Config, send_json: Callable[[Dict[str, Any]], None]):
+    """
+    One viewer session: queue → rtp*pay → webrtcbin, attached to the shared CapturePipeline.
+    The payloader follows whichever codec the shared encoder produces (VP8 or H.264).
+    WebSocket viewers: server is SDP offerer (start → handle_answer). WHEP viewers: the peer
+    offers and start_answer() produces a non-trickle answer. Mirror/rotate act on the shared pipeline.
+    start/start_answer/handle_answer/add_ice are meant to run on the GLib loop thread
+    (glib_loop().run/call); send_json may be called from any thread.
+    """
+    _seq = 0
+
+    def __init__(self, cfg: Config, send_json: Callable[[Dict[str, Any]], None], capture: CapturePipeline,
+                 payload_type: int = 96, on_closed: Optional[Callable[[], None]] = None):
         self.cfg = cfg
         self._send_json = send_json
-        self.pipeline: Optional[Gst.Pipeline] = None
+        self.capture = capture
+        self.pt = int(payload_type)
+        self.spec: Optional[EncoderSpec] = None
+        self._offer_sdp: Optional[str] = None
+        self.mids: Dict[str, int] = {}      # WHEP: the offer's a=mid → m-line index
+        self._on_closed = on_closed
+        self._on_answer: Optional[Callable[[str], None]] = None
+        WebRTCBroadcaster._seq += 1
+        self.name = f"viewer{WebRTCBroadcaster._seq}"
+        self.bin: Optional[Gst.Bin] = None
         self.webrtc: Optional[Gst.Element] = None
         self._rtp_src_pad: Optional[Gst.Pad] = None
-        self.vflip_mirror: Optional[Gst.Element] = None
-        self.vflip_rotate: Optional[Gst.Element] = None
+        self._tee_pad: Optional[Gst.Pad] = None
+        self._send_pad: Optional[Gst.Pad] = None      # requested from webrtcbin
+        # Everything stop() must undo: (object, handler id) and (pad, probe id)
+        self._signals: List[tuple] = []
+        self._pay_probes = []
+        self._key_probe: Optional[tuple] = None
+        self._stop_lock = threading.Lock()
+        self._stopped = False
+        # Session timing (monotonic seconds): join → ICE/DTLS connected → first keyframe out → first decoded frame (client-reported)
+        self._t_join = time.monotonic()
+        self._t_connected: Optional[float] = None
+        self._t_first_key: Optional[float] = None
+        self._t_first_frame: Optional[float] = None
+        SESSIONS.opened(self, "ws", capture.stream)
+
+    def _connect(self, obj, signal: str, cb) -> None:
+        self._signals.append((obj, obj.connect(signal, cb)))
 
     def _on_webrtc_pad_added(self, _webrtc: Gst.Element, pad: Gst.Pad):
         name = pad.get_name()
@@ -63,54 +141,31 @@ class WebRTCBroadcaster:
             pass
         return None
 
-    def _make_vp8_chain(self, p: Gst.Pipeline):
-        v = self.cfg.video
-        enc = Gst.ElementFactory.make("vp8enc", "vp8enc")
-        if not enc:
-            raise RuntimeError("vp8enc not available (apt install gstreamer1.0-plugins-good)")
-        for k, val in {
-            "deadline": 1, "cpu-used": 8, "end-usage": 1,
-            "target-bitrate": int(v.bitrate), "error-resilient": 1,
-            "keyframe-max-dist": max(1, int(v.fps * 2)), "threads": 2
-        }.items():
-            try: enc.set_property(k, val)
-            except Exception: pass
-        pay = Gst.ElementFactory.make("rtpvp8pay", "pay"); pay.set_property("pt", 96)
-        rtpcapsf = Gst.ElementFactory.make("capsfilter", "rtpcaps")
-        rtpcapsf.set_property("caps", Gst.Caps.from_string(
-            "application/x-rtp,media=video,encoding-name=VP8,payload=96,clock-rate=90000"
-        ))
-        for e in [enc, pay, rtpcapsf]: p.add(e)
-        return enc, pay, rtpcapsf
-
-    def build_pipeline(self) -> None:
-        assert self.pipeline is None
-        v = self.cfg.video
-        p = Gst.Pipeline.new("rev-pipe")
-
-        src = Gst.ElementFactory.make("libcamerasrc", "src")
-        if not src:
-            raise RuntimeError("libcamerasrc missing (apt install gstreamer1.0-libcamera rpicam-apps)")
-
-        capsf = Gst.ElementFactory.make("capsfilter", "caps")
-        capsf.set_property("caps", Gst.Caps.from_string(
-            f"video/x-raw,format=I420,width={v.width},height={v.height},framerate={v.fps}/1"
-        ))
-
-        vconv = Gst.ElementFactory.make("v4l2convert", "vconv") or Gst.ElementFactory.make("videoconvert", "vconv")
-        self.vflip_mirror = Gst.ElementFactory.make("videoflip", "vflip_mirror")
-        self.vflip_mirror.set_property("method", _mirror_to_method(v.mirror))
+    def _rtp_caps(self) -> Gst.Caps:
+        return Gst.Caps.from_string(self.spec.rtp_caps(self.pt))
 
-        self.vflip_rotate = Gst.ElementFactory.make("videoflip", "vflip_rotate")
-        self.vflip_rotate.set_property("method", _rotate_to_method(v.rotate))
-
-        tee = Gst.ElementFactory.make("tee", "tee")
-        q1 = Gst.ElementFactory.make("queue", "q1"); q1.set_property("leaky", 2); q1.set_property("max-size-buffers", 2)
-        qenc = Gst.ElementFactory.make("queue", "qenc"); qenc.set_property("leaky", 2); qenc.set_property("max-size-buffers", 2)
-        overlay = make_overlay_element()
-        q2 = Gst.ElementFactory.make("queue", "q2")
-
-        enc, pay, rtpcapsf = self._make_vp8_chain(p)
+    def _make_payloader(self, b: Gst.Bin):
+        pay = self.spec.make_pay(self.pt)
+        rtpcapsf = Gst.ElementFactory.make("capsfilter", "rtpcaps")
+        rtpcapsf.set_property("caps", self._rtp_caps())
+        for e in [pay, rtpcapsf]: b.add(e)
+        return pay, rtpcapsf
+
+    def build_branch(self) -> None:
+        assert self.bin is None
+        b = Gst.Bin.new(self.name)
+
+        # Leaky so one slow viewer can never stall the shared encoder; the browser recovers with a PLI.
+        q = Gst.ElementFactory.make("queue", "qviewer")
+        q.set_property("leaky", 2); q.set_property("max-size-buffers", 0)
+        q.set_property("max-size-bytes", 0); q.set_property("max-size-time", 500 * Gst.MSECOND)
+        b.add(q)
+
+        pay, rtpcapsf = self._make_payloader(b)
+        pay_sink = pay.get_static_pad("sink")
+        self._key_probe = (pay_sink, pay_sink.add_probe(Gst.PadProbeType.BUFFER, self._on_first_keyframe))
+        if self.capture.cfg.metrics.enabled:
+            self._pay_probes = self.capture.metrics.attach_payloader(pay)
 
         webrtc = Gst.ElementFactory.make("webrtcbin", "webrtc")
         if not webrtc:
@@ -129,82 +184,155 @@ class WebRTCBroadcaster:
                 uri = f"{proto}://{w.turn_username}:{w.turn_password}@{rest}"
             webrtc.set_property("turn-server", uri)
 
-        # Add everything
-        for e in [src, capsf, vconv, self.vflip_mirror, self.vflip_rotate, tee, q1, overlay, q2, qenc, enc, pay, rtpcapsf, webrtc]:
-            p.add(e)
-
-        # Camera chain
-        _link(src, capsf, "src->caps")
-        _link(capsf, vconv, "caps->vconv")
-        _link(vconv, self.vflip_mirror, "vconv->mirror")
-        _link(self.vflip_mirror, self.vflip_rotate, "mirror->rotate")
-        _link(self.vflip_rotate, tee, "rotate->tee")
-
-        tee_src = tee.get_request_pad("src_%u")
-        if tee_src is None: raise RuntimeError("tee request pad failed")
-        q1_sink = q1.get_static_pad("sink")
-        if q1_sink is None: raise RuntimeError("q1 sink pad missing")
-        if tee_src.link(q1_sink) != Gst.PadLinkReturn.OK:
-            raise RuntimeError("link tee.src -> q1.sink failed")
-
-        _link(q1, overlay, "q1->overlay")
-        _link(overlay, q2, "overlay->q2")
-        _link(q2, qenc, "q2->qenc")
-        _link(qenc, enc, "qenc->enc")
-        _link(enc, pay, "enc->pay")
+        b.add(webrtc)
+        _link(q, pay, "qviewer->pay")
         _link(pay, rtpcapsf, "pay->rtpcaps")
+        b.add_pad(Gst.GhostPad.new("sink", q.get_static_pad("sink")))
 
         self._rtp_src_pad = rtpcapsf.get_static_pad("src")
-        webrtc.connect("pad-added", self._on_webrtc_pad_added)
+        self._connect(webrtc, "pad-added", self._on_webrtc_pad_added)
+        self._connect(webrtc, "on-ice-candidate", self._on_ice_candidate)
+        self._connect(webrtc, "notify::connection-state", self._on_connection_state)
+
+        self.bin = b
+
+    def _setup(self, peer_codecs: Optional[List[str]] = None) -> None:
+        """Build this viewer's branch and hang it off the shared encoder."""
+        self.capture.acquire(peer_codecs)
+        try:
+            self.spec = self.capture.encoder
+            if self._offer_sdp is not None:
+                pt = payload_type(self._offer_sdp, self.spec.codec)
+                if pt is None:
+                    raise RuntimeError(f"offer has no {self.spec.codec} video")
+                self.pt = pt
+            self.build_branch()
+            # Ensure sender pad exists
+            try:
+                self.webrtc.emit("add-transceiver", GstWebRTC.WebRTCRTPTransceiverDirection.SENDONLY, self._rtp_caps())
+                LOG.info("webrtcbin transceiver added (SENDONLY %s)", self.spec.codec)
+            except Exception as e:
+                LOG.info("add-transceiver not available/needed: %s", e)
 
-        # Bus + ICE
-        webrtc.connect("on-ice-candidate", self._on_ice_candidate)
-        bus = p.get_bus(); bus.add_signal_watch(); bus.connect("message", self._on_bus)
+            pad = self._request_any_send_sink(self.webrtc)
+            tmpl = pad.get_pad_template() if pad is not None else None
+            if tmpl is not None and tmpl.presence == Gst.PadPresence.REQUEST:
+                self._send_pad = pad
+            if pad and self._rtp_src_pad:
+                res = self._rtp_src_pad.link(pad)
+                LOG.info("Linked RTP -> %s: %s", pad.get_name(), res)
+            else:
+                LOG.info("No send sink pad available yet; waiting for pad-added…")
 
-        self.pipeline = p
+            self._tee_pad = self.capture.attach(self.bin)
+            self.capture.abr.register(self.name, self.webrtc)
+        except Exception:
+            # Undo whatever got as far as the pipeline before handing the capture back
+            try:
+                self.capture.abr.unregister(self.name)
+                if self._tee_pad is not None:
+                    self.capture.detach(self._tee_pad, self.bin)
+                elif self.bin is not None:
+                    _set_null(self.bin, DETACH_TIMEOUT)
+                if self._send_pad is not None and self.webrtc is not None:
+                    self.webrtc.release_request_pad(self._send_pad)
+            except Exception as e:
+                LOG.warning("%s setup cleanup failed: %s", self.name, e)
+            finally:
+                self.bin = None
+                self.webrtc = None
+                self._rtp_src_pad = None
+                self._send_pad = None
+                self._tee_pad = None
+                self.capture.release()
+            raise
 
     def start(self) -> None:
-        if self.pipeline is None:
-            self.build_pipeline()
-        # Ensure sender pad exists
-        try:
-            vp8_caps = Gst.Caps.from_string("application/x-rtp,media=video,encoding-name=VP8,clock-rate=90000,payload=96")
-            self.webrtc.emit("add-transceiver", GstWebRTC.WebRTCRTPTransceiverDirection.SENDONLY, vp8_caps)
-            LOG.info("webrtcbin transceiver added (SENDONLY VP8)")
-        except Exception as e:
-            LOG.info("add-transceiver not available/needed: %s", e)
-
-        pad = self._request_any_send_sink(self.webrtc)
-        if pad and self._rtp_src_pad:
-            res = self._rtp_src_pad.link(pad)
-            LOG.info("Linked RTP -> %s: %s", pad.get_name(), res)
-        else:
-            LOG.info("No send sink pad available yet; waiting for pad-added…")
-
-        ret = self.pipeline.set_state(Gst.State.PLAYING)
-        if ret == Gst.StateChangeReturn.FAILURE:
-            self.pipeline.set_state(Gst.State.NULL)
-            raise RuntimeError("pipeline PLAYING failed (vp8)")
-
-        # Offer
+        self._setup()
+        # Offer: the promise resolves on a webrtcbin thread; finish on the GLib loop
         def on_offer_created(promise, _):
             reply = promise.get_reply()
-            offer = reply.get_value("offer")
-            self.webrtc.emit("set-local-description", offer, Gst.Promise.new())
-            self._send_json({"type": "offer", "sdp": offer.sdp.as_text()})
-            LOG.info("Sent SDP offer")
+            offer = reply.get_value("offer") if reply is not None else None
+            if offer is None:
+                LOG.error("%s create-offer failed", self.name)
+                return
+            glib_loop().call(self._set_local_offer, offer)
         self.webrtc.emit("create-offer", None, Gst.Promise.new_with_change_func(on_offer_created, None))
 
+    def _set_local_offer(self, offer) -> None:
+        if self.webrtc is None:
+            return
+        self.webrtc.emit("set-local-description", offer, Gst.Promise.new())
+        self._send_json({"type": "offer", "sdp": offer.sdp.as_text()})
+        LOG.info("Sent SDP offer")
+
     def handle_answer(self, sdp_text: str) -> None:
         assert self.webrtc is not None
-        ok, sdp = GstSdp.SDPMessage.new()
-        if ok != GstSdp.SDPResult.OK: raise RuntimeError("SDPMessage.new failed")
-        if GstSdp.sdp_message_parse_buffer(sdp_text.encode(), sdp) != GstSdp.SDPResult.OK:
-            raise RuntimeError("SDP parse failed")
-        answer = GstWebRTC.WebRTCSessionDescription.new(GstWebRTC.WebRTCSDPType.ANSWER, sdp)
+        if self.spec.codec not in sdp_codecs(sdp_text):
+            # The browser can't decode what the shared encoder makes; have it pick again
+            # once this pipeline is free, and tell the client to come back if that helps.
+            LOG.warning("%s answer rejects %s", self.name, self.spec.codec)
+            retry = self.capture.encoder_rejected()
+            self._send_json({"type": "error", "reason": "codec", "codec": self.spec.codec, "retry": retry})
+            return
+        answer = _parse_sdp(sdp_text, GstWebRTC.WebRTCSDPType.ANSWER)
         self.webrtc.emit("set-remote-description", answer, Gst.Promise.new())
         LOG.info("Set remote ANSWER")
 
+    # ---- answerer mode (WHEP) ----
+    def start_answer(self, offer_sdp: str, on_answer: Callable[[str], None]) -> None:
+        """
+        Peer is the offerer. on_answer(sdp) fires once, after ICE gathering completes, so the
+        answer carries every local candidate and setup finishes in one HTTP round trip.
+        """
+        offer = _parse_sdp(offer_sdp, GstWebRTC.WebRTCSDPType.OFFER)
+        self._on_answer = on_answer
+        self._offer_sdp = offer_sdp
+        self.mids = sdp_mids(offer_sdp)
+        SESSIONS.set_kind(self, "whep")
+        self._setup(sdp_codecs(offer_sdp))
+        self._connect(self.webrtc, "notify::ice-gathering-state", self._on_gathering_state)
+        def on_remote_set(_promise, _):
+            glib_loop().call(self._create_answer)
+        self.webrtc.emit("set-remote-description", offer, Gst.Promise.new_with_change_func(on_remote_set, None))
+        LOG.info("%s set remote OFFER", self.name)
+
+    def _create_answer(self) -> None:
+        if self.webrtc is None:
+            return
+        def on_answer_created(promise, _):
+            reply = promise.get_reply()
+            answer = reply.get_value("answer") if reply is not None else None
+            if answer is None:
+                LOG.error("%s create-answer failed", self.name)
+                return
+            glib_loop().call(self._set_local_answer, answer)
+        self.webrtc.emit("create-answer", None, Gst.Promise.new_with_change_func(on_answer_created, None))
+
+    def _set_local_answer(self, answer) -> None:
+        if self.webrtc is None:
+            return
+        self.webrtc.emit("set-local-description", answer, Gst.Promise.new())
+        if self.webrtc.get_property("ice-gathering-state") == GstWebRTC.WebRTCICEGatheringState.COMPLETE:
+            self._deliver_answer()
+
+    def _on_gathering_state(self, webrtc, _pspec):
+        if webrtc.get_property("ice-gathering-state") == GstWebRTC.WebRTCICEGatheringState.COMPLETE:
+            glib_loop().call(self._deliver_answer)
+
+    def local_sdp(self) -> Optional[str]:
+        """Current local description (with whatever candidates have been gathered so far)."""
+        desc = self.webrtc.get_property("local-description") if self.webrtc is not None else None
+        return desc.sdp.as_text() if desc is not None else None
+
+    def _deliver_answer(self) -> None:
+        cb, sdp = self._on_answer, self.local_sdp()
+        if cb is None or sdp is None:
+            return
+        self._on_answer = None
+        cb(sdp)
+        LOG.info("%s sent SDP answer (ICE gathering complete)", self.name)
+
     def add_ice(self, candidate: str, sdp_mline_index: int) -> None:
         if self.webrtc:
             self.webrtc.emit("add-ice-candidate", int(sdp_mline_index), candidate)
@@ -212,45 +340,96 @@ class WebRTCBroadcaster:
     def _on_ice_candidate(self, _webrtc, mlineindex, candidate):
         self._send_json({"type": "ice", "candidate": candidate, "sdpMLineIndex": int(mlineindex)})
 
-    def _on_bus(self, _bus, msg):
-        t = msg.type
-        if t == Gst.MessageType.ERROR:
-            err, dbg = msg.parse_error()
-            LOG.error("GStreamer ERROR: %s (%s)", err, dbg)
-        elif t == Gst.MessageType.WARNING:
-            err, dbg = msg.parse_warning()
-            LOG.warning("GStreamer WARN: %s (%s)", err, dbg)
-        elif t == Gst.MessageType.EOS:
-            LOG.info("GStreamer EOS")
-
-    def stop(self) -> None:
+    # ---- time to first frame ----
+    def _ms_since_join(self, t: float) -> float:
+        return (t - self._t_join) * 1000.0
+
+    def _on_connection_state(self, webrtc, _pspec):
+        state = webrtc.get_property("connection-state")
+        LOG.info("%s connection-state: %s", self.name, state.value_nick)
+        if state == GstWebRTC.WebRTCPeerConnectionState.CONNECTED and self._t_connected is None:
+            self._t_connected = time.monotonic()
+            # Don't make the new peer wait up to keyframe-max-dist frames
+            self.capture.force_keyframe()
+            LOG.info("%s connected %.0f ms after join; forced keyframe", self.name, self._ms_since_join(self._t_connected))
+        elif state in (GstWebRTC.WebRTCPeerConnectionState.FAILED, GstWebRTC.WebRTCPeerConnectionState.CLOSED):
+            if self._on_closed is not None:
+                self._on_closed()
+
+    def _on_first_keyframe(self, _pad, info):
+        if self._t_connected is None:
+            return Gst.PadProbeReturn.OK
+        buf = info.get_buffer()
+        if buf is None or buf.has_flags(Gst.BufferFlags.DELTA_UNIT):
+            return Gst.PadProbeReturn.OK
+        self._t_first_key = time.monotonic()
+        LOG.info("%s first keyframe sent %.0f ms after join", self.name, self._ms_since_join(self._t_first_key))
+        self._key_probe = None
+        return Gst.PadProbeReturn.REMOVE
+
+    def mark_first_frame(self) -> None:
+        """Client reported its first decoded frame."""
+        if self._t_first_frame is not None:
+            return
+        self._t_first_frame = time.monotonic()
+        elapsed = self._t_first_frame - self._t_join
+        self.capture.metrics.observe_first_frame(elapsed)
+        LOG.info("%s join-to-first-decoded-frame: %.0f ms (connected %s ms, keyframe %s ms)", self.name, elapsed * 1000.0,
+                 f"{self._ms_since_join(self._t_connected):.0f}" if self._t_connected else "?",
+                 f"{self._ms_since_join(self._t_first_key):.0f}" if self._t_first_key else "?")
+
+    def stop(self) -> bool:
+        """
+        Tear the session down and release everything it took: ABR registration, probes,
+        signal handlers, the enc_tee pad, the webrtcbin request pad and the capture
+        reference. Idempotent and blocking (run it off the event loop and the GLib
+        thread); each wait inside is bounded by DETACH_TIMEOUT. Returns False if a wait
+        gave up, which is counted as an unclean teardown.
+        """
+        with self._stop_lock:
+            if self._stopped:
+                return True
+            self._stopped = True
+        t0 = time.monotonic()
+        clean = True
         try:
-            if self.pipeline:
-                self.pipeline.set_state(Gst.State.NULL)
+            # Handlers first: nothing may call back into this session while it winds down
+            for obj, hid in self._signals:
+                try: obj.disconnect(hid)
+                except Exception: pass
+            self._signals = []
+            probes = self._pay_probes + ([self._key_probe] if self._key_probe else [])
+            for pad, pid in probes:
+                try: pad.remove_probe(pid)
+                except Exception: pass
+            self._pay_probes = []
+            self._key_probe = None
+            if self.bin is None:
+                return clean  # _setup failed and already released the capture
+            self.capture.abr.unregister(self.name)
+            try:
+                if self._tee_pad is not None:
+                    clean = self.capture.detach(self._tee_pad, self.bin)
+                else:
+                    clean = _set_null(self.bin, DETACH_TIMEOUT)
+                if self._send_pad is not None and self.webrtc is not None:
+                    self.webrtc.release_request_pad(self._send_pad)
+            finally:
+                self.bin = None
+                self.webrtc = None
+                self._rtp_src_pad = None
+                self._send_pad = None
+                self._tee_pad = None
+                self._on_answer = None
+                self._on_closed = None
+                self.capture.release()
+            return clean
         finally:
-            self.pipeline = None
-            self.webrtc = None
-            self._rtp_src_pad = None
+            SESSIONS.closed(self, time.monotonic() - t0, clean)
 
-    # ---- live controls ----
+    # ---- live controls (shared by all viewers) ----
     def apply_mirror(self, mirror: str) -> bool:
-        self.cfg.video.mirror = mirror
-        if self.vflip_mirror:
-            try:
-                self.vflip_mirror.set_property("method", _mirror_to_method(mirror))
-                LOG.info("Applied live mirror: %s", mirror)
-                return True
-            except Exception as e:
-                LOG.warning("Failed apply mirror: %s", e)
-        return False
+        return self.capture.apply_mirror(mirror)
 
     def apply_rotate(self, rotate: int) -> bool:
-        self.cfg.video.rotate = int(rotate) if str(rotate).isdigit() else 0
-        if self.vflip_rotate:
-            try:
-                self.vflip_rotate.set_property("method", _rotate_to_method(self.cfg.video.rotate))
-                LOG.info("Applied live rotate: %s", self.cfg.video.rotate)
-                return True
-            except Exception as e:
-                LOG.warning("Failed apply rotate: %s", e)
-        return False
+        return self.capture.apply_rotate(rotate)
@@ -0,0 +1,21 @@
+import pytest
+
+pytest.importorskip("gi")
+
+from server.app import _etag_matches  # noqa: E402
+
+ETAG = '"a1b2c3-7"'
+
+@pytest.mark.parametrize("header, match", [
+    (None, False),
+    ("", False),
+    (ETAG, True),
+    ("W/" + ETAG, True),
+    ('"x-1", ' + ETAG, True),
+    ('"x-1",W/' + ETAG, True),
+    ("*", True),
+    ('"a1b2c3-77"', False),   # a longer tag containing ours is a different tag
+    ('"a1b2c3-7', False),
+])
+def test_if_none_match(header, match):
+    assert _etag_matches(header, ETAG) is match
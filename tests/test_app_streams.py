@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("gi")
+
+from aiohttp import web  # noqa: E402
+from aiohttp.test_utils import TestClient, TestServer  # noqa: E402
+
+from server import app as app_mod  # noqa: E402
+from server.config import Config, _from_dict  # noqa: E402
+
+class _Store:
+    def __init__(self, cfg: Config):
+        self.cfg = cfg
+
+    def get(self) -> Config:
+        return self.cfg
+
+def _get(monkeypatch, cfg: Config, path: str):
+    """GET path from an app serving only GET /api/config; returns (status, json or text)."""
+    monkeypatch.setattr(app_mod, "config_store", lambda: _Store(cfg))
+    async def _run():
+        app = web.Application()
+        app.router.add_get("/api/config", app_mod.get_config)
+        async with TestClient(TestServer(app)) as client:
+            resp = await client.get(path)
+            body = await resp.json() if resp.content_type == "application/json" else await resp.text()
+            return resp.status, body
+    return asyncio.run(_run())
+
+TWO = {
+    "video": {"width": 960, "height": 540, "source": "test"},
+    "streams": [{"name": "front"}, {"name": "rear", "video": {"width": 640, "height": 360}}],
+}
+
+def test_default_is_first_stream(monkeypatch):
+    status, body = _get(monkeypatch, _from_dict(TWO), "/api/config")
+    assert status == 200
+    assert body["stream"] == "front"
+    assert body["video"]["width"] == 960
+
+def test_stream_query_selects_stream(monkeypatch):
+    status, body = _get(monkeypatch, _from_dict(TWO), "/api/config?stream=rear")
+    assert status == 200
+    assert body["stream"] == "rear"
+    assert (body["video"]["width"], body["video"]["height"]) == (640, 360)
+
+def test_unknown_stream_is_404(monkeypatch):
+    status, body = _get(monkeypatch, _from_dict(TWO), "/api/config?stream=nope")
+    assert status == 404
+    assert "nope" in body
+
+def test_main_without_streams_section(monkeypatch):
+    assert _get(monkeypatch, Config(), "/api/config?stream=main")[1]["stream"] == "main"
+    assert _get(monkeypatch, Config(), "/api/config?stream=rear")[0] == 404
@@ -0,0 +1,49 @@
+import yaml
+
+from server import config
+from server.config import ConfigStore
+
+def _store(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "CFG_PATH", tmp_path / "config.yaml")
+    return ConfigStore()
+
+def _set_width(width):
+    def _mutate(cfg):
+        cfg.video.width = width
+    return _mutate
+
+def test_update_notifies_and_saves(monkeypatch, tmp_path):
+    store = _store(monkeypatch, tmp_path)
+    seen = []
+    store.subscribe(lambda cfg, diff: seen.append(diff) or {"width": 1})
+    cfg, diff, applied = store.update(_set_width(640))
+    assert cfg.video.width == 640 and store.get().video.width == 640
+    assert diff == {"video": {"width": 640}} and seen == [diff]
+    assert applied == {"width": 1}
+    assert yaml.safe_load((tmp_path / "config.yaml").read_text())["video"]["width"] == 640
+
+def test_subscriber_amendment_is_saved_and_notified(monkeypatch, tmp_path):
+    store = _store(monkeypatch, tmp_path)
+    old = store.get().video.width
+    seen = []
+    def undo(cfg):
+        if cfg.video.width == 320:
+            cfg.video.width = old
+    def sub(cfg, diff):
+        seen.append(diff)
+        if cfg.video.width == 320:
+            store.amend(undo)  # e.g. the camera would not take it
+        return {}
+    store.subscribe(sub)
+    cfg, diff, _applied = store.update(_set_width(320))
+    assert diff == {"video": {"width": 320}}  # what the caller asked for
+    assert cfg.video.width == old  # the snapshot after the amendment
+    assert store.get().video.width == old
+    assert seen == [{"video": {"width": 320}}, {"video": {"width": old}}]
+    assert yaml.safe_load((tmp_path / "config.yaml").read_text())["video"]["width"] == old
+
+def test_snapshots_are_not_shared(monkeypatch, tmp_path):
+    store = _store(monkeypatch, tmp_path)
+    before = store.get()
+    store.update(_set_width(640))
+    assert before.video.width != 640
@@ -0,0 +1,93 @@
+from server.config import (DEFAULT_STREAM, Config, _from_dict, all_media_cpus, config_diff,
+                           config_to_dict, stream_config)
+
+def _two_streams(**rear_video):
+    return _from_dict({
+        "video": {"width": 960, "height": 540, "fps": 25, "source": "test"},
+        "sched": {"media_cpus": [2, 3]},
+        "streams": [
+            {"name": "front"},
+            {"name": "rear", "video": {"width": 640, "height": 360, **rear_video}, "cpus": [3, 1]},
+        ],
+    })
+
+def test_no_streams_section_is_one_main_stream():
+    cfg = Config()
+    assert cfg.stream_names() == [DEFAULT_STREAM]
+    assert cfg.stream().name == DEFAULT_STREAM
+    assert cfg.stream(DEFAULT_STREAM).video is cfg.video
+    assert stream_config(cfg) is cfg
+    assert "streams" not in config_to_dict(cfg)
+
+def test_stream_lookup():
+    cfg = _two_streams()
+    assert cfg.stream_names() == ["front", "rear"]
+    assert cfg.stream().name == "front"  # None/empty = the first
+    assert cfg.stream("").name == "front"
+    for bad in ("nope", DEFAULT_STREAM):
+        try:
+            cfg.stream(bad)
+        except KeyError:
+            continue
+        raise AssertionError(f"{bad!r} should be unknown")
+
+def test_stream_video_inherits_top_level():
+    cfg = _two_streams()
+    front, rear = cfg.stream("front"), cfg.stream("rear")
+    assert (front.video.width, front.video.height, front.video.fps) == (960, 540, 25)
+    assert (rear.video.width, rear.video.height, rear.video.fps) == (640, 360, 25)
+    assert rear.video.source == "test"
+    assert rear.cpus == [1, 3]
+    assert all_media_cpus(cfg) == [1, 2, 3]
+
+def test_stream_config_view():
+    cfg = _two_streams()
+    front, rear = stream_config(cfg, "front"), stream_config(cfg, "rear")
+    assert front.video is cfg.stream("front").video
+    assert rear.video is cfg.stream("rear").video
+    assert front.sched is cfg.sched  # no per-stream CPUs: shares the section
+    assert rear.sched.media_cpus == [1, 3]
+    assert cfg.sched.media_cpus == [2, 3]  # the view's sched is a copy
+    assert rear.abr is cfg.abr
+
+def test_duplicate_stream_names_rejected():
+    try:
+        _from_dict({"streams": [{"name": "a"}, {"name": "a"}]})
+    except ValueError:
+        return
+    raise AssertionError("duplicate names should be rejected")
+
+def test_round_trip_writes_only_overrides():
+    cfg = _two_streams()
+    d = config_to_dict(cfg)
+    assert d["streams"] == [{"name": "front"},
+                            {"name": "rear", "video": {"width": 640, "height": 360}, "cpus": [1, 3]}]
+    again = _from_dict(d)
+    assert config_to_dict(again) == d
+    assert again.stream("rear").video == cfg.stream("rear").video
+
+def test_round_trip_follows_top_level_changes():
+    # A key a stream doesn't override tracks the top-level video section
+    d = config_to_dict(_two_streams())
+    d["video"]["fps"] = 15
+    cfg = _from_dict(d)
+    assert cfg.stream("front").video.fps == 15
+    assert cfg.stream("rear").video.fps == 15
+    assert cfg.stream("rear").video.width == 640
+
+def test_config_diff_per_stream():
+    old = _two_streams()
+    new = _two_streams(fps=10)
+    diff = config_diff(old, new)
+    assert set(diff) == {"streams"}
+    assert set(diff["streams"]) == {"rear"}
+    # Each pipeline diffs its own view: only rear's video changed
+    assert "video" not in config_diff(stream_config(old, "front"), stream_config(new, "front"))
+    assert config_diff(stream_config(old, "rear"), stream_config(new, "rear"))["video"] == {"fps": 10}
+
+def test_config_diff_removed_stream():
+    old = _two_streams()
+    d = config_to_dict(old)
+    d["streams"] = d["streams"][:1]
+    diff = config_diff(old, _from_dict(d))
+    assert diff == {"streams": {"rear": None}}
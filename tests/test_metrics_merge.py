@@ -0,0 +1,44 @@
+import pytest
+
+pytest.importorskip("gi")
+
+from server.metrics import PipelineMetrics, merge_expositions  # noqa: E402
+
+def _exposition(viewers: int, qenc_drops: int, join_s: float) -> str:
+    """Real PipelineMetrics output, the way CapturePipeline.render_metrics produces it."""
+    m = PipelineMetrics()
+    m.drops["qenc"] = qenc_drops
+    m.enc_bytes = 1000 * viewers
+    m.observe_first_frame(join_s)
+    return m.render({"revcam_viewers": viewers})
+
+def _types(text: str):
+    return [l for l in text.splitlines() if l.startswith("# TYPE ")]
+
+def test_one_header_per_family_and_stream_labels():
+    front, rear = _exposition(2, 5, 0.4), _exposition(0, 1, 1.2)
+    text = merge_expositions([({"stream": "front"}, front), ({"stream": "rear"}, rear)])
+    lines = text.splitlines()
+    # Same families, each declared once
+    assert _types(text) == _types(front)
+    assert len(set(_types(text))) == len(_types(text))
+    assert 'revcam_queue_dropped_total{stream="front",queue="qenc"} 5' in lines
+    assert 'revcam_queue_dropped_total{stream="rear",queue="qenc"} 1' in lines
+    assert 'revcam_encoder_bytes_total{stream="front"} 2000' in lines
+    assert 'revcam_viewers{stream="rear"} 0' in lines
+    assert 'revcam_join_to_first_frame_seconds_bucket{stream="front",le="0.5"} 1' in lines
+    assert 'revcam_join_to_first_frame_seconds_bucket{stream="rear",le="0.5"} 0' in lines
+    assert 'revcam_join_to_first_frame_seconds_count{stream="rear"} 1' in lines
+    # Every sample is labelled, and follows its family's header
+    samples = [l for l in lines if not l.startswith("#")]
+    assert all('stream="front"' in l or 'stream="rear"' in l for l in samples)
+    assert lines.index('revcam_queue_dropped_total{stream="rear",queue="qenc"} 1') < \
+        lines.index("# TYPE revcam_encoder_bytes_total counter")
+
+def test_single_stream_keeps_samples_unlabelled():
+    text = _exposition(1, 0, 0.3)
+    assert merge_expositions([({}, text)]) == text
+
+def test_label_values_are_escaped():
+    text = merge_expositions([({"stream": 'a"b'}, _exposition(1, 0, 0.3))])
+    assert 'revcam_viewers{stream="a\\"b"} 1' in text.splitlines()
@@ -0,0 +1,41 @@
+import time
+
+import pytest
+
+pytest.importorskip("gi")
+
+from gi.repository import Gst  # noqa: E402
+
+from server.config import _from_dict, stream_config  # noqa: E402
+from server.pipeline import CapturePipeline  # noqa: E402
+from server.preflight import gst_init  # noqa: E402
+
+gst_init()
+for _e in ("videotestsrc", "videoconvert", "videoflip", "vp8enc"):
+    if Gst.ElementFactory.find(_e) is None:
+        pytest.skip(f"{_e} not installed", allow_module_level=True)
+
+def test_two_test_streams_run_at_once():
+    cfg = _from_dict({
+        "video": {"width": 320, "height": 180, "fps": 15, "source": "test", "encoder": "vp8enc"},
+        "abr": {"enabled": False},
+        "metrics": {"enabled": True},
+        "standby": {"warm": False},
+        "recording": {"enabled": False},
+        "streams": [{"name": "a"}, {"name": "b", "video": {"width": 160, "height": 120, "camera": "snow"}}],
+    })
+    caps = [CapturePipeline(stream_config(cfg, n), n) for n in cfg.stream_names()]
+    try:
+        for c in caps:
+            c.acquire()
+        deadline = time.monotonic() + 10.0
+        while time.monotonic() < deadline and not all(c.metrics.enc_bytes > 0 for c in caps):
+            time.sleep(0.1)
+        assert all(c.running for c in caps)
+        assert all(c.metrics.enc_bytes > 0 for c in caps), [c.metrics.enc_bytes for c in caps]
+        assert caps[0].pipeline is not caps[1].pipeline
+        assert (caps[1].cfg.video.width, caps[1].cfg.video.height) == (160, 120)
+    finally:
+        for c in caps:
+            c.release()
+    assert not any(c.running for c in caps)